@@ -0,0 +1,119 @@
+"""
+batchstate.py - remember what a batch run has already done
+
+A batch of pages can be stopped part way or handed in again
+with a few pages changed. The state file (SQLite) keeps, for
+each page, the size/mtime/hash of the image and the hocr files
+along with the settings used and how it went, so a re-run only
+has to stat a few files to know a page is finished.
+
+Hashes are only worked out when a size or mtime doesn't match,
+so touching a file (or copying a batch around) doesn't send its
+pages through again unless the contents changed.
+"""
+
+import hashlib, json, os, sqlite3, time
+
+""" size, mtime and (lazily) hash of a file, None if it is missing """
+class file_info:
+    def __init__(self, path):
+        self.path = path
+        self.digest = None
+        try:
+            st = os.stat(path)
+            self.size = st.st_size
+            self.mtime = st.st_mtime_ns
+        except FileNotFoundError:
+            self.size = None
+            self.mtime = None
+
+    def exists(self):
+        return self.size is not None
+
+    def sha(self):
+        if self.digest is None and self.exists():
+            h = hashlib.sha256()
+            with open(self.path,'rb') as f:
+                for chunk in iter(lambda: f.read(1 << 20), b''):
+                    h.update(chunk)
+            self.digest = h.hexdigest()
+        return self.digest
+
+    def record(self):
+        return [self.size, self.mtime, self.sha()]
+
+""" check a file against what was recorded, only hash it if the stat is different """
+def sameFile(info,recorded):
+
+    if recorded is None or not info.exists():
+        return recorded is None and not info.exists()
+    size, mtime, digest = recorded
+    if info.size != size:
+        return False
+    if info.mtime == mtime:
+        return True
+
+    return info.sha() == digest
+
+""" batch_state - one row per page in an SQLite file """
+class batch_state:
+    def __init__(self, path):
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("""CREATE TABLE IF NOT EXISTS pages (
+            page TEXT PRIMARY KEY,
+            status TEXT,
+            params TEXT,
+            files TEXT,
+            added INTEGER,
+            error TEXT,
+            finished REAL)""")
+        self.db.commit()
+
+    def lookup(self, page):
+        row = self.db.execute("SELECT status, params, files FROM pages WHERE page = ?",
+            (os.path.abspath(page),)).fetchone()
+        if row is None:
+            return None
+        return row[0], row[1], json.loads(row[2])
+
+    """ True if the page finished with these params and none of its files changed """
+    def upToDate(self, page, params, files):
+        found = self.lookup(page)
+        if found is None:
+            return False
+        status, old_params, recorded = found
+        if status != 'done' or old_params != params:
+            return False
+        for name, info in files.items():
+            if not sameFile(info,recorded.get(name)):
+                return False
+
+        return True
+
+    def recorded(self, page, name):
+        found = self.lookup(page)
+        if found is None:
+            return None
+        return found[2].get(name)
+
+    def finish(self, page, params, files, added, error=None):
+        status = 'done' if error is None else 'failed'
+        self.db.execute("INSERT OR REPLACE INTO pages VALUES (?,?,?,?,?,?,?)",
+            (os.path.abspath(page),status,params,
+            json.dumps({name: info.record() if info.exists() else None
+                for name, info in files.items()}),
+            added,error,time.time()))
+        #commit every page so an interrupted run keeps what it finished
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+""" settings that change the output, as a string that can be compared """
+def paramString(args,names):
+
+    return json.dumps({name: getattr(args,name,None) for name in names},
+        sort_keys=True)
@@ -0,0 +1,255 @@
+"""
+benchmark.py - time hocrmod.py on synthetic pages
+
+Usage (see list of options):
+    benchmark.py [-h]
+
+For example:
+    benchmark.py
+    benchmark.py -d 300,600 -z letter -n 5 -o bench.json
+    benchmark.py --flags "-r -g -p"
+
+Pages are drawn with opencv: two columns of paragraphs,
+a base hocr file that matches them, a page number that
+is left out of the hocr (the missed region hocrmod is
+meant to find) and separator lines above the page number
+and between the columns. Everything is seeded, and the stub
+OCR engine stands in for Tesseract, so runs can be
+compared from one machine (or commit) to the next.
+
+Times are in seconds for each of the hocrmod stages,
+these nest: runThruPars includes sortOutHocr and
+writeModHocr. Results go out as JSON.
+
+- art rhyno, u. of windsor & ourdigitalworld
+"""
+
+import argparse, contextlib, io, json, os, platform, random, shlex
+import statistics, subprocess, sys, tempfile, time
+import cv2
+import numpy as np
+import hocrmod
+
+#namespace for HOCR
+HOCR_NS = 'http://www.w3.org/1999/xhtml'
+
+#page sizes in inches
+PAGE_SIZES = {'letter': (8.5,11.0), 'legal': (8.5,14.0), 'tabloid': (11.0,17.0)}
+
+#stages of hocrmod.py that get timed
+STAGES = ('runThruHocr','runThruContours','sortOutHocr','runThruPars','writeModHocr')
+
+WORDS = ('the','of','and','to','in','council','meeting','road','township',
+    'report','was','read','moved','seconded','carried','that','by-law',
+    'tender','for','gravel','with','bridge','accounts','paid','clerk')
+
+FONT = cv2.FONT_HERSHEY_SIMPLEX
+
+""" synthetic page - image plus hocr for everything but the page number """
+def makePage(width_in,height_in,dpi,seed):
+    rng = random.Random(seed)
+
+    w = int(width_in * dpi)
+    h = int(height_in * dpi)
+    img = np.full((h,w), 255, dtype=np.uint8)
+
+    scale = dpi / 300.0
+    thick = max(1,int(round(2 * scale)))
+    gap = int(14 * scale)
+    line_h = int(44 * scale)
+    margin = dpi
+    col_gap = int(dpi / 2)
+    col_w = (w - 2 * margin - col_gap) // 2
+
+    blocks = []
+    for col in range(2):
+        cx = margin + col * (col_w + col_gap)
+        y = margin
+        #leave the bottom inch and a half for the rule and page number
+        while y + 4 * line_h < h - int(1.5 * dpi):
+            lines = []
+            for l in range(rng.randint(3,8)):
+                x = cx
+                words = []
+                while True:
+                    text = rng.choice(WORDS)
+                    (tw, th), base = cv2.getTextSize(text, FONT, scale, thick)
+                    if x + tw > cx + col_w:
+                        break
+                    cv2.putText(img, text, (x,y + th), FONT, scale, 0, thick)
+                    words.append((text,x,y,x + tw,y + th + base))
+                    x += tw + gap
+                if len(words) > 0:
+                    lines.append(words)
+                y += line_h
+            blocks.append(lines)
+            y += line_h
+
+    #rule across the page above the page number
+    ry = h - int(1.2 * dpi)
+    cv2.line(img, (margin,ry), (w - margin,ry), 0, max(2,thick))
+    number = str(rng.randint(1,999))
+    (tw, th), base = cv2.getTextSize(number, FONT, scale, thick)
+    cv2.putText(img, number, ((w - tw) // 2,ry + int(0.4 * dpi)), FONT, scale, 0, thick)
+    #and a short rule between the columns
+    sx = margin + col_w + col_gap // 2
+    cv2.line(img, (sx,margin), (sx,margin + int(2 * dpi)), 0, max(2,thick))
+
+    return img, hocrPage(blocks,w,h)
+
+""" tesseract style hocr for the blocks on a page """
+def hocrPage(blocks,w,h):
+
+    def box(items):
+        return '%d %d %d %d' % (min(i[1] for i in items),min(i[2] for i in items),
+            max(i[3] for i in items),max(i[4] for i in items))
+
+    out = ['<?xml version="1.0" encoding="UTF-8"?>\n'
+        '<!DOCTYPE html PUBLIC "-//W3C//DTD XHTML 1.0 Transitional//EN"\n'
+        '    "http://www.w3.org/TR/xhtml1/DTD/xhtml1-transitional.dtd">\n'
+        '<html xmlns="%s" xml:lang="en" lang="en">\n <head>\n'
+        '  <title></title>\n </head>\n <body>\n'
+        '  <div class="ocr_page" id="page_1" title="bbox 0 0 %d %d">\n' % (HOCR_NS,w,h)]
+    line_cnt = 0
+    word_cnt = 0
+    for b, lines in enumerate(blocks):
+        words = [word for line in lines for word in line]
+        out.append('   <div class="ocr_carea" id="block_1_%d" title="bbox %s">\n'
+            '    <p class="ocr_par" id="par_1_%d" lang="eng" title="bbox %s">\n' %
+            (b + 1,box(words),b + 1,box(words)))
+        for line in lines:
+            line_cnt += 1
+            out.append('     <span class="ocr_line" id="line_1_%d" title="bbox %s; '
+                'baseline 0 0; x_size 30; x_descenders 7; x_ascenders 8">\n' %
+                (line_cnt,box(line)))
+            for text, x0, y0, x1, y1 in line:
+                word_cnt += 1
+                out.append('      <span class="ocrx_word" id="word_1_%d" '
+                    'title="bbox %d %d %d %d; x_wconf 92">%s</span>\n' %
+                    (word_cnt,x0,y0,x1,y1,text))
+            out.append('     </span>\n')
+        out.append('    </p>\n   </div>\n')
+    out.append('  </div>\n </body>\n</html>\n')
+
+    return ''.join(out).encode('utf8')
+
+""" timed - wrap a hocrmod function so calls add to a running total """
+class timed:
+    def __init__(self, name, func, totals):
+        self.name = name
+        self.func = func
+        self.totals = totals
+
+    def __call__(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return self.func(*args, **kwargs)
+        finally:
+            self.totals[self.name] = (self.totals.get(self.name,0.0) +
+                time.perf_counter() - start)
+
+""" run one page through hocrmod, time per stage plus the whole page """
+def timePage(ifile,hocr,args):
+
+    img_base = ifile.rsplit('.', 1)[0]
+    #start each run from the base hocr
+    with open(img_base + '.hocr','wb') as f:
+        f.write(hocr)
+    if os.path.exists(img_base + '.hocr.bak'):
+        os.remove(img_base + '.hocr.bak')
+
+    totals = {}
+    originals = {name: getattr(hocrmod,name) for name in STAGES}
+    for name in STAGES:
+        setattr(hocrmod, name, timed(name,originals[name],totals))
+    try:
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            added = hocrmod.processPage(ifile,args).lines
+        totals['page'] = time.perf_counter() - start
+    finally:
+        for name in STAGES:
+            setattr(hocrmod, name, originals[name])
+
+    return totals, added
+
+""" versions and machine details to go with the numbers """
+def environment():
+
+    try:
+        commit = subprocess.run(['git','rev-parse','HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+
+    return {'python': platform.python_version(), 'opencv': cv2.__version__,
+        'numpy': np.__version__, 'platform': platform.platform(),
+        'cpus': os.cpu_count(), 'commit': commit,
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S%z')}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    arg_named = parser.add_argument_group("named arguments")
+    arg_named.add_argument("-d","--dpis", default="150,300,600",
+        help="comma separated resolutions for the pages")
+    arg_named.add_argument("-z","--sizes", default="letter,tabloid",
+        help="comma separated page sizes: %s" % ','.join(sorted(PAGE_SIZES)))
+    arg_named.add_argument("-n","--repeat", default=3, type=int,
+        help="number of runs for each page, the median is reported")
+    arg_named.add_argument("-s","--seed", default=1, type=int,
+        help="seed for the page content")
+    arg_named.add_argument("--flags", default="",
+        help="hocrmod.py options to benchmark, for example: \"-r -g\"")
+    arg_named.add_argument("-k","--keep",
+        help="directory to keep the generated pages in")
+    arg_named.add_argument("-o","--output",
+        help="file for the JSON results (default: standard output)")
+
+    args = parser.parse_args()
+
+    #stub engine so there is no dependency on tesseract and results don't vary
+    hargs = hocrmod.buildParser().parse_args(shlex.split(args.flags) + ['-e','stub'])
+    #a '--dpi' in the flags is what's being compared, leave it alone
+    flag_dpi = hargs.dpi
+
+    workdir = args.keep
+    tmp = None
+    if workdir is None:
+        tmp = tempfile.TemporaryDirectory()
+        workdir = tmp.name
+    os.makedirs(workdir, exist_ok=True)
+
+    pages = []
+    for size in args.sizes.split(','):
+        width_in, height_in = PAGE_SIZES[size]
+        for dpi in [int(d) for d in args.dpis.split(',')]:
+            img, hocr = makePage(width_in,height_in,dpi,args.seed)
+            ifile = os.path.join(workdir,"%s_%d.png" % (size,dpi))
+            cv2.imwrite(ifile, img)
+            hargs.dpi = dpi if flag_dpi is None else flag_dpi
+
+            runs = []
+            for r in range(args.repeat):
+                totals, added = timePage(ifile,hocr,hargs)
+                runs.append(totals)
+            print("%s %d dpi: %.3fs" % (size,dpi,
+                statistics.median(run['page'] for run in runs)), file=sys.stderr)
+
+            pages.append({'size': size, 'dpi': dpi, 'width': img.shape[1],
+                'height': img.shape[0], 'lines_added': added,
+                'median': {name: statistics.median(run.get(name,0.0) for run in runs)
+                    for name in STAGES + ('page',)},
+                'min': {name: min(run.get(name,0.0) for run in runs)
+                    for name in STAGES + ('page',)}})
+
+    if tmp is not None:
+        tmp.cleanup()
+
+    results = {'environment': environment(), 'flags': args.flags,
+        'repeat': args.repeat, 'seed': args.seed, 'pages': pages}
+    if args.output is not None:
+        with open(args.output,'w') as f:
+            json.dump(results, f, indent=2)
+    else:
+        print(json.dumps(results, indent=2))
@@ -9,19 +9,61 @@ For example:
 
 This rebuilds the HOCR file based
 on confidence threshold (per word) and
-a possible exception for numbers.
+a possible exception for numbers. Each
+page of a multi-page file keeps its own
+div, with ids numbered for that page.
+
+With '--stream', the file is read a block at a
+time and the results written as it goes, so memory
+use doesn't grow with the size of the page. The
+blocks, paragraphs and lines of the original are
+kept, with boxes and ids worked out again for the
+words that are left.
+
+With '--index', the kept words also go into a
+binary sidecar (<base>_odw.words) that can be
+memory mapped without parsing XML, words that
+hocrmod.py added are flagged (see hocrindex.py).
+
+For a whole collection, '-s' takes a directory
+(searched all the way down), a glob pattern ('**'
+works), a manifest with one hocr path per line or
+a single hocr file, and files are cleaned across
+a pool of '-w' worker processes. Files are handed out as they are found,
+so the list is never held in memory. Each file is recorded
+in a state file ('--state') along with the options used, and
+is skipped next time unless the hocr, its output or the
+options changed:
+    cleanhocr.py -s books/ -n -w 8
+
+It can also be used from python:
+    import cleanhocr
+    result = cleanhocr.cleanPage("page.hocr",
+        cleanhocr.cleanOptions(conf=60))
 
 - art rhyno, u. of windsor & ourdigitalworld
 """
 
 import xml.etree.ElementTree as ET
-import argparse, glob, math, os, sys, time
-from xml.dom import minidom
-from subprocess import call
+import argparse, concurrent.futures, contextlib, glob, io, itertools, os, sys
+import batchstate, hocrindex, hocrio, hocrwords
 
 #namespace for HOCR
 HOCR_NS = 'http://www.w3.org/1999/xhtml'
 
+#spans that carry line info (checked as a substring, so 'ocr_line' matches)
+LINE_CLASSES = 'ocr_line,ocr_caption,ocr_header,ocr_textfloat'
+
+#files handed to a batch worker at a time, and how many of those can be waiting
+BATCH_CHUNK = 64
+BATCH_AHEAD = 4
+
+#options that change what a batch writes, a file is redone if any of them differ
+CLEAN_PARAMS = ('conf','number','lang','title','stream','index')
+
+#state file for batch input if none is given
+STATE_FILE = 'cleanhocr_state.db'
+
 #set paths for cat and lynx
 #this part is commented out below
 #but might be useful for quickly checking
@@ -31,79 +73,51 @@ CAT_CMD = "/bin/cat"
 LYNX_CMD = "/usr/bin/lynx"
 """
 
-""" page_region - a rectangle on the image """
-class page_region:
-    def __init__(self, x0, y0, x1, y1):
-        self.x0 = x0
-        self.y0 = y0
-        self.x1 = x1
-        self.y1 = y1
-
-""" word_region - word hocr info """
-class word_region:
-    def __init__(self, wregion, pident, dident, wtext, wline, wconf):
-        self.wregion = wregion
-        self.pident = pident
-        self.dident = dident
-        self.wtext = wtext
-        self.wline = wline
-        self.wconf = wconf
-
-""" pull coords and sometimes conf from bbox string """
-def getBBoxInfo(bbox_str):
-    conf = None
-
-    if ';' in bbox_str:
-        bbox_info = bbox_str.split(';')
-        bbox_info = bbox_info[1].strip()
-        bbox_info = bbox_info.split(' ')
-        conf = int(bbox_info[1])
-    bbox_info = bbox_str.replace(';',' ')
-    bbox_info = bbox_info.split(' ')
-    x0 = int(bbox_info[1])
-    y0 = int(bbox_info[2])
-    x1 = int(bbox_info[3])
-    y1 = int(bbox_info[4])
-
-    return x0,y0,x1,y1,conf
-
-""" look for limits of coord boxes """
-def calcBoxLimit(low_x, low_y, high_x, high_y, region):
-                
-    if low_x == 0 or region.wregion.x0 < low_x:
-        low_x = region.wregion.x0
-    if low_y == 0 or region.wregion.y0 < low_y:
-        low_y = region.wregion.y0
-    if high_x == 0 or region.wregion.x1 > high_x:
-        high_x = region.wregion.x1
-    if high_y == 0 or region.wregion.y1 > high_y:
-        high_y = region.wregion.y1
-
-    return low_x, low_y, high_x, high_y
-
-""" remove all divs except for ocr_page parent """
+""" clean_state - numbering for one file, nothing is shared between calls """
+class clean_state:
+    def __init__(self):
+        #hocr numbering starts at 1 (not 0)
+        self.page_cnt = 1
+        self.block_cnt = 1
+        self.par_cnt = 1
+        self.line_cnt = 1
+        self.word_cnt = 1
+
+""" clean_result - what cleanPage() did with a file """
+class clean_result:
+    def __init__(self, hocr_file, words, skipped=False):
+        self.hocr_file = hocr_file
+        self.words = words
+        self.skipped = skipped
+
+""" remove all divs except for the ocr_page parents, one for each page in order """
 def stripPage(orig_page):
-    parent_node = None
+    page_nodes = []
 
     for elem in orig_page.iter():
         if elem.tag.startswith("{"):
             elem_tag = elem.tag.split('}', 1)[1]  #strip namespace
         if elem_tag == "div":
             if elem.attrib["class"] == 'ocr_page':
-                parent_node = elem
+                page_nodes.append(elem)
                 for child in list(elem): #list is needed for this to work
                     elem.remove(child)
 
-    return parent_node
+    return page_nodes
 
-""" write hocr file """
+""" write hocr file, same layout as minidom pretty printing,
+    through a temporary file so a stopped run never leaves half of one """
 def writeModHocr(new_node,hocr_file):
 
-    #use minidom pretty print feature
-    xmlstr = minidom.parseString(ET.tostring(new_node)).toprettyxml(indent="   ")
-    with open(hocr_file, 'w') as f:
-        f.write(xmlstr)
-    f.close()
+    tmp_file = hocr_file + '.tmp'
+    try:
+        with open(tmp_file, 'w') as f:
+            hocrio.writePrettyHocr(new_node,f)
+        os.replace(tmp_file,hocr_file)
+    except BaseException:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+        raise
 
 """ add headers for HOCR """
 def addHtmlHeaders(result_title):
@@ -116,89 +130,114 @@ def addHtmlHeaders(result_title):
 
     return html_node
 
-""" add divs for paragraphs """
-def runThruPars(img_hocr,par_regions,orig_page,conf,lang,result_title):
-    global file_cnt, page_cnt, block_cnt, par_cnt, line_cnt, word_cnt
+""" add divs for paragraphs, keep has the indexes of the words that made the cut """
+def runThruPars(img_hocr,words,keep,orig_page,conf,lang,result_title,state):
 
-    orig_node = stripPage(orig_page)
+    page_nodes = stripPage(orig_page)
     parent_node = addHtmlHeaders(result_title)
     body_node = ET.Element(ET.QName(HOCR_NS,"body"))
 
-    l_low_x = 0
-    l_low_y = 0
-    l_high_x = 0
-    l_high_y = 0
+    #each page gets its own divs, numbered from 1 with the page number in the ids
+    for p, orig_node in enumerate(page_nodes):
+        page_keep = keep[words.page[keep] == p]
+        if len(page_keep) > 0:
+            if p > 0:
+                state = clean_state()
+            state.page_cnt = p + 1
+            runThruPage(orig_node,words,page_keep,lang,state)
+
+    if len(keep) > 0:
+        for orig_node in page_nodes:
+            body_node.append(orig_node)
+        parent_node.append(body_node)
+        writeModHocr(parent_node, img_hocr)
+        #convenience code, this would be one way to get a text version of the results
+        """
+        if os.path.exists(img_base + '_odw.hocr'):
+             from subprocess import call
+             cmd_line = "%s %s | %s -stdin --dump > %s_odw.txt" % (CAT_CMD,img_hocr,LYNX_CMD,img_base)
+             print("cmd: ", cmd_line)
+             call(cmd_line, shell=True)
+        """
+
+""" paragraphs for the kept words of one page, added to its (stripped) page div """
+def runThruPage(orig_node,words,keep,lang,state):
 
-    p_low_x = 0
-    p_low_y = 0
-    p_high_x = 0
-    p_high_y = 0
+    #line and paragraph boxes for all runs of words at once
+    line_info = [None if l is None else ' '.join(l.split()) for l in words.lines]
+    bbox = words.bbox[keep]
+    lrun = hocrwords.runIds(hocrwords.stringCodes(line_info)[words.line[keep]])
+    prun = hocrwords.runIds(hocrwords.stringCodes(words.par_ids)[words.par[keep]])
+    lbox = hocrwords.boxLimits(bbox,lrun)
+    pbox = hocrwords.boxLimits(bbox,prun)
+    if len(keep) > 1:
+        #the last paragraph is closed before its last word is counted
+        pbox_last = hocrwords.boxLimits(bbox[:-1],prun[:-1])[-1]
 
     div_element = ET.Element(ET.QName(HOCR_NS,"div"))
     div_element.set('class','ocr_carea')
-    div_element.set('id','block_1_%d' % block_cnt)
+    div_element.set('id','block_%d_%d' % (state.page_cnt,state.block_cnt))
 
     p_element = ET.Element(ET.QName(HOCR_NS,"p"))
     p_element.set('class','ocr_par')
     p_element.set('lang',lang)
-    p_element.set('id','par_1_%d' % par_cnt)
+    p_element.set('id','par_%d_%d' % (state.page_cnt,state.par_cnt))
 
     wline = ''
     wpar = ''
     wdiv = ''
     l_element = None
 
-    num_pars = len(par_regions) - 1
+    num_pars = len(keep) - 1
     par_filled = False
     div_filled = False
 
     #words in paras
-    for cnt, region in enumerate(par_regions):
+    for cnt, i in enumerate(keep):
+        x0, y0, x1, y1 = bbox[cnt]
+        rline = line_info[words.line[i]]
+        pident = words.par_ids[words.par[i]]
+        dident = words.page_ids[words.page[i]]
 
         w_element = ET.Element(ET.QName(HOCR_NS,"span"))
         w_element.set('class','ocrx_word')
 
-        w_element.text = region.wtext
+        w_element.text = words.text(i)
         w_element.set('title','bbox %d %d %d %d; x_wconf %d' %
-            (region.wregion.x0,region.wregion.y0,
-            region.wregion.x1,region.wregion.y1,
-            region.wconf))
-        w_element.set('id','word_1_%d' % word_cnt)
-        word_cnt += 1
+            (x0,y0,x1,y1,words.conf[i]))
+        w_element.set('id','word_%d_%d' % (state.page_cnt,state.word_cnt))
+        state.word_cnt += 1
 
-        if wline != region.wline:
+        if wline != rline:
             if l_element is not None:
                 l_element.set('title','bbox %d %d %d %d; %s' %
-                    (l_low_x,l_low_y,l_high_x,l_high_y,wline))
-                l_element.set('id','line_1_%d' % line_cnt)
-                line_cnt += 1
+                    (tuple(lbox[lrun[cnt - 1]]) + (wline,)))
+                l_element.set('id','line_%d_%d' % (state.page_cnt,state.line_cnt))
+                state.line_cnt += 1
                 p_element.append(l_element)
                 par_filled = True
 
             l_element = ET.Element(ET.QName(HOCR_NS,"span"))
             l_element.set('class','ocr_line')
-            l_low_x = 0
-            l_low_y = 0
-            l_high_x = 0
-            l_high_y = 0
-
-        l_low_x, l_low_y, l_high_x, l_high_y = calcBoxLimit(
-            l_low_x, l_low_y, l_high_x, l_high_y, region)
 
         if l_element is not None:
             l_element.append(w_element)
-            wline = region.wline
-
-            if (wpar != region.pident or cnt == num_pars) and len(wpar) > 0:
-                p_element.set('title','bbox %d %d %d %d' %
-                    (p_low_x, p_low_y, p_high_x, p_high_y))
-                p_element.set('id','par_1_%d' % par_cnt)
-                par_cnt += 1
+            wline = rline
+
+            if (wpar != pident or cnt == num_pars) and len(wpar) > 0:
+                if wpar != pident:
+                    p_box = pbox[prun[cnt - 1]]
+                else:
+                    p_box = pbox_last
+                p_element.set('title','bbox %d %d %d %d' % tuple(p_box))
+                p_element.set('id','par_%d_%d' % (state.page_cnt,state.par_cnt))
+                state.par_cnt += 1
                 if cnt == num_pars:
-                    if (l_low_x + l_low_y + l_high_x + l_high_y) > 0:
+                    l_box = lbox[lrun[cnt]]
+                    if l_box.sum() > 0:
                         l_element.set('title','bbox %d %d %d %d; %s' %
-                            (l_low_x,l_low_y,l_high_x,l_high_y,wline))
-                        l_element.set('id','line_1_%d' % line_cnt)
+                            (tuple(l_box) + (wline,)))
+                        l_element.set('id','line_%d_%d' % (state.page_cnt,state.line_cnt))
                     p_element.append(l_element)
                     par_filled = True
                 
@@ -211,17 +250,10 @@ def runThruPars(img_hocr,par_regions,orig_page,conf,lang,result_title):
                     p_element = ET.Element(ET.QName(HOCR_NS,"p"))
                     p_element.set('class','ocr_par')
                     p_element.set('lang',lang)
-                    p_low_x = 0
-                    p_low_y = 0
-                    p_high_x = 0
-                    p_high_y = 0
-
-            p_low_x, p_low_y, p_high_x, p_high_y = calcBoxLimit(
-                p_low_x, p_low_y, p_high_x, p_high_y, region)
 
-            if (wdiv != region.dident or cnt == num_pars) and len(wdiv) > 0:
-                div_element.set('id','block_1_%d' % block_cnt)
-                block_cnt += 1
+            if (wdiv != dident or cnt == num_pars) and len(wdiv) > 0:
+                div_element.set('id','block_%d_%d' % (state.page_cnt,state.block_cnt))
+                state.block_cnt += 1
                 if div_filled:
                     orig_node.append(div_element)
                     div_filled = False
@@ -229,80 +261,218 @@ def runThruPars(img_hocr,par_regions,orig_page,conf,lang,result_title):
                         div_element = ET.Element(ET.QName(HOCR_NS,"div"))
                         div_element.set('class','ocr_carea')
 
-            wpar = region.pident
-            wdiv = region.dident
-
-    if len(par_regions) > 0:
-        body_node.append(orig_node)
-        parent_node.append(body_node)
-        writeModHocr(parent_node, img_base + '_odw.hocr')
-        #convenience code, this would be one way to get a text version of the results
-        """
-        if os.path.exists(img_base + '_odw.hocr'):
-             cmd_line = "%s %s | %s -stdin --dump > %s_odw.txt" % (CAT_CMD,img_hocr,LYNX_CMD,img_base)
-             print("cmd: ", cmd_line)
-             call(cmd_line, shell=True)
-        """
-
-""" check for any numbers in string """
-def hasNumbers(inputString):
-    return any(char.isdigit() for char in inputString)
-
-""" pull together paragraphs from hocr file """
-def sortOutHocr(tree,HOCRfile,HOCRconf,number,pars):
-
-    #keep words together in paragraphs identified by tesseract
-    for div_elem in tree.iterfind('.//{%s}%s' % (HOCR_NS,'div')):
-        if 'class' in div_elem.attrib:
-            class_name = div_elem.attrib['class']
-            if class_name == 'ocr_page': 
-                for par_elem in div_elem.iterfind('.//{%s}%s' % (HOCR_NS,'p')):
-                    line_info = None
-                    if 'class' in par_elem.attrib:
-                        class_name = par_elem.attrib['class']
-                        if class_name == 'ocr_par': 
-                            x0,y0,x1,y1,_ = getBBoxInfo(
-                                par_elem.attrib['title'])
-                            words = ''
-                            for word_elem in par_elem.iterfind('.//{%s}%s' % (HOCR_NS,'span')):
-                                class_name = word_elem.attrib['class']
-                                if class_name in 'ocr_line,ocr_caption,ocr_header,ocr_textfloat': 
-                                    #save line infos
-                                    line_info = word_elem.attrib['title']
-                                    line_index = line_info.find(';')
-                                    line_info = line_info[line_index + 1:]
-                                    line_info = ' '.join(line_info.split())
-                                if class_name == 'ocrx_word': #word details
-                                    word_text = word_elem.text.strip()
-                                    if len(word_text) > 0:
-                                        x0,y0,x1,y1,conf = getBBoxInfo(
-                                            word_elem.attrib['title'])
-                                        if conf >= HOCRconf or (number and hasNumbers(word_text)):
-                                            pars.append(
-                                                word_region(page_region(x0,y0,x1,y1),
-                                                par_elem.attrib['id'],
-                                                div_elem.attrib['id'],
-                                                word_text,line_info,conf))
-                                    words += word_text
-                            #skip para blocks that don't have any text
-                            if len(words.strip()) > 0:
-                                print(".",end="",flush=True)
-
-    return pars
-
-""" use word coords to remove already recognized sections """
-def runThruHocr(ifile,iconf,number,pars):
-
-    print("sort through hocr words for " + ifile + " ...",end="",flush=True)
+            wpar = pident
+            wdiv = dident
+
+    #a lone word never gets to the closing code above
+    if len(keep) == 1:
+        l_element.set('title','bbox %d %d %d %d; %s' % (tuple(lbox[0]) + (wline,)))
+        l_element.set('id','line_%d_%d' % (state.page_cnt,state.line_cnt))
+        p_element.append(l_element)
+        p_element.set('title','bbox %d %d %d %d' % tuple(pbox[0]))
+        div_element.append(p_element)
+        orig_node.append(div_element)
+
+""" read the words of an hocr file into columns, along with the tree,
+    added words are only flagged if asked for (it slows down parsing) """
+def runThruHocr(ifile,flag_added=False,quiet=False):
+
+    if not quiet:
+        print("sort through hocr words for " + ifile + " ...",end="",flush=True)
+    added = None
+    if flag_added:
+        builder = hocrwords.hocrmod_builder()
+        tree = ET.parse(ifile,parser=ET.XMLParser(target=builder))
+        added = builder.added
+    else:
+        tree = ET.parse(ifile)
+    words = hocrwords.pageWords(tree.getroot(),LINE_CLASSES,added)
+    if not quiet:
+        #a dot for each paragraph with text
+        print("." * int((words.par_text & (words.par_page >= 0)).sum()),end="",flush=True)
+        print("!") #hocr processing is done
+
+    return tree, words
+
+""" stream_writer - write cleaned hocr a block at a time, same layout as writeModHocr() """
+class stream_writer:
+    def __init__(self, f, result_title, lang):
+        self.f = f
+        self.lang = lang
+        self.page_tag = None
+        self.page_open = False
+        self.page_no = 0
+        self.words = 0
+        #1 for each word written that hocrmod.py added
+        self.inserted = bytearray()
+        f.write('<?xml version="1.0" ?>\n')
+        f.write('<html:html xmlns:html="%s">\n' % hocrio.prettyData(HOCR_NS))
+        f.write('   <html:head>\n      <html:title>%s</html:title>\n   </html:head>\n' %
+            hocrio.prettyData(hocrio.prettyText(result_title)))
+        f.write('   <html:body>\n')
+
+    #page tag is held back until the page turns out to have something on it
+    def startPage(self, attrib):
+        self.page_no += 1
+        self.blocks = self.pars = self.lines = self.wcnt = 0
+        self.page_tag = '      <html:div'
+        for k, v in attrib.items():
+            if k.startswith('{'):
+                if not k.startswith('{http://www.w3.org/XML/1998/namespace}'):
+                    continue
+                k = 'xml:' + k.split('}', 1)[1]
+            self.page_tag += ' %s="%s"' % (k,hocrio.prettyData(v))
+        self.page_open = False
+
+    def endPage(self):
+        if self.page_open:
+            self.f.write('      </html:div>\n')
+        elif self.page_tag is not None:
+            self.f.write(self.page_tag + '/>\n')
+        self.page_tag = None
+        self.page_open = False
+
+    #pars is a list of paragraphs, each a list of (class, info, words) lines,
+    #words are (text, x0, y0, x1, y1, conf, inserted)
+    def writeBlock(self, pars):
+        if self.page_tag is None:
+            self.startPage({'class': 'ocr_page'})
+        if not self.page_open:
+            self.f.write(self.page_tag + '>\n')
+            self.page_open = True
+
+        self.blocks += 1
+        self.f.write('         <html:div class="ocr_carea" id="block_%d_%d" title="bbox %s">\n' %
+            (self.page_no,self.blocks,boxText([w for p in pars for l in p for w in l[2]])))
+        for par in pars:
+            self.pars += 1
+            self.f.write('            <html:p class="ocr_par" lang="%s" title="bbox %s" id="par_%d_%d">\n' %
+                (hocrio.prettyData(self.lang),boxText([w for l in par for w in l[2]]),
+                self.page_no,self.pars))
+            for class_name, info, words in par:
+                self.lines += 1
+                title = 'bbox ' + boxText(words)
+                if len(info) > 0:
+                    title += '; ' + info
+                self.f.write('               <html:span class="%s" title="%s" id="line_%d_%d">\n' %
+                    (hocrio.prettyData(class_name),hocrio.prettyData(title),self.page_no,self.lines))
+                for text, x0, y0, x1, y1, conf, inserted in words:
+                    self.wcnt += 1
+                    self.f.write('                  <html:span class="ocrx_word" '
+                        'title="bbox %d %d %d %d; x_wconf %d" id="word_%d_%d">%s</html:span>\n' %
+                        (x0,y0,x1,y1,conf,self.page_no,self.wcnt,hocrio.prettyData(text)))
+                    self.words += 1
+                    self.inserted.append(1 if inserted else 0)
+                self.f.write('               </html:span>\n')
+            self.f.write('            </html:p>\n')
+        self.f.write('         </html:div>\n')
+
+    def close(self):
+        self.endPage()
+        self.f.write('   </html:body>\n</html:html>\n')
+
+""" bbox of a list of words """
+def boxText(words):
+
+    return '%d %d %d %d' % (min(w[1] for w in words),min(w[2] for w in words),
+        max(w[3] for w in words),max(w[4] for w in words))
+
+""" one pass through the hocr, dropping words and writing each block as soon as it ends,
+    the word index (if asked for) is written from the results afterwards """
+def streamHocr(hocr_file,odw_file,conf,number,lang,result_title,index_file=None,quiet=False):
+
+    #progress dots, one for each block written
+    def progress(text):
+        if not quiet:
+            print(text,end="",flush=True)
+
+    progress("stream hocr words for " + hocr_file + " ...")
+    tmp_file = odw_file + '.tmp'
     try:
-        tree = ET.ElementTree(file=ifile)
-    except:
-        tree = None
-    if tree is not None:
-        pars = sortOutHocr(tree,ifile,iconf,number,pars)
-    print("!") #hocr processing is done
-
-    return pars
+        with open(tmp_file,'w') as f:
+            out = stream_writer(f,result_title,lang)
+            stack = []
+            block = None
+            par = None
+            line = None
+            in_mod = False
+            for event, elem in ET.iterparse(hocr_file, events=('start','end','comment')):
+                if event == 'comment':
+                    #hocrmod.py puts its additions between a pair of comments
+                    in_mod = hocrio.modComment(elem.text,in_mod)
+                    continue
+                tag = elem.tag
+                if tag.startswith('{'):
+                    tag = tag.split('}', 1)[1]
+                class_name = elem.get('class')
+
+                if event == 'start':
+                    stack.append(elem)
+                    if tag == 'div' and class_name == 'ocr_page':
+                        out.endPage()
+                        out.startPage(elem.attrib)
+                    elif tag == 'div' and class_name == 'ocr_carea':
+                        block = []
+                    elif tag == 'p' and class_name == 'ocr_par':
+                        par = []
+                        line = None
+                    elif (tag == 'span' and par is not None and class_name != 'ocrx_word' and
+                        class_name is not None and class_name in LINE_CLASSES):
+                        title = elem.get('title','')
+                        line = (class_name,' '.join(title[title.find(';') + 1:].split()),[])
+                        par.append(line)
+                    continue
+
+                stack.pop()
+                if tag == 'span' and class_name == 'ocrx_word' and par is not None:
+                    word_text = (elem.text or '').strip()
+                    if len(word_text) > 0:
+                        x0,y0,x1,y1,wconf = hocrwords.titleInfo(elem.get('title'))
+                        if wconf >= conf or (number and any(c.isdigit() for c in word_text)):
+                            if line is None:
+                                #words that aren't in a line get one of their own
+                                line = ('ocr_line','',[])
+                                par.append(line)
+                            line[2].append((word_text,x0,y0,x1,y1,wconf,in_mod))
+                elif tag == 'p' and class_name == 'ocr_par' and par is not None:
+                    par = [l for l in par if len(l[2]) > 0]
+                    if len(par) > 0:
+                        if block is not None:
+                            block.append(par)
+                        else:
+                            out.writeBlock([par])
+                            progress(".")
+                    par = None
+                    line = None
+                elif tag == 'div' and class_name == 'ocr_carea' and block is not None:
+                    if len(block) > 0:
+                        out.writeBlock(block)
+                        progress(".")
+                    block = None
+                elif tag == 'div' and class_name == 'ocr_page':
+                    out.endPage()
+
+                #done with this element, don't let the tree grow
+                if len(stack) > 0:
+                    elem.clear()
+                    stack[-1].remove(elem)
+            out.close()
+    except BaseException:
+        #don't leave half a file behind
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+        raise
+    progress("!\n")
+
+    #same as the default mode, no file if nothing is left
+    if out.words > 0:
+        os.replace(tmp_file,odw_file)
+        if index_file is not None:
+            hocrindex.indexHocr(odw_file,index_file,out.inserted)
+    else:
+        os.remove(tmp_file)
+
+    return out.words
 
 """ write results to file """
 def writeHocr(block,fhocr):
@@ -311,50 +481,214 @@ def writeHocr(block,fhocr):
     hfile.write(bytearray(block))
     hfile.close()
 
-#parser values
-parser = argparse.ArgumentParser()
-arg_named = parser.add_argument_group("named arguments")
-arg_named.add_argument("-f","--file", 
-    help="input file, for example: page.hocr")
-arg_named.add_argument("-c","--conf", default=50, type=int,
-    help="set confidence number threshold for ocr words")
-arg_named.add_argument('-l', '--lang', type=str, 
-    default="eng",
-    help="language for OCR")
-arg_named.add_argument("-n",'--number', action='store_true', 
-    default=False,
-    help="flag to bypass confidence value for words with number(s)")
-arg_named.add_argument('-t', '--title', type=str, 
-    help="title to set for HOCR file")
-
-args = parser.parse_args()
-
-if args.file == None or not os.path.exists(args.file):
-    print("missing hocr file, use '-h' parameter for syntax")
-    sys.exit()
-
-img_base = args.file.rsplit('.', 1)[0]
-print("img_base", img_base)
-
-if os.path.exists(img_base + "_odw.hocr"):
-    print("odw file exists")
-    sys.exit()
-
-result_title = args.title
-if args.title == None:
-    result_title = img_base + "_odw.hocr"
-        
-pars = []
-pars = runThruHocr(args.file,int(args.conf),args.number,pars)
-        
-orig_page = ET.parse(args.file)
-
-#hocr numbering starts at 1 (not 0)
-page_cnt = 1
-block_cnt = 1
-par_cnt = 1
-line_cnt = 1
-word_cnt = 1
+""" command line options """
+def buildParser():
+
+    parser = argparse.ArgumentParser()
+    arg_named = parser.add_argument_group("named arguments")
+    arg_named.add_argument("-f","--file", 
+        help="input file, for example: page.hocr")
+    arg_named.add_argument("-c","--conf", default=50, type=int,
+        help="set confidence number threshold for ocr words")
+    arg_named.add_argument('-l', '--lang', type=str, 
+        default="eng",
+        help="language for OCR")
+    arg_named.add_argument("-n",'--number', action='store_true', 
+        default=False,
+        help="flag to bypass confidence value for words with number(s)")
+    arg_named.add_argument('-t', '--title', type=str, 
+        help="title to set for HOCR file")
+    arg_named.add_argument("--stream", action='store_true',
+        default=False,
+        help="read and write a block at a time, keeping the original layout")
+    arg_named.add_argument("--index", action='store_true',
+        default=False,
+        help="also write the kept words to a binary index (.words) for fast loading")
+    arg_named.add_argument("-s","--source",
+        help="batch input: directory, glob pattern or manifest of hocr files")
+    arg_named.add_argument("-w","--workers", default=os.cpu_count(), type=int,
+        help="number of worker processes for batch input")
+    arg_named.add_argument("--state", default=STATE_FILE,
+        help="state file for batch input, files are redone if their hocr, output or options change")
+    arg_named.add_argument("-q","--quiet", default=False,
+        action="store_true",
+        help="only report failures and the totals")
+
+    return parser
+
+""" options for cleanPage(), the command line defaults with any changes """
+def cleanOptions(**changes):
+
+    args = buildParser().parse_args([])
+    #nothing gets printed from python unless asked for
+    args.quiet = True
+    for name, value in changes.items():
+        if not hasattr(args,name):
+            raise TypeError("unknown option: %s" % name)
+        setattr(args,name,value)
+
+    return args
+
+""" clean one hocr file into <base>_odw.hocr, skipped if that already exists """
+def cleanPage(hocr_file,args=None):
+
+    if args is None:
+        args = cleanOptions()
+    img_base = hocr_file.rsplit('.', 1)[0]
+    odw_file = img_base + "_odw.hocr"
+
+    if os.path.exists(odw_file):
+        return clean_result(odw_file,0,True)
+
+    result_title = args.title
+    if args.title == None:
+        result_title = odw_file
+
+    index_file = hocrindex.indexFile(odw_file) if args.index else None
+    if args.stream:
+        kept = streamHocr(hocr_file,odw_file,int(args.conf),args.number,
+            args.lang,result_title,index_file,args.quiet)
+        return clean_result(odw_file if kept > 0 else None,kept)
         
-runThruPars(img_base + "_odw.hocr",pars,orig_page,int(args.conf),
-    args.lang, result_title)
+    orig_page, words = runThruHocr(hocr_file,args.index,args.quiet)
+    #only words on a page, over the threshold (or with a number if asked)
+    keep = words.keep(int(args.conf),args.number)
+    keep = keep[words.page[keep] >= 0]
+
+    runThruPars(odw_file,words,keep,orig_page,int(args.conf),
+        args.lang,result_title,clean_state())
+    if index_file is not None and len(keep) > 0:
+        #the comments don't make it into the cleaned file, the flags come along instead
+        hocrindex.indexHocr(odw_file,index_file,words.inserted[keep])
+
+    return clean_result(odw_file if len(keep) > 0 else None,len(keep))
+
+""" hocr files under a directory, from a glob pattern or a manifest (or just the one file),
+    found as they are needed """
+def collectHocr(source):
+
+    if os.path.isdir(source):
+        yield from pickHocr(walkHocr(source))
+    elif os.path.isfile(source) and source.lower().endswith('.hocr'):
+        yield from pickHocr([source])
+    elif os.path.isfile(source):
+        with open(source) as f:
+            yield from pickHocr(l.strip() for l in f if l.strip())
+    else:
+        yield from pickHocr(glob.iglob(source, recursive=True))
+
+""" leave out our own results and hocrmod's region files """
+def pickHocr(hfiles):
+
+    for hfile in hfiles:
+        name = os.path.basename(hfile)
+        if (name.endswith('.hocr') and not name.endswith('_odw.hocr') and
+            '_coords_' not in name):
+            yield hfile
+
+""" every .hocr file below a directory, in name order """
+def walkHocr(top):
+
+    with os.scandir(top) as it:
+        entries = sorted(it, key=lambda e: e.name)
+    for entry in entries:
+        if entry.is_dir(follow_symlinks=False):
+            yield from walkHocr(entry.path)
+        elif entry.name.endswith('.hocr') and entry.is_file():
+            yield entry.path
+
+""" the hocr and what was written for it, to check against the state file """
+def cleanFiles(hfile,args):
+    odw_file = hfile.rsplit('.', 1)[0] + "_odw.hocr"
+    files = {'hocr': batchstate.file_info(hfile),
+        'odw': batchstate.file_info(odw_file)}
+    if args.index:
+        files['index'] = batchstate.file_info(hocrindex.indexFile(odw_file))
+
+    return files
+
+""" batch worker - clean a chunk of files, whatever was there before is replaced """
+def batchFiles(job):
+    hfiles, args = job
+    results = []
+
+    for hfile in hfiles:
+        odw_file = hfile.rsplit('.', 1)[0] + "_odw.hocr"
+        try:
+            #out of date, cleanPage() won't touch it otherwise
+            for old_file in (odw_file,hocrindex.indexFile(odw_file)):
+                try:
+                    os.remove(old_file)
+                except FileNotFoundError:
+                    pass
+            with contextlib.redirect_stdout(io.StringIO()):
+                result = cleanPage(hfile,args)
+            results.append((hfile,result.words,None))
+        except Exception as e:
+            results.append((hfile,0,str(e)))
+
+    return results
+
+""" fan files out to a process pool a chunk at a time, reporting as chunks finish,
+    files done before with the same options are skipped """
+def runBatch(hfiles,args):
+    cleaned = skipped = failed = words = 0
+
+    state = batchstate.batch_state(args.state)
+    params = batchstate.paramString(args,CLEAN_PARAMS)
+
+    #only the files that changed go out to the pool
+    def changed():
+        nonlocal skipped
+        for hfile in hfiles:
+            if state.upToDate(hfile,params,cleanFiles(hfile,args)):
+                skipped += 1
+            else:
+                yield hfile
+
+    todo = changed()
+    chunks = iter(lambda: list(itertools.islice(todo,BATCH_CHUNK)), [])
+    with concurrent.futures.ProcessPoolExecutor(args.workers) as pool:
+        #only a few chunks per worker are waiting at any time
+        jobs = set()
+        for chunk in itertools.islice(chunks,args.workers * BATCH_AHEAD):
+            jobs.add(pool.submit(batchFiles,(chunk,args)))
+        while len(jobs) > 0:
+            done, jobs = concurrent.futures.wait(jobs,
+                return_when=concurrent.futures.FIRST_COMPLETED)
+            for job in done:
+                for hfile, kept, err in job.result():
+                    state.finish(hfile,params,cleanFiles(hfile,args),kept,err)
+                    if err is not None:
+                        print("%s: failed (%s)" % (hfile,err))
+                        failed += 1
+                    else:
+                        if not args.quiet:
+                            print("%s: %d word(s) kept" % (hfile,kept))
+                        cleaned += 1
+                        words += kept
+                for chunk in itertools.islice(chunks,1):
+                    jobs.add(pool.submit(batchFiles,(chunk,args)))
+    state.close()
+
+    print("%d file(s) cleaned, %d word(s) kept, %d up to date, %d failed" %
+        (cleaned,words,skipped,failed))
+
+    return cleaned
+
+if __name__ == "__main__":
+    args = buildParser().parse_args()
+
+    if args.source is not None:
+        runBatch(collectHocr(args.source),args)
+        sys.exit()
+
+    if args.file == None or not os.path.exists(args.file):
+        print("missing hocr file, use '-h' parameter for syntax")
+        sys.exit()
+
+    img_base = args.file.rsplit('.', 1)[0]
+    print("img_base", img_base)
+
+    if cleanPage(args.file,args).skipped:
+        print("odw file exists")
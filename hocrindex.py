@@ -0,0 +1,252 @@
+"""
+hocrindex.py - words of an hocr file in a binary sidecar
+
+With '--index', hocrmod.py and cleanhocr.py also write <hocr base>.words
+next to the hocr. It has the same words in columns that can be memory
+mapped, so search indexing or highlighting can get at them without
+parsing any XML:
+
+    bbox     - int32 x0,y0,x1,y1 for each word
+    conf     - int16 x_wconf, -1 if there isn't one
+    inserted - uint8, 1 if the word came from a HOCRMOD insertion
+    page, block, par, line - int32 row in the id tables, -1 for none
+    chars, offsets - utf-8 of all of the words, with the byte offset
+               where each word starts (int64) and the end after the last
+    page_ids, block_ids, par_ids, line_ids (and their _offsets) - the ids
+               from the hocr, utf-8 with offsets in the same way
+
+Every word with some text is in the index, in document order. The file
+starts with MAGIC, a little-endian uint32 length and a JSON header with
+the number of words and each column's dtype, shape and offset. Offsets
+count from the first 64 byte boundary after the header, columns start
+on 64 byte boundaries too:
+
+    import hocrindex
+    words = hocrindex.loadIndex("page.words")
+    for i in range(len(words)):
+        print(words.text(i), words.bbox[i], words.ident('line',i))
+"""
+
+import xml.etree.ElementTree as ET
+import array, json, mmap, os
+import numpy as np
+import hocrio, hocrwords
+
+MAGIC = b'HOCRIDX1'
+VERSION = 1
+#columns (and the header) start on these boundaries
+ALIGN = 64
+#sidecar extension, in place of .hocr
+INDEX_EXT = '.words'
+#spans that carry line info
+LINE_CLASSES = ('ocr_line','ocr_caption','ocr_header','ocr_textfloat')
+#tables of hocr ids, in the order they are written
+ID_TABLES = ('page','block','par','line')
+
+""" index file for an hocr file """
+def indexFile(hocr_file):
+
+    return hocr_file.rsplit('.', 1)[0] + INDEX_EXT
+
+""" True if the index is missing or older than its hocr """
+def staleIndex(hocr_file):
+    index_file = indexFile(hocr_file)
+
+    if not os.path.exists(index_file):
+        return True
+    return os.stat(index_file).st_mtime_ns < os.stat(hocr_file).st_mtime_ns
+
+""" index_builder - columns filled in a word at a time, arrays keep them compact """
+class index_builder:
+    def __init__(self):
+        self.bbox = array.array('i')
+        self.conf = array.array('h')
+        self.inserted = bytearray()
+        self.rows = {name: array.array('i') for name in ID_TABLES}
+        self.chars = bytearray()
+        self.offsets = array.array('q',[0])
+        self.ids = {name: [] for name in ID_TABLES}
+
+    def __len__(self):
+        return len(self.conf)
+
+    #new row in an id table
+    def addId(self, table, ident):
+        self.ids[table].append(ident or '')
+        return len(self.ids[table]) - 1
+
+    def addWord(self, text, x0, y0, x1, y1, conf, inserted, rows):
+        self.bbox.extend((x0,y0,x1,y1))
+        self.conf.append(conf)
+        self.inserted.append(1 if inserted else 0)
+        for name in ID_TABLES:
+            self.rows[name].append(rows[name])
+        self.chars += text.encode('utf-8')
+        self.offsets.append(len(self.chars))
+
+    #name, dtype and data of each column, in file order
+    def columns(self):
+        n = len(self)
+        cols = [('bbox','<i4',(n,4),self.bbox),('conf','<i2',(n,),self.conf),
+            ('inserted','u1',(n,),self.inserted)]
+        for name in ID_TABLES:
+            cols.append((name,'<i4',(n,),self.rows[name]))
+        cols.append(('offsets','<i8',(n + 1,),self.offsets))
+        cols.append(('chars','u1',(len(self.chars),),self.chars))
+        for name in ID_TABLES:
+            data = [ident.encode('utf-8') for ident in self.ids[name]]
+            offsets = np.zeros(len(data) + 1,dtype='<i8')
+            np.cumsum([len(d) for d in data],out=offsets[1:])
+            cols.append((name + '_ids_offsets','<i8',offsets.shape,offsets))
+            joined = b''.join(data)
+            cols.append((name + '_ids','u1',(len(joined),),joined))
+
+        return cols
+
+    """ write the index, through a temporary file so readers never see half of one """
+    def write(self, index_file):
+        columns = {}
+        blobs = []
+        offset = 0
+        for name, dtype, shape, data in self.columns():
+            #arrays are in machine order, the file is little-endian
+            blob = np.frombuffer(data,dtype=np.dtype(dtype).newbyteorder('='))
+            blob = blob.astype(dtype).tobytes()
+            columns[name] = {'dtype': dtype, 'shape': list(shape), 'offset': offset}
+            blobs.append((offset,blob))
+            offset = alignUp(offset + len(blob))
+        header = json.dumps({'version': VERSION, 'words': len(self),
+            'columns': columns}, sort_keys=True).encode('utf-8')
+
+        tmp_file = index_file + '.tmp'
+        with open(tmp_file,'wb') as f:
+            f.write(MAGIC)
+            f.write(len(header).to_bytes(4,'little'))
+            f.write(header)
+            start = alignUp(f.tell())
+            for pos, blob in blobs:
+                f.seek(start + pos)
+                f.write(blob)
+            f.truncate(start + offset)
+        os.replace(tmp_file,index_file)
+
+""" round up to the next ALIGN boundary """
+def alignUp(n):
+
+    return -(-n // ALIGN) * ALIGN
+
+""" index the words of an hocr file in one pass, inserted can give the HOCRMOD flag
+    for each word if the hocr no longer has the comments, returns the number of words """
+def indexHocr(hocr_file,index_file=None,inserted=None):
+
+    if index_file is None:
+        index_file = indexFile(hocr_file)
+    builder = index_builder()
+    rows = {name: -1 for name in ID_TABLES}
+    #rows to go back to as each element ends, and the open elements
+    saved = []
+    stack = []
+    in_mod = False
+    for event, elem in ET.iterparse(hocr_file, events=('start','end','comment')):
+        if event == 'comment':
+            in_mod = hocrio.modComment(elem.text,in_mod)
+            continue
+
+        tag = elem.tag
+        if tag.startswith('{'):
+            tag = tag.split('}', 1)[1]
+        class_name = elem.get('class')
+
+        if event == 'start':
+            saved.append(dict(rows))
+            stack.append(elem)
+            if tag == 'div' and class_name == 'ocr_page':
+                rows = dict.fromkeys(ID_TABLES,-1)
+                rows['page'] = builder.addId('page',elem.get('id'))
+            elif tag == 'div' and class_name == 'ocr_carea':
+                rows['block'] = builder.addId('block',elem.get('id'))
+                rows['par'] = rows['line'] = -1
+            elif tag == 'p' and class_name == 'ocr_par':
+                rows['par'] = builder.addId('par',elem.get('id'))
+                rows['line'] = -1
+            elif tag == 'span' and class_name in LINE_CLASSES:
+                rows['line'] = builder.addId('line',elem.get('id'))
+            continue
+
+        if tag == 'span' and class_name == 'ocrx_word':
+            word_text = (elem.text or '').strip()
+            if len(word_text) > 0:
+                x0,y0,x1,y1,wconf = hocrwords.titleInfo(elem.get('title'))
+                if inserted is not None:
+                    if len(builder) >= len(inserted):
+                        raise ValueError("more words than flags for: %s" % hocr_file)
+                    in_word = inserted[len(builder)]
+                else:
+                    in_word = in_mod
+                builder.addWord(word_text,x0,y0,x1,y1,wconf,in_word,rows)
+        rows = saved.pop()
+        stack.pop()
+
+        #done with this element, don't let the tree grow
+        if len(stack) > 0:
+            elem.clear()
+            stack[-1].remove(elem)
+
+    if inserted is not None and len(builder) != len(inserted):
+        raise ValueError("fewer words than flags for: %s" % hocr_file)
+    builder.write(index_file)
+
+    return len(builder)
+
+""" word_index - columns of an index file, read-only views of the mapped file """
+class word_index:
+    def __init__(self, buf, header, start):
+        self.buf = buf
+        self.header = header
+        self.tables = {}
+        for name, col in header['columns'].items():
+            count = int(np.prod(col['shape']))
+            setattr(self,name,np.frombuffer(buf,dtype=col['dtype'],count=count,
+                offset=start + col['offset']).reshape(col['shape']))
+
+    def __len__(self):
+        return self.header['words']
+
+    def text(self, i):
+        return bytes(self.chars[self.offsets[i]:self.offsets[i + 1]]).decode('utf-8')
+
+    #hocr id of a word's page, block, par or line, None if it isn't in one,
+    #only that id is decoded
+    def ident(self, table, i):
+        row = getattr(self,table)[i]
+        if row < 0:
+            return None
+        offsets = getattr(self,table + '_ids_offsets')
+        data = getattr(self,table + '_ids')
+
+        return bytes(data[offsets[row]:offsets[row + 1]]).decode('utf-8')
+
+    #all of the ids of a table, decoded once
+    def table(self, table):
+        if table not in self.tables:
+            offsets = getattr(self,table + '_ids_offsets')
+            data = bytes(getattr(self,table + '_ids'))
+            self.tables[table] = [data[offsets[j]:offsets[j + 1]].decode('utf-8')
+                for j in range(len(offsets) - 1)]
+
+        return self.tables[table]
+
+""" map an index file, nothing is read until it is used """
+def loadIndex(index_file):
+
+    with open(index_file,'rb') as f:
+        buf = mmap.mmap(f.fileno(),0,access=mmap.ACCESS_READ)
+    if buf[:len(MAGIC)] != MAGIC:
+        raise ValueError("not a word index: %s" % index_file)
+    size = int.from_bytes(buf[len(MAGIC):len(MAGIC) + 4],'little')
+    pos = len(MAGIC) + 4
+    header = json.loads(buf[pos:pos + size].decode('utf-8'))
+    if header.get('version') != VERSION:
+        raise ValueError("unknown word index version: %s" % header.get('version'))
+
+    return word_index(buf,header,alignUp(pos + size))
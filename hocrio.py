@@ -0,0 +1,243 @@
+"""
+hocrio.py - shared hocr output for hocrmod.py and cleanhocr.py
+
+Both scripts used to build the whole document as one string
+(ET.tostring) and then clean up the layout with string
+replacements or a minidom round trip, which makes several
+copies of what can be a multi-megabyte string. The writers
+here walk the tree once and write to the file handle as they
+go, producing exactly the same bytes as before:
+
+    writeTessHocr   - Tesseract style layout used by hocrmod.py
+    writePrettyHocr - minidom toprettyxml() layout used by
+                      cleanhocr.py
+
+What hocrmod.py adds goes between a pair of comments, and
+modComment() is how everything that reads them back keeps
+track of whether it is inside one.
+"""
+
+import os, re
+import xml.etree.ElementTree as ET
+from xml.sax.saxutils import escape
+
+#namespace for HOCR
+HOCR_NS = 'http://www.w3.org/1999/xhtml'
+#prefixes for namespaces, others get ns0, ns1, ... like ET.tostring()
+NS_PREFIXES = {'http://www.w3.org/XML/1998/namespace': 'xml', HOCR_NS: 'html'}
+#what ET.tostring() escapes in attribute values on top of &, < and >
+ATTRIB_ENTITIES = {'"': '&quot;', '\r': '&#13;', '\n': '&#10;', '\t': '&#09;'}
+
+#comments hocrmod.py puts around the blocks it adds
+MOD_START = 'START HOCRMOD'
+MOD_END = 'END HOCRMOD'
+
+TESS_HEADER = ('<?xml version="1.0" encoding="UTF-8"?>\n'
+    '<!DOCTYPE html PUBLIC "-//W3C//DTD XHTML 1.0 Transitional//EN"\n'
+    '    "http://www.w3.org/TR/xhtml1/DTD/xhtml1-transitional.dtd">\n')
+
+#line breaks put in between two tags that are right up against each other,
+#(end of first tag, start of second tag, indent) - first match wins
+TESS_BREAKS = (
+    ('-->','<','   '),
+    ('">','<html:p','    '),
+    ('>','<html:span class="ocr_line"','     '),
+    ('>','<html:span class="ocrx_word"','      '),
+    ('span>','</html:span','     '),
+    ('span>','</html:p','    '),
+    ('p>','</html:div','   '),
+    ('div>','<html','   '),
+    ('div>','<!--','   '))
+
+""" prefixed names for the tags and attributes of a tree, and the namespaces
+    (uri to prefix) that need declaring, the same as ET.tostring() picks them """
+def xmlNames(root):
+    qnames = {None: None}
+    namespaces = {}
+
+    def addName(qname):
+        if qname[:1] == "{":
+            uri, local = qname[1:].rsplit("}", 1)
+            prefix = namespaces.get(uri)
+            if prefix is None:
+                prefix = NS_PREFIXES.get(uri)
+                if prefix is None:
+                    prefix = "ns%d" % len(namespaces)
+                if prefix != "xml":
+                    namespaces[uri] = prefix
+            qnames[qname] = "%s:%s" % (prefix,local) if prefix else local
+        else:
+            qnames[qname] = qname
+
+    for elem in root.iter():
+        tag = elem.tag
+        if isinstance(tag, ET.QName):
+            tag = tag.text
+        if isinstance(tag, str) and tag not in qnames:
+            addName(tag)
+        for k in elem.keys():
+            if isinstance(k, ET.QName):
+                k = k.text
+            if k not in qnames:
+                addName(k)
+
+    return qnames, namespaces
+
+""" inside hocrmod.py additions after a comment with this text, given whether we were before it """
+def modComment(text,in_mod):
+
+    note = (text or '').strip()
+    if note == MOD_START:
+        return True
+    if note == MOD_END:
+        return False
+
+    return in_mod
+
+""" text escaped the same way as ET.tostring() """
+def escapeCdata(text):
+
+    return escape(text)
+
+""" attribute value escaped the same way as ET.tostring() """
+def escapeAttrib(text):
+
+    return escape(text,ATTRIB_ENTITIES)
+
+""" serialize a tree into tokens (tags, comments, text), markup is the same as ET.tostring() """
+def xmlTokens(elem,qnames,namespaces=None):
+    tag = elem.tag
+
+    if tag is ET.Comment:
+        yield "<!--%s-->" % elem.text
+    elif tag is ET.ProcessingInstruction:
+        yield "<?%s?>" % elem.text
+    else:
+        tag = qnames[tag]
+        start = "<" + tag
+        if namespaces:
+            for uri, prefix in sorted(namespaces.items(), key=lambda x: x[1]):
+                start += " xmlns%s=\"%s\"" % (":" + prefix if prefix else "",
+                    escapeAttrib(uri))
+        for k, v in elem.items():
+            if isinstance(k, ET.QName):
+                k = k.text
+            start += " %s=\"%s\"" % (qnames[k],escapeAttrib(v))
+        if elem.text or len(elem):
+            yield start + ">"
+            if elem.text:
+                yield escapeCdata(elem.text)
+            for child in elem:
+                yield from xmlTokens(child,qnames)
+            yield "</" + tag + ">"
+        else:
+            yield start + " />"
+
+    if elem.tail:
+        yield escapeCdata(elem.tail)
+
+""" line_filter - drop empty lines and use the platform line separator on the way out """
+class line_filter:
+    def __init__(self, f, linesep=os.linesep):
+        self.f = f
+        self.linesep = linesep.encode('ascii')
+        self.started = False
+        self.line_empty = True
+
+    def write(self, s):
+        for piece in re.split(r'([\r\n])', s):
+            if piece == '\r' or piece == '\n':
+                self.line_empty = True
+            elif len(piece) > 0:
+                if self.line_empty and self.started:
+                    self.f.write(self.linesep)
+                #same output as ET.tostring(), non-ascii goes out as character references
+                self.f.write(piece.encode('ascii','xmlcharrefreplace'))
+                self.started = True
+                self.line_empty = False
+
+""" write hocr in one pass, keeping xml output in line with Tesseract """
+def writeTessHocr(root,f):
+
+    f.write(TESS_HEADER.encode('utf8'))
+    out = line_filter(f)
+    qnames, namespaces = xmlNames(root)
+
+    prev = ''
+    consumed = {}
+    for token in xmlTokens(root,qnames,namespaces):
+        if len(token) == 0:
+            continue
+        sep = ''
+        for rule, (end, start, indent) in enumerate(TESS_BREAKS):
+            #a match can't reuse the part of the previous token the same rule already matched
+            if (prev.endswith(end) and token.startswith(start) and
+                len(prev) - len(end) >= consumed.get(rule,0)):
+                sep = '\n' + indent
+                break
+        consumed = {} if len(sep) == 0 else {rule: len(start)}
+        out.write(sep + token)
+        prev = token
+
+""" minidom style tokens, text nodes are inlined when they are an element's only child """
+def prettyTokens(elem,qnames,namespaces,indent,addindent):
+    tag = elem.tag
+
+    if tag is ET.Comment:
+        yield "%s<!--%s-->\n" % (indent,elem.text)
+        return
+    if tag is ET.ProcessingInstruction:
+        yield "%s<?%s?>\n" % (indent,elem.text)
+        return
+
+    tag = qnames[tag]
+    start = indent + "<" + tag
+    if namespaces:
+        for uri, prefix in sorted(namespaces.items(), key=lambda x: x[1]):
+            start += " xmlns%s=\"%s\"" % (":" + prefix if prefix else "",
+                prettyData(uri))
+    for k, v in elem.items():
+        if isinstance(k, ET.QName):
+            k = k.text
+        start += " %s=\"%s\"" % (qnames[k],prettyData(v))
+
+    children = len(elem)
+    for child in elem:
+        if child.tail:
+            children += 1
+    if elem.text:
+        children += 1
+
+    if children == 0:
+        yield start + "/>\n"
+    elif children == 1 and elem.text:
+        yield start + ">" + prettyData(prettyText(elem.text)) + "</" + tag + ">\n"
+    else:
+        yield start + ">\n"
+        child_indent = indent + addindent
+        if elem.text:
+            yield prettyData(child_indent + prettyText(elem.text) + "\n")
+        for child in elem:
+            yield from prettyTokens(child,qnames,None,child_indent,addindent)
+            if child.tail:
+                yield prettyData(child_indent + prettyText(child.tail) + "\n")
+        yield indent + "</" + tag + ">\n"
+
+""" minidom escaping """
+def prettyData(data):
+
+    return data.replace("&", "&amp;").replace("<", "&lt;").replace(
+        "\"", "&quot;").replace(">", "&gt;")
+
+""" text as a parser would hand it back, with line ends normalized """
+def prettyText(text):
+
+    return text.replace("\r\n","\n").replace("\r","\n")
+
+""" write hocr in one pass, same layout as minidom's toprettyxml() """
+def writePrettyHocr(root,f,indent="   "):
+
+    f.write('<?xml version="1.0" ?>\n')
+    qnames, namespaces = xmlNames(root)
+    for token in prettyTokens(root,qnames,namespaces,"",indent):
+        f.write(token)
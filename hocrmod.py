@@ -7,6 +7,11 @@ Usage (see list of options):
 For example:
     hocrmod.py -f sim1.jpg
     hocrmod.py -f sim1.jpg -d
+    hocrmod.py -s scans/ -w 8
+    hocrmod.py -f sim1.jpg -j 4
+    hocrmod.py -f sim1.jpg -j 4 -e worker
+    hocrmod.py -f sim1.jpg -m
+    hocrmod.py -f sim1.jpg --cache ocr_cache
 
 Assumes that hocr file has the same base name,
 e.g. sim1.hocr and is located in the same
@@ -21,6 +26,37 @@ original will be renamed with a 'bak' extension
 and a new hocr file with the additions will
 be created.
 
+Use '-s' with a directory, glob pattern (quoted),
+manifest file (one image path per line) or just
+one image to run a batch of pages across a pool
+of '-w' worker processes, largest images first. With '--state',
+finished pages are recorded so that a re-run only
+redoes pages whose image, hocr or options changed.
+With '--pipeline', the batch runs in one process
+instead, with reading, region finding, OCR and
+merging of different pages overlapping (see
+pagepipeline.py).
+
+With '--serve', it stays up as a service on
+localhost, taking pages over HTTP with the engine
+kept warm between them (see hocrserver.py).
+
+With '--index', the words of the hocr also go
+into a binary sidecar (.words) that can be memory
+mapped without parsing XML (see hocrindex.py).
+
+A multi-page tiff goes with one hocr file for all
+of its pages, frames are matched to ocr_page divs
+(by ppageno, or in order), run across '-w' worker
+processes and written back as one hocr file.
+
+It can also be used from python, each call keeps
+its own state:
+    import hocrmod
+    result = hocrmod.processPage("sim1.jpg",
+        hocrmod.pageOptions(engine="worker", jobs=4))
+    print(result.lines)
+
 Use the '-d' flag to see the process. Some simple
 opencv tricks to gather up the missing pieces,
 kudos to Tesseract for getting most of what's 
@@ -30,15 +66,56 @@ there almost all of the time.
 """
 
 import xml.etree.ElementTree as ET
-import argparse, glob, math, os, sys
+import argparse, bisect, concurrent.futures, contextlib, copy, glob, io, math, os, shutil, sys
+import threading
 import cv2
-import pytesseract
-import copy
+import numpy as np
+import batchstate, hocrindex, hocrio, hocrwords, ocrengine, pagemetrics
 
 #namespace for HOCR
 HOCR_NS = 'http://www.w3.org/1999/xhtml'
 ET.register_namespace('html', HOCR_NS)
 
+#white space between regions stacked in a montage, and the tallest montage
+#to hand to tesseract (which tops out at 32767 pixels)
+MONTAGE_GUTTER = 50
+MONTAGE_MAX = 30000
+
+#resolution the region detection kernels are tuned for, and the range
+#of header values that are taken to be a real scanning resolution
+BASE_DPI = 300
+MIN_SCAN_DPI = 150
+MAX_SCAN_DPI = 2400
+
+#rows of the page masked at a time when blocking out recognized text,
+#and the cell size used for coverage checks against the mask
+MASK_BAND = 512
+MASK_CELL = 4
+
+#prefilters for scoring regions all at once: smallest area (at BASE_DPI),
+#longest side to shortest side, and share already recognized
+MIN_REGION_AREA = 400
+MAX_ASPECT = 50
+MAX_COVERED = 0.95
+
+#rows of the page run through the region detection filters at a time
+DETECT_BAND = 1024
+#rows of the page summed at a time when scoring regions with '-g'
+SCORE_BAND = 256
+
+#grid cell size for looking up page level separator lines
+SEP_CELL = 256
+
+#scratch arrays for the page stages, kept per thread and shared between the stages of a page
+work_buffers = threading.local()
+
+#image types picked up in batch mode
+IMG_EXTS = ('.jpg','.jpeg','.png','.tif','.tiff','.jp2','.bmp')
+
+#options that change what ends up in the hocr, a batch page is redone if any change
+STATE_PARAMS = ('border','arguments','conf','lang','engine','montage','words',
+    'reduce','dpi','integral','pagelines')
+
 """ page_region - a rectangle on the image """
 class page_region:
     def __init__(self, x0, y0, x1, y1):
@@ -57,25 +134,70 @@ class word_region:
         self.wconf = wconf
         self.added = False
 
-""" par - paragraph hocr """
+""" region_index - missed paragraphs keyed by their top-left word in reading order,
+    a paragraph goes in ahead of the first block that starts after any of its words """
+class region_index:
+    def __init__(self, par_regions):
+        groups = {}
+        for regions in par_regions:
+            for region in regions:
+                groups.setdefault(region.wident,[]).append(region)
+
+        #dicts keep insertion order, which is the order paragraphs are added in
+        self.groups = sorted((min((w.wregion.x0,w.wregion.y0) for w in words),pos,words)
+            for pos, words in enumerate(groups.values()))
+        self.keys = [g[0] for g in self.groups]
+        self.placed = 0
+
+    #paragraphs to put in before a block starting at x0,y0
+    def before(self, x0, y0):
+        upto = bisect.bisect_left(self.keys,(x0,y0))
+        found = self.groups[self.placed:upto]
+        self.placed = max(self.placed,upto)
+
+        return [words for _, _, words in sorted(found,key=lambda g: g[1])]
+
+    #whatever is left goes at the end of the page
+    def remaining(self):
+        found = self.groups[self.placed:]
+        self.placed = len(self.groups)
+
+        return [words for _, _, words in sorted(found,key=lambda g: g[1])]
+
+""" page_state - numbering and settings for one page, nothing is shared between calls """
+class page_state:
+    def __init__(self, page=None, quiet=False, metrics=False):
+        #hocr numbering starts at 1
+        self.page_cnt = 1
+        self.block_cnt = 1
+        self.par_cnt = 1
+        self.line_cnt = 1
+        self.word_cnt = 1
+        self.lines = 0
+        self.quiet = quiet
+        #does nothing without '--metrics'
+        self.metrics = pagemetrics.page_metrics(page,metrics)
+
+    #progress dots, turned off with '-q'
+    def progress(self, text):
+        if not self.quiet:
+            print(text,end="",flush=True)
+
+""" page_result - what processPage() did to a page """
+class page_result:
+    def __init__(self, hocr_file, lines, candidates, metrics, cache_counts=None):
+        self.hocr_file = hocr_file
+        self.lines = lines
+        self.candidates = candidates
+        self.metrics = metrics
+        self.cache_counts = cache_counts
+
+""" par - paragraph hocr, mregion is set when the region was OCR'd as part of a montage """
 class par_region:
-    def __init__(self, phocr, pregion):
+    def __init__(self, phocr, pregion, mregion=None):
         self.phocr = phocr
         self.pregion = pregion
-
-""" avoid passing through divs with no text """
-def isTextinDiv(elem):
-    words = ''
-
-    for word_elem in elem.iterfind('.//{%s}%s' % (HOCR_NS,'span')):
-        class_name = word_elem.attrib['class']
-        if class_name == 'ocrx_word':
-            words += word_elem.text
-
-    if len(words.strip()) > 0:
-        return True
-
-    return False
+        self.mregion = mregion
 
 """ pull coords and sometimes conf from bbox string """
 def getBBoxInfo(bbox_str):
@@ -96,8 +218,7 @@ def getBBoxInfo(bbox_str):
     return x0,y0,x1,y1,conf
 
 """ adjust numbers for hocr to reflect additions """
-def adjustCounts(element):
-    global page_cnt, block_cnt, par_cnt, line_cnt, word_cnt
+def adjustCounts(element,state):
 
     for elem in element.iter():
         elem_tag = '%s' % elem.tag
@@ -105,19 +226,19 @@ def adjustCounts(element):
             elem_tag = elem_tag.split('}', 1)[1]  #strip namespace
         if elem_tag == "div":
             if elem.attrib["class"] == 'ocr_carea':
-                elem.set('id','block_%d_%d' % (page_cnt,block_cnt))
-                block_cnt += 1
+                elem.set('id','block_%d_%d' % (state.page_cnt,state.block_cnt))
+                state.block_cnt += 1
         if elem_tag == "p":
             if elem.attrib["class"] == 'ocr_par':
-                elem.set('id','par_%d_%d' % (page_cnt,par_cnt))
-                par_cnt += 1
+                elem.set('id','par_%d_%d' % (state.page_cnt,state.par_cnt))
+                state.par_cnt += 1
         if elem_tag == "span":
             if elem.attrib["class"] == 'ocr_line':
-                elem.set('id','line_%d_%d' % (page_cnt,line_cnt))
-                line_cnt += 1
+                elem.set('id','line_%d_%d' % (state.page_cnt,state.line_cnt))
+                state.line_cnt += 1
             if elem.attrib["class"] == 'ocrx_word':
-                elem.set('id','word_%d_%d' % (page_cnt,word_cnt))
-                word_cnt += 1
+                elem.set('id','word_%d_%d' % (state.page_cnt,state.word_cnt))
+                state.word_cnt += 1
             
 """ look for limits of coord boxes """
 def calcBoxLimit(low_x, low_y, high_x, high_y, region):
@@ -134,8 +255,7 @@ def calcBoxLimit(low_x, low_y, high_x, high_y, region):
     return low_x, low_y, high_x, high_y
 
 """ create div for entry representing missed regions """
-def sortOutDiv(wident,div_element,par_regions,lang):
-    global lines
+def sortOutDiv(div_element,words,lang,state):
 
     l_low_x = 0
     l_low_y = 0
@@ -150,91 +270,118 @@ def sortOutDiv(wident,div_element,par_regions,lang):
     p_element.set('class','ocr_par')
     p_element.set('lang',lang)
 
-    for regions in par_regions:
-        wline = ''
-        l_element = None
-
-        for region in regions:
-            if not region.added and wident==region.wident:
-                w_element = ET.Element(ET.QName(HOCR_NS,"span"))
-                w_element.set('class','ocrx_word')
-                w_element.text = region.wtext
-                w_element.set('title','bbox %d %d %d %d; x_wconf %d' %
-                    (region.wregion.x0,region.wregion.y0,
-                    region.wregion.x1,region.wregion.y1,
-                    region.wconf))
-
-                if wline != region.wline:
-                    if l_element is not None:
-                        p_element.append(l_element)
-                        lines += 1
-
-                    l_element = ET.Element(ET.QName(HOCR_NS,"span"))
-                    l_element.set('class','ocr_line')
-                    l_low_x = 0
-                    l_low_y = 0
-                    l_high_x = 0
-                    l_high_y = 0
-
-                l_low_x, l_low_y, l_high_x, l_high_y = calcBoxLimit(
-                    l_low_x, l_low_y, l_high_x, l_high_y, region)
-                l_element.append(w_element)
-                wline = region.wline
-                l_element.set('title','bbox %d %d %d %d; %s' %
-                    (l_low_x,l_low_y,l_high_x,l_high_y,wline))
-               
-                p_low_x, p_low_y, p_high_x, p_high_y = calcBoxLimit(
-                    p_low_x, p_low_y, p_high_x, p_high_y, region)
-                region.added = True
-
-        if l_element is not None:
-            p_element.append(l_element)
-            lines += 1
-            p_element.set('title','bbox %d %d %d %d' %
-                (p_low_x, p_low_y, p_high_x, p_high_y))
-            div_element.append(p_element)
-            p_element = ET.Element(ET.QName(HOCR_NS,"p"))
-            p_element.set('class','ocr_par')
+    wline = ''
+    l_element = None
+
+    for region in words:
+        w_element = ET.Element(ET.QName(HOCR_NS,"span"))
+        w_element.set('class','ocrx_word')
+        w_element.text = region.wtext
+        w_element.set('title','bbox %d %d %d %d; x_wconf %d' %
+            (region.wregion.x0,region.wregion.y0,
+            region.wregion.x1,region.wregion.y1,
+            region.wconf))
+
+        if wline != region.wline:
+            if l_element is not None:
+                p_element.append(l_element)
+                state.lines += 1
+
+            l_element = ET.Element(ET.QName(HOCR_NS,"span"))
+            l_element.set('class','ocr_line')
+            l_low_x = 0
+            l_low_y = 0
+            l_high_x = 0
+            l_high_y = 0
+
+        l_low_x, l_low_y, l_high_x, l_high_y = calcBoxLimit(
+            l_low_x, l_low_y, l_high_x, l_high_y, region)
+        l_element.append(w_element)
+        wline = region.wline
+        l_element.set('title','bbox %d %d %d %d; %s' %
+            (l_low_x,l_low_y,l_high_x,l_high_y,wline))
+       
+        p_low_x, p_low_y, p_high_x, p_high_y = calcBoxLimit(
+            p_low_x, p_low_y, p_high_x, p_high_y, region)
+        region.added = True
+
+    if l_element is not None:
+        p_element.append(l_element)
+        state.lines += 1
+        p_element.set('title','bbox %d %d %d %d' %
+            (p_low_x, p_low_y, p_high_x, p_high_y))
+        div_element.append(p_element)
                     
 """ add new div and put comments before/after """
-def addAndComment(wident,regions,parent_node,lang):
+def addAndComment(words,parent_node,lang,state):
 
     div_element = ET.Element(ET.QName(HOCR_NS,"div"))
     div_element.set('class','ocr_carea')
-    sortOutDiv(wident,div_element,regions,lang)
-    adjustCounts(div_element)
-    div_comment = ET.Comment(' START HOCRMOD ')
+    sortOutDiv(div_element,words,lang,state)
+    adjustCounts(div_element,state)
+    div_comment = ET.Comment(' %s ' % hocrio.MOD_START)
     parent_node.append(div_comment)
     parent_node.append(div_element)
-    div_comment = ET.Comment(' END HOCRMOD ')
+    div_comment = ET.Comment(' %s ' % hocrio.MOD_END)
     parent_node.append(div_comment)
 
 """ try to insert new divs for missed regions based on coordinates """
-def sortOutElement(elem, par_regions, parent_node,lang):
-    global page_cnt, block_cnt, par_cnt, line_cnt, word_cnt
+def sortOutElement(elem, rindex, parent_node,lang,state):
 
+    #coordinate placement could be more sophisticated but basic for now
     x0,y0,x1,y1,_ = getBBoxInfo(elem.attrib['title'])
-    for regions in par_regions:
-        for region in regions:
-            #coordinate placement could be more sophisticated but basic for now
-            if x0 > region.wregion.x0 or (x0 == region.wregion.x0 and y0 > region.wregion.y0):
-                if not region.added:
-                    addAndComment(region.wident,par_regions,parent_node,lang)
-
-""" remove all divs except for parent page """
-def stripPage(orig_page):
-    parent_node = None
+    for words in rindex.before(x0,y0):
+        addAndComment(words,parent_node,lang,state)
 
-    for elem in orig_page.iter():
-        if elem.tag.startswith("{"):
-            elem_tag = elem.tag.split('}', 1)[1]  #strip namespace
-        if elem_tag == "div":
-            if elem.attrib["class"] == 'ocr_page':
+""" strip namespace from tag """
+def localTag(elem):
+    elem_tag = '%s' % elem.tag
+    if elem_tag.startswith("{"):
+        elem_tag = elem_tag.split('}', 1)[1]
+
+    return elem_tag
+
+""" single pass through the hocr, keep blocks with text and slot missed regions in as we go """
+def mergePage(hocr_file,rindex,lang,state):
+    root = None
+    parent_node = None
+    stack = []
+    careas = []
+
+    for event, elem in ET.iterparse(hocr_file, events=('start','end')):
+        elem_tag = localTag(elem)
+        class_name = elem.attrib.get('class')
+        if event == 'start':
+            if root is None:
+                root = elem
+            if elem_tag == 'div' and class_name == 'ocr_page':
                 parent_node = elem
-                for child in list(elem): #list is needed for this to work
-                    elem.remove(child)
+            if elem_tag == 'div' and class_name == 'ocr_carea':
+                careas.append(False)
+            stack.append(elem)
+            continue
+
+        stack.pop()
+        parent = stack[-1] if len(stack) > 0 else None
+        if elem_tag == 'span' and class_name == 'ocrx_word':
+            #weed out empty divs
+            if len(careas) > 0 and elem.text is not None and len(elem.text.strip()) > 0:
+                careas[-1] = True
+        elif elem_tag == 'div' and class_name == 'ocr_carea':
+            has_text = careas.pop()
+            if parent is not None:
+                parent.remove(elem)
+            if has_text and parent_node is not None:
+                sortOutElement(elem, rindex, parent_node,lang,state)
+                adjustCounts(elem,state)
+                parent_node.append(elem)
+            continue
+
+        #only text blocks are kept on the page
+        if parent is not None and parent is parent_node:
+            parent.remove(elem)
 
-    return parent_node
+    return ET.ElementTree(root), parent_node
 
 """ sort by coordnates """
 def coordSort(k):
@@ -245,156 +392,230 @@ def coordSort(k):
 def writeModHocr(orig_page,hocr_file):
 
     with open(hocr_file, 'wb') as f:
-        f.write("<?xml version=\"1.0\" encoding=\"UTF-8\"?>\n".encode('utf8'))
-        f.write("<!DOCTYPE html PUBLIC \"-//W3C//DTD XHTML 1.0 Transitional//EN\"\n".encode('utf8'))
-        f.write("    \"http://www.w3.org/TR/xhtml1/DTD/xhtml1-transitional.dtd\">\n".encode('utf8'))
-        root = orig_page.getroot()
-        rstr = ET.tostring(root)
-        rstr = rstr.decode('utf8')
-        #clean up hocr additions - could use minidom pretty printing but this covers most scenarios
-        rstr = rstr.replace('--><','-->\n   <')
-        rstr = rstr.replace('\"><html:p','\">\n    <html:p')
-        rstr = rstr.replace('><html:span class=\"ocr_line\"',
-            '>\n     <html:span class=\"ocr_line\"')
-        rstr = rstr.replace('><html:span class=\"ocrx_word\"',
-            '>\n      <html:span class=\"ocrx_word\"')
-        rstr = rstr.replace('><html:span class=\"ocrx_word\"',
-            '>\n      <html:span class=\"ocrx_word\"')
-        rstr = rstr.replace('span></html:span',
-            'span>\n     </html:span')
-        rstr = rstr.replace('span></html:p',
-            'span>\n    </html:p')
-        rstr = rstr.replace('p></html:div',
-            'p>\n   </html:div')
-        rstr = rstr.replace('div><html',
-            'div>\n   <html')
-        rstr = rstr.replace('div><!--',
-            'div>\n   <!--')
-        #remove blank lines (if any) - these sometimes creep in hocr files for some reason
-        rstr = os.linesep.join([s for s in rstr.splitlines() if s])
-        f.write(rstr.encode('utf8'))
-        f.close()
+        hocrio.writeTessHocr(orig_page.getroot(),f)
 
 """ these are the paragraph regions coming from missed regions """
-def runThruPars(img_base,pars,orig_page,conf,lang):
-    global page_cnt, block_cnt, par_cnt, line_cnt, word_cnt
+def runThruPars(hocr_file,pars,conf,lang,state):
+
+    orig_page = mergeRegions(hocr_file,pars,conf,lang,state)
+    if orig_page is None:
+        return
+
+    if os.path.exists(hocr_file):
+        os.rename(hocr_file, hocr_file + '.bak')
+    with state.metrics.stage("writeModHocr"):
+        writeModHocr(orig_page,hocr_file)
+
+""" slot the missed regions into the hocr (a file, or file object for one page),
+    None if none of them had any words that made the cut """
+def mergeRegions(hocr_file,pars,conf,lang,state):
 
     par_regions = []
     for par in pars:
-        regions = sortOutHocr(str(len(par_regions)),par.phocr,par.pregion,conf)
+        with state.metrics.stage("sortOutHocr"):
+            regions = sortOutHocr(str(len(par_regions)),par.phocr,par.pregion,conf,
+                par.mregion,state)
         if (len(regions) > 0):
             par_regions.append(regions)
 
     par_regions.sort(key=coordSort)
 
-    #make a copy - this will be used for stepping through existing divs
-    ref_copy = copy.deepcopy(orig_page)
-    parent_node = stripPage(orig_page)
-
-    for elem in ref_copy.iterfind('.//{%s}%s' % (HOCR_NS,'div')):
-        #weed out empty divs
-        if isTextinDiv(elem):
-            class_name = elem.attrib['class']
-            if class_name == 'ocr_carea':
-                sortOutElement(elem, par_regions, parent_node,lang)
-                adjustCounts(elem)
-                parent_node.append(elem)
+    if len(par_regions) == 0:
+        return None
+
+    rindex = region_index(par_regions)
+    orig_page, parent_node = mergePage(hocr_file,rindex,lang,state)
 
     #add anything that's left at the end of page div
-    for regions in par_regions:
-        for region in regions:
-            if not region.added:
-                addAndComment(region.wident,par_regions,parent_node,lang)
+    for words in rindex.remaining():
+        addAndComment(words,parent_node,lang,state)
 
-    if len(par_regions) > 0:
-        if os.path.exists(img_base + '.hocr'):
-            os.rename(img_base + '.hocr', img_base + '.hocr.bak')
-        writeModHocr(orig_page,img_base + '.hocr')
+    return orig_page
 
 """ pull together paragraphs from hocr file """
-def sortOutHocr(HOCRfile,HOCRimg,HOCRregion,HOCRconf):
+def sortOutHocr(HOCRfile,HOCRimg,HOCRregion,HOCRconf,HOCRslot=None,state=None):
     img_regions = []
 
-    if HOCRimg is None:
-        tree = ET.ElementTree(file=HOCRfile)
+    #montage hocr is read once for all of its regions
+    if isinstance(HOCRimg,hocrwords.page_words):
+        words = HOCRimg
     else:
-        tree = ET.ElementTree(ET.fromstring(HOCRimg))
-
-    for elem in tree.iterfind('.//{%s}%s' % (HOCR_NS,'p')):
-        line_info = None
-        if 'class' in elem.attrib:
-            class_name = elem.attrib['class']
-            if class_name == 'ocr_par': 
-                words = ''
-                for word_elem in elem.iterfind('.//{%s}%s' % (HOCR_NS,'span')):
-                    class_name = word_elem.attrib['class']
-                    if class_name == 'ocr_line': #save line infos
-                        line_info = word_elem.attrib['title']
-                        line_index = line_info.find(';')
-                        line_info = line_info[line_index + 1:]
-                    if class_name == 'ocrx_word': #word details
-                        word_text = word_elem.text.strip()
-                        if HOCRimg is not None and len(word_text) > 0:
-                            x0,y0,x1,y1,conf = getBBoxInfo(
-                                word_elem.attrib['title'])
-                            if conf >= HOCRconf:
-                                img_regions.append(
-                                    word_region(page_region(HOCRregion.x0+x0,
-                                    HOCRregion.y0+y0,HOCRregion.x0+x1,
-                                    HOCRregion.y0+y1),
-                                    HOCRfile + '_' + elem.attrib['id'],
-                                    word_text,line_info,conf))
-                        words += word_text
-                #skip para blocks that don't have any text
-                if len(words.strip()) > 0 and HOCRimg is None:
-                    print(".",end="",flush=True)
-                    x0,y0,x1,y1,_ = getBBoxInfo(elem.attrib['title'])
-                    img_regions.append(page_region(x0,y0,x1,y1))
+        words = hocrwords.loadWords(HOCRimg)
+
+    idx = np.arange(len(words))
+    bbox = words.bbox
+    if HOCRslot is not None:
+        #only words with their middle in the slot, offset by where the
+        #region sits in the montage
+        cx = (bbox[:,0] + bbox[:,2]) // 2
+        cy = (bbox[:,1] + bbox[:,3]) // 2
+        idx = np.flatnonzero((HOCRslot.x0 <= cx) & (cx < HOCRslot.x1) &
+            (HOCRslot.y0 <= cy) & (cy < HOCRslot.y1))
+        bbox = bbox[idx] - np.array([HOCRslot.x0,HOCRslot.y0,HOCRslot.x0,HOCRslot.y0])
+
+    ok = words.conf[idx] >= HOCRconf
+    if state is not None:
+        state.metrics.count('words_dropped',int((~ok).sum()))
+        state.metrics.count('words_kept',int(ok.sum()))
+
+    for (x0,y0,x1,y1), i in zip(bbox[ok].tolist(),idx[ok]):
+        img_regions.append(
+            word_region(page_region(HOCRregion.x0+x0,
+            HOCRregion.y0+y0,HOCRregion.x0+x1,
+            HOCRregion.y0+y1),
+            HOCRfile + '_' + words.par_ids[words.par[i]],
+            words.text(i),words.lines[words.line[i]],int(words.conf[i])))
 
     return img_regions
 
-""" use paragraph coords to remove already recognized sections """
-def runThruHocr(ifile,ibase,iborder,debug):
-
-    print("sort through hocr paragraphs...",end="",flush=True)
-    pg_regions = sortOutHocr(ibase + '.hocr',None,None,None)
-    print("!") #hocr processing is done
-
-    im = cv2.imread(ifile)
-    print("block out recognized text...",end="",flush=True)
-    for i,region in enumerate(pg_regions):
-        print(".",end="",flush=True)
-        x0 = region.x0 - iborder
-        y0 = region.y0 - iborder
-        x1 = region.x1 + iborder
-        y1 = region.y1 + iborder
-        w = region.x1 - region.x0
-        h = region.y1 - region.y0
-
-        if w > 0 and h > 0:
-            cv2.rectangle(im, (x0,y0), (x1,y1), (255,255,255), -1)
-
-    print("!")
+""" paragraph (or word) boxes with text from the base hocr, one row of x0,y0,x1,y1 each """
+def hocrBoxes(hocr_file,words):
+
+    page = hocrwords.loadWords(hocr_file)
+    if words:
+        return page.bbox
+
+    #skip para blocks that don't have any text
+    return page.par_bbox[page.par_text]
+
+""" scratch array for a page stage, reused (and only ever grown) until releaseBuffers(),
+    contents are left over from the last stage that used it """
+def workBuffer(name,shape,dtype=np.uint8):
+    arrays = work_buffers.__dict__.setdefault('arrays',{})
+    size = int(np.prod(shape)) * np.dtype(dtype).itemsize
+    buf = arrays.get(name)
+    if buf is None or buf.size < size:
+        buf = arrays[name] = np.empty(size,dtype=np.uint8)
+
+    return buf[:size].view(dtype).reshape(shape)
+
+""" let go of the scratch arrays for this thread, once a page is done with them """
+def releaseBuffers():
+
+    work_buffers.__dict__.pop('arrays',None)
+
+""" text_mask - everything Tesseract already recognized on the page """
+class text_mask:
+    def __init__(self, boxes, shape, border):
+        h, w = shape[:2]
+        #same area cv2.rectangle() would fill, with exclusive ends
+        boxes = boxes[(boxes[:,2] > boxes[:,0]) & (boxes[:,3] > boxes[:,1])]
+        boxes = boxes + np.array([-border,-border,border + 1,border + 1])
+        boxes[:,[0,2]] = boxes[:,[0,2]].clip(0,w)
+        boxes[:,[1,3]] = boxes[:,[1,3]].clip(0,h)
+        self.boxes = boxes[(boxes[:,2] > boxes[:,0]) & (boxes[:,3] > boxes[:,1])]
+        #its own array, a mask can outlive the stage that made it
+        self.mask = np.zeros((h,w),dtype=np.uint8)
+        self.cells = None
+
+        #fill the boxes a band of rows at a time, summing corner marks
+        #is done in one go per band rather than box by box
+        for top in range(0,h,MASK_BAND):
+            bottom = min(top + MASK_BAND,h)
+            rows = self.boxes[(self.boxes[:,1] < bottom) & (self.boxes[:,3] > top)]
+            if len(rows) == 0:
+                continue
+            y0 = rows[:,1].clip(top,bottom) - top
+            y1 = rows[:,3].clip(top,bottom) - top
+            marks = np.zeros((bottom - top + 1,w + 1),dtype=np.int32)
+            np.add.at(marks,(y0,rows[:,0]),1)
+            np.add.at(marks,(y0,rows[:,2]),-1)
+            np.add.at(marks,(y1,rows[:,0]),-1)
+            np.add.at(marks,(y1,rows[:,2]),1)
+            marks = marks.cumsum(axis=0,dtype=np.int32).cumsum(axis=1,dtype=np.int32)
+            self.mask[top:bottom][marks[:-1,:-1] > 0] = 255
+
+    #white out the recognized text in place
+    def apply(self, gray):
+        cv2.max(gray,self.mask,dst=gray)
+
+    #share of a rectangle (exclusive ends) that is already recognized
+    def covered(self, x0, y0, x1, y1):
+        area = (x1 - x0) * (y1 - y0)
+        if area <= 0:
+            return 0.0
+
+        return cv2.countNonZero(self.mask[y0:y1, x0:x1]) / area
+
+    #any recognized box touching a rectangle (exclusive ends)
+    def overlaps(self, x0, y0, x1, y1):
+        b = self.boxes
+
+        return bool(((b[:,0] < x1) & (b[:,2] > x0) & (b[:,1] < y1) & (b[:,3] > y0)).any())
+
+    #approximate share recognized for many x,y,w,h rects at once, from an
+    #integral image of the mask at MASK_CELL resolution
+    def coverage(self, rects):
+        if self.cells is None:
+            h, w = self.mask.shape
+            small = cv2.resize(self.mask,(-(-w // MASK_CELL),-(-h // MASK_CELL)),
+                interpolation=cv2.INTER_AREA)
+            self.cells = cv2.integral(small,sdepth=cv2.CV_64F) / 255
+        x0 = rects[:,0] // MASK_CELL
+        y0 = rects[:,1] // MASK_CELL
+        x1 = np.maximum(-(-(rects[:,0] + rects[:,2]) // MASK_CELL),x0 + 1)
+        y1 = np.maximum(-(-(rects[:,1] + rects[:,3]) // MASK_CELL),y0 + 1)
+        c = self.cells
+
+        return ((c[y1,x1] - c[y0,x1] - c[y1,x0] + c[y0,x0]) /
+            ((x1 - x0) * (y1 - y0)))
+
+""" gray copy of an image file or array (BGR or gray), it gets written on """
+def grayImage(image):
+
+    if isinstance(image,str):
+        gray = cv2.imread(image,cv2.IMREAD_GRAYSCALE)
+        if gray is None:
+            raise ValueError("cannot read image %s" % image)
+        return gray
+    if len(image.shape) == 3:
+        return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+
+    return image.copy()
+
+""" use paragraph (or word) coords to remove already recognized sections """
+def runThruHocr(image,hocr_file,ibase,iborder,debug,words,state):
+
+    state.progress("sort through hocr %s..." % ("words" if words else "paragraphs"))
+    boxes = hocrBoxes(hocr_file,words)
+    state.progress("!\n") #hocr processing is done
+
+    #everything downstream works in gray
+    im = grayImage(image)
+
+    return im, blockOut(im,boxes,ibase,iborder,debug,state)
+
+""" white out the recognized text on the (gray) page in place """
+def blockOut(im,boxes,ibase,iborder,debug,state):
+
+    state.progress("block out recognized text...")
+    tmask = text_mask(boxes,im.shape,iborder)
+    tmask.apply(im)
+    state.progress("!\n")
     if debug:
         #write out blocked image for troubleshooting
         cv2.imwrite(ibase +'_regions.jpg', im)
 
-    return im
-
-""" weed out horizontal or vertical line """
-def getSLine(roi,iborder):
+    return tmask
 
-    #Tesseract (rightfully) ignores separator lines for the most part,
-    #which means they can be legion afterwards, try to blank them out
-    #rather than completely removing since they might be part of extrude
-    #into missing text
+""" find separator segments with a hough transform, one row of x0,y0,x1,y1 each """
+def houghLines(gray):
 
-    dst = cv2.Canny(roi, 50, 200, None, 3)
+    dst = cv2.Canny(gray, 50, 200, workBuffer('bin',gray.shape[:2]), 3)
     #use explicit parameters - see https://stackoverflow.com/questions/35609719/opencv-houghlinesp-parameters
     slines = cv2.HoughLinesP(dst, rho = 1, theta = math.pi / 180,
         threshold = 200, minLineLength=200, maxLineGap=50)
 
     if slines is None:
+        return np.zeros((0,4),dtype=np.int64)
+
+    #opencv 4 hands back (n,1,4), opencv 5 (n,4)
+    return slines.reshape(-1,4).astype(np.int64)
+
+""" area to blank out to cover separator segments, with border """
+def sepExtent(slines,iborder):
+
+    if len(slines) == 0:
         return []
 
     x0 = 0
@@ -402,8 +623,7 @@ def getSLine(roi,iborder):
     x1 = 0
     y1 = 0
 
-    for i in range(0, len(slines)):
-        coords = slines[i][0]
+    for coords in slines:
         if coords[0] < x0 or x0 == 0:
             x0 = coords[0]
         if coords[1] < y0 or y0 == 0:
@@ -419,86 +639,349 @@ def getSLine(roi,iborder):
     if y0 > iborder:
         y0 -= iborder
 
-    return [x0,y0,x1 + iborder,y1 + iborder]
+    return [int(x0),int(y0),int(x1 + iborder),int(y1 + iborder)]
 
-""" extract remaining candidate text blocks """
-def runThruContours(ibase,im,debug,tess_args,iborder,lang):
-    pars = []
- 
-    print("look for missed text blocks...",end="",flush=True)
-    img = im.copy()
-    #convert the image to gray scale
-    gray = cv2.cvtColor(im, cv2.COLOR_BGR2GRAY)
-    print(".",end="",flush=True)
-
-    #get image ready for detecting text clusters
-    bin = cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_MEAN_C, 
-        cv2.THRESH_BINARY_INV, 3, 9)
-    bin = cv2.medianBlur(bin, 3)
-    print(".",end="",flush=True)
+""" weed out horizontal or vertical line """
+def getSLine(roi,iborder):
 
-    #use a fairly large kernel to try to keep sentences together
-    kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (20, 20))
-    bin = cv2.dilate(bin, kernel, iterations=2)
-    bin = cv2.GaussianBlur(bin, (45,45),0)
-    print(".",end="",flush=True)
+    #Tesseract (rightfully) ignores separator lines for the most part,
+    #which means they can be legion afterwards, try to blank them out
+    #rather than completely removing since they might be part of extrude
+    #into missing text
 
-    ret, bin = cv2.threshold(bin, 0,255, cv2.THRESH_BINARY)       
+    return sepExtent(houghLines(roi),iborder)
+
+""" clip a segment to a rectangle (exclusive ends), None if it misses """
+def clipSegment(seg,x0,y0,x1,y1):
+    sx, sy, ex, ey = (float(v) for v in seg)
+    dx = ex - sx
+    dy = ey - sy
+    t0 = 0.0
+    t1 = 1.0
+
+    #liang-barsky, pixel coords so the far edges are x1 - 1, y1 - 1
+    for p, q in ((-dx,sx - x0),(dx,x1 - 1 - sx),(-dy,sy - y0),(dy,y1 - 1 - sy)):
+        if p == 0:
+            if q < 0:
+                return None
+        else:
+            t = q / p
+            if p < 0:
+                t0 = max(t0,t)
+            else:
+                t1 = min(t1,t)
+    if t0 > t1:
+        return None
+
+    return (int(round(sx + t0 * dx)),int(round(sy + t0 * dy)),
+        int(round(sx + t1 * dx)),int(round(sy + t1 * dy)))
+
+""" page_lines - separator segments found once for the whole page, bucketed
+    in a grid so each region only looks at the segments that cross it """
+class page_lines:
+    def __init__(self, gray):
+        self.slines = houghLines(gray)
+        self.grid = {}
+
+        for i, (x0,y0,x1,y1) in enumerate(self.slines):
+            for cx in range(min(x0,x1) // SEP_CELL,max(x0,x1) // SEP_CELL + 1):
+                for cy in range(min(y0,y1) // SEP_CELL,max(y0,y1) // SEP_CELL + 1):
+                    self.grid.setdefault((cx,cy),[]).append(i)
+
+    #segments crossing a region, clipped and in region coordinates
+    def within(self, x, y, w, h):
+        found = set()
+        for cx in range(x // SEP_CELL,(x + w - 1) // SEP_CELL + 1):
+            for cy in range(y // SEP_CELL,(y + h - 1) // SEP_CELL + 1):
+                found.update(self.grid.get((cx,cy),()))
+
+        segs = []
+        for i in sorted(found):
+            seg = clipSegment(self.slines[i],x,y,x + w,y + h)
+            if seg is not None:
+                segs.append((seg[0] - x,seg[1] - y,seg[2] - x,seg[3] - y))
+
+        return segs
+
+    #same as getSLine() for a region, without running hough on it
+    def getSLine(self, x, y, w, h, iborder):
+
+        return sepExtent(self.within(x,y,w,h),iborder)
+
+""" stack regions into as few montages as possible, separated by white gutters """
+def buildMontages(rois):
+    montages = []
+    stack = []
+    height = MONTAGE_GUTTER
+
+    for roi, region in rois:
+        h = roi.shape[0]
+        if len(stack) > 0 and height + h + MONTAGE_GUTTER > MONTAGE_MAX:
+            montages.append(pasteMontage(stack,height))
+            stack = []
+            height = MONTAGE_GUTTER
+        stack.append((roi,region,height))
+        height += h + MONTAGE_GUTTER
+
+    if len(stack) > 0:
+        montages.append(pasteMontage(stack,height))
+
+    return montages
+
+""" put a stack of regions on a white background, keep track of the slots """
+def pasteMontage(stack,height):
+    width = max(roi.shape[1] for roi, _, _ in stack) + 2 * MONTAGE_GUTTER
+    mimg = np.full((height,width) + stack[0][0].shape[2:],255,
+        dtype=stack[0][0].dtype)
+    slots = []
+
+    for roi, region, y in stack:
+        h, w = roi.shape[:2]
+        mimg[y:y + h, MONTAGE_GUTTER:MONTAGE_GUTTER + w] = roi
+        slots.append((region,page_region(MONTAGE_GUTTER,y,MONTAGE_GUTTER + w,y + h)))
+
+    return mimg, slots
+
+""" kernel size for the detection resolution, at least 3 and odd if need be """
+def kernelSize(base,scale,odd):
+    k = max(3,int(round(base * scale)))
+    if odd and k % 2 == 0:
+        k += 1
+
+    return k
+
+""" resolution from the image header, if it looks like a scan """
+def imageDpi(ifile):
+
+    try:
+        from PIL import Image
+        with Image.open(ifile) as pim:
+            dpi = pim.info.get('dpi')
+    except Exception:
+        dpi = None
+
+    #screen resolutions (72, 96) are usually just defaults, not scanner settings
+    if dpi is not None and MIN_SCAN_DPI <= dpi[0] <= MAX_SCAN_DPI:
+        return int(round(dpi[0]))
+
+    return None
+
+""" find candidate text clusters, bounding rects are in full resolution coordinates """
+def findRegions(gray,reduce,dpi,state=None):
+    levels = 0
+    scale = 1.0
+    full_h, full_w = gray.shape[:2]
+
+    if reduce:
+        #halve the page until it is close to the resolution the kernels were tuned for,
+        #then size the kernels for what is left
+        det_dpi = dpi
+        while det_dpi / 2 >= BASE_DPI:
+            gray = cv2.pyrDown(gray)
+            det_dpi /= 2
+            levels += 1
+        scale = det_dpi / BASE_DPI
+
+    tk = kernelSize(3,scale,True)
+    #use a fairly large kernel to try to keep sentences together
+    dk = kernelSize(20,scale,False)
+    kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (dk, dk))
+    gk = kernelSize(45,scale,True)
+
+    #every filter only looks at nearby pixels, so the page goes through a band
+    #of rows at a time, with enough rows either side to cover how far they reach
+    h, w = gray.shape[:2]
+    reach = tk // 2 + tk // 2 + 2 * dk + gk // 2
+    bin = workBuffer('bin',(h,w))
+    for top in range(0,h,DETECT_BAND):
+        bottom = min(top + DETECT_BAND,h)
+        y0 = max(top - reach,0)
+        y1 = min(bottom + reach,h)
+        band_a = workBuffer('band_a',(y1 - y0,w))
+        band_b = workBuffer('band_b',(y1 - y0,w))
+
+        #get image ready for detecting text clusters
+        band = cv2.adaptiveThreshold(gray[y0:y1], 255, cv2.ADAPTIVE_THRESH_MEAN_C, 
+            cv2.THRESH_BINARY_INV, tk, 9, band_a)
+        band = cv2.medianBlur(band, tk, band_b)
+        band = cv2.dilate(band, kernel, band_a, iterations=2)
+        band = cv2.GaussianBlur(band, (gk,gk), 0, band_b)
+        bin[top:bottom] = band[top - y0:bottom - y0]
+        if state is not None and top == 0:
+            state.progress(".")
+    if state is not None:
+        state.progress(".")
+
+    ret, bin = cv2.threshold(bin, 0,255, cv2.THRESH_BINARY, bin)       
     contours, _ = cv2.findContours( bin, cv2.RETR_CCOMP, 
         cv2.CHAIN_APPROX_SIMPLE)
-    print("!")
 
-    print("work through contours...",end="",flush=True)
+    rects = [cv2.boundingRect(cnt) for cnt in contours]
+    if levels > 0:
+        #map back to the full page, regions are cropped at full resolution
+        f = 2 ** levels
+        rects = [(x * f, y * f, min(rw * f, full_w - x * f), min(rh * f, full_h - y * f))
+            for x, y, rw, rh in rects]
+
+    return rects
+
+""" score all regions at once, percentage of white space in one binarized copy
+    of the page, obvious non-candidates score 0 """
+def scoreRegions(gray,rects,tmask,dpi):
+    r = np.array(rects,dtype=np.int64).reshape(-1,4)
+    x, y, w, h = r.T
+
+    #too small, too thin or already recognized
+    scale = dpi / BASE_DPI
+    keep = w * h >= MIN_REGION_AREA * scale * scale
+    keep &= np.maximum(w,h) <= MAX_ASPECT * np.minimum(w,h)
+    if len(r) > 0:
+        keep &= tmask.coverage(r) < MAX_COVERED
+
+    #use threshold to push gradiants to black and white (1 for white), once for the page,
+    #then count what is left in each region from an integral image of a band of rows
+    #at a time, an integral of a large page would take four times the memory of the page
+    ret, th = cv2.threshold(gray,0,1,cv2.THRESH_BINARY+cv2.THRESH_TRIANGLE,
+        workBuffer('bin',gray.shape[:2]))
+    white = np.zeros(len(r),dtype=np.int64)
+    y1 = y + h
+    x1 = x + w
+    page_h, page_w = th.shape[:2]
+    for top in range(0,page_h,SCORE_BAND):
+        bottom = min(top + SCORE_BAND,page_h)
+        hit = np.flatnonzero(keep & (y < bottom) & (y1 > top))
+        if len(hit) == 0:
+            continue
+        sums = cv2.integral(th[top:bottom],workBuffer('integral',
+            (bottom - top + 1,page_w + 1),np.int32),cv2.CV_32S)
+        #each region's rows within the band
+        ry0 = np.maximum(y[hit],top) - top
+        ry1 = np.minimum(y1[hit],bottom) - top
+        white[hit] += (sums[ry1,x1[hit]] - sums[ry0,x1[hit]] -
+            sums[ry1,x[hit]] + sums[ry0,x[hit]])
+    percent_w = np.round(white / (w * h) * 100,1)
+    percent_w[~keep] = 0.0
+
+    return percent_w.tolist()
+
+""" extract remaining candidate text blocks """
+def runThruContours(ibase,im,debug,tess_args,iborder,lang,jobs,engine,montage,
+    reduce,dpi,tmask,integral,pagelines,state):
+
+    #regions go to tesseract as soon as they are found
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as ocr_pool:
+        cand_cnt, pars = ocrCandidates(ibase,
+            findCandidates(ibase,im,debug,iborder,reduce,dpi,tmask,integral,pagelines,state),
+            debug,tess_args,lang,engine,montage,ocr_pool)
+    state.progress("!\n")
+
+    return cand_cnt, pars
+
+""" candidate regions of a page as they are found, each one a snapshot of the region
+    (separators blanked) along with where it is on the page """
+def findCandidates(ibase,im,debug,iborder,reduce,dpi,tmask,integral,pagelines,state):
+ 
+    state.progress("look for missed text blocks...")
+    #nothing needs the page after this, regions are blanked in place
+    img = im
+    #debug marks go on their own copy so they never end up in a region
+    if debug:
+        marked = cv2.cvtColor(im, cv2.COLOR_GRAY2BGR)
+    state.progress(".")
+
+    rects = findRegions(im,reduce,dpi,state)
+    state.metrics.count('contours',len(rects))
+    scores = None
+    if integral:
+        scores = scoreRegions(im,rects,tmask,dpi)
+    #separator lines for the whole page, before any region is blanked
+    plines = None
+    if pagelines:
+        plines = page_lines(im)
+    state.progress("!\n")
+
+    state.progress("work through contours...")
     cand_cnt = 0
-    for cnt in contours:
-        print(".",end="",flush=True)
-        x, y, w, h = cv2.boundingRect(cnt)
-        print(".",end="",flush=True)
-        roi = img[y:y + h, x:x + w]
-        cg = cv2.cvtColor(roi, cv2.COLOR_BGR2GRAY)
-
-        #use threshold to push gradiants to black and white
-        ret,th = cv2.threshold(cg,0,255,
-            cv2.THRESH_BINARY+cv2.THRESH_TRIANGLE)
-        #only consider regions with significant white space
-        percent_w = round((cv2.countNonZero(th)/cg.size) * 100,1)
-
-        #use coordinates for file name
-        roi_name = "%s_coords_%05d_%05d_%05d_%05d" % (ibase,x,y,x+w,y+h)
+    for i, (x, y, w, h) in enumerate(rects):
+        state.progress(".")
+        if scores is not None:
+            percent_w = scores[i]
+        else:
+            cg = img[y:y + h, x:x + w]
+
+            #use threshold to push gradiants to black and white
+            ret,th = cv2.threshold(cg,0,255,
+                cv2.THRESH_BINARY+cv2.THRESH_TRIANGLE)
+            #only consider regions with significant white space
+            percent_w = round((cv2.countNonZero(th)/cg.size) * 100,1)
 
         #specify high percentage of white space (70% or higher) for candidate region
         if percent_w > 70.0:
-           seps = getSLine(roi,iborder)
+           roi = img[y:y + h, x:x + w]
+           if plines is not None:
+               seps = plines.getSLine(x,y,w,h,iborder)
+           else:
+               seps = getSLine(roi,iborder)
            if len(seps) > 0:
                #blank out separator line, Tesseract (rightfully) ignores these
                cv2.rectangle(roi, (seps[0],seps[1]), 
                    (seps[2],seps[3]), 
                    (255,255,255), -1)
 
-           cv2.imwrite(roi_name + '.png', roi)
-           missed_par = pytesseract.image_to_pdf_or_hocr(
-               roi_name + '.png', 
-               config = ("-l %s %s" % (lang,tess_args)),
-               extension='hocr')
-           pars.append(par_region(missed_par,page_region(x,y,x+w,y+h)))
-
-           writeHocr(missed_par,roi_name + ".hocr")
-           if not debug:
-               os.remove(roi_name + ".hocr")
-               os.remove(roi_name + ".png")
-            
            if debug:
+               #use coordinates for file name
+               roi_name = "%s_coords_%05d_%05d_%05d_%05d" % (ibase,x,y,x+w,y+h)
+               cv2.imwrite(roi_name + '.png', roi)
+
                #mark region on original image
-               cv2.rectangle(img, (x, y), (x + w, y + h), (0, 255, 0), 2)
+               cv2.rectangle(marked, (x, y), (x + w, y + h), (0, 255, 0), 2)
 
            cand_cnt += 1
+           #region goes to tesseract straight from memory, hocr stays in memory too,
+           #snapshot it since later blanking/marking can overlap it
+           yield roi.copy(), page_region(x,y,x+w,y+h)
 
-    print("!")
+    state.metrics.count('candidates',cand_cnt)
     #write out image with contour(s) for troubleshooting
     if debug:
-        cv2.imwrite(ibase + '_contours.jpg', img)
+        cv2.imwrite(ibase + '_contours.jpg', marked)
 
-    return cand_cnt, pars
+""" OCR candidate regions in a thread pool, one by one or stacked in montages,
+    the paragraphs come back in the same order for any number of jobs """
+def ocrCandidates(ibase,candidates,debug,tess_args,lang,engine,montage,ocr_pool):
+    pars = []
+    cands = []
+    rois = []
+
+    for roi, region in candidates:
+        if montage:
+            rois.append((roi,region))
+        else:
+            cands.append((ocr_pool.submit(engine.ocr,roi,lang,tess_args),region))
+
+    #one tesseract run per montage rather than per region
+    mcands = []
+    for mimg, slots in buildMontages(rois):
+        mcands.append((ocr_pool.submit(engine.ocr,mimg,lang,tess_args),
+            mimg,slots))
+    for m, (ocr_job, mimg, slots) in enumerate(mcands):
+        missed_hocr = ocr_job.result()
+        mhocr = hocrwords.loadWords(missed_hocr)
+        for region, slot in slots:
+            pars.append(par_region(mhocr,region,slot))
+        if debug:
+            cv2.imwrite("%s_montage_%02d.png" % (ibase,m), mimg)
+            writeHocr(missed_hocr,"%s_montage_%02d.hocr" % (ibase,m))
+
+    #collect in submission order so the merge is the same for any number of jobs
+    for ocr_job, region in cands:
+        missed_par = ocr_job.result()
+        pars.append(par_region(missed_par,region))
+        if debug:
+            writeHocr(missed_par,"%s_coords_%05d_%05d_%05d_%05d.hocr" % 
+                (ibase,region.x0,region.y0,region.x1,region.y1))
+
+    return len(rois) + len(cands), pars
 
 """ write results to file """
 def writeHocr(block,fhocr):
@@ -507,58 +990,521 @@ def writeHocr(block,fhocr):
     hfile.write(bytearray(block))
     hfile.close()
 
-parser = argparse.ArgumentParser()
-arg_named = parser.add_argument_group("named arguments")
-arg_named.add_argument("-f","--file", 
-    help="input image, for example: imgs/my_image.tif")
-arg_named.add_argument("-b","--border", default=10, type=int,
-    help="adjust border value for extracted regions")
-arg_named.add_argument('-a', '--arguments', type=str, 
-    default="--psm 6 -c tessedit_pageseg_mode=6",
-    help="arguments for tesseract on missing regions")
-arg_named.add_argument("-d","--debug", default=False, 
-    action="store_true",
-    help="create debug files")
-arg_named.add_argument("-c","--conf", default=50, type=int,
-    help="set confidence number threshold for mised regions")
-arg_named.add_argument('-l', '--lang', type=str, 
-    default="eng",
-    help="language for OCR")
-
-args = parser.parse_args()
-
-if args.file == None or not os.path.exists(args.file):
-    print("missing input image, use '-h' parameter for syntax")
-    sys.exit()
-
-#use filename to pull everything together
-img_base = args.file.split(".")[0]
-
-orig_page = None
-if not os.path.exists(img_base + ".hocr"):
-    print("missing base hocr file: %s.hocr, running Tesseract" % img_base)
-    orig_page = pytesseract.image_to_pdf_or_hocr(args.file,
-        config=("-l %s" % args.lang),
-        extension='hocr')
-    #always want a copy of original
-    writeHocr(orig_page,img_base + ".hocr")
-
-img = runThruHocr(args.file,img_base,
-    args.border,args.debug)
-extras, pars = runThruContours(img_base,img,args.debug,
-    args.arguments,args.border,args.lang)
-
-lines = 0
-if extras > 0: 
-    orig_page = ET.parse(img_base + ".hocr")
-
-    #hocr numbering starts at 1
-    page_cnt = 1
-    block_cnt = 1
-    par_cnt = 1
-    line_cnt = 1
-    word_cnt = 1
-
-    runThruPars(img_base,pars,orig_page,args.conf,args.lang)
-
-print("hocr line(s) added: %d" % lines)
+""" options for processPage(), the command line defaults with any changes """
+def pageOptions(**changes):
+
+    args = buildParser().parse_args([])
+    #nothing gets printed from python unless asked for
+    args.quiet = True
+    for name, value in changes.items():
+        if not hasattr(args,name):
+            raise TypeError("unknown option: %s" % name)
+        setattr(args,name,value)
+
+    return args
+
+""" options for pages that run side by side in one process (the pipeline and the server),
+    returns a copy and True if memory tracing was started here (stop it when done) """
+def sharedOptions(args):
+
+    args = copy.copy(args)
+    #progress dots from pages at once would just be noise
+    args.quiet = True
+    #pages overlap, so memory peaks are for the process rather than the page
+    tracing = args.metrics is not None and pagemetrics.traceProcess()
+
+    return args, tracing
+
+""" run one image (file or array) through the whole process, the base hocr is
+    found next to the image file unless given, and gets replaced if lines are added """
+def processPage(image,args=None,hocr_file=None):
+
+    if args is None:
+        args = pageOptions()
+    #not worth running Tesseract on (or writing a hocr for) something opencv can't open
+    if isinstance(image,str) and not (os.path.isfile(image) and cv2.haveImageReader(image)):
+        raise ValueError("cannot read image %s" % image)
+    if isinstance(image,str) and frameCount(image) > 1:
+        return processVolume(image,args,hocr_file)
+    if hocr_file is None:
+        if not isinstance(image,str):
+            raise ValueError("hocr file is needed for an image array")
+        #use filename to pull everything together
+        hocr_file = image.rsplit('.', 1)[0] + '.hocr'
+    img_base = hocr_file.rsplit('.', 1)[0]
+    page = image if isinstance(image,str) else hocr_file
+
+    state = page_state(page,args.quiet,args.metrics is not None)
+    metrics = state.metrics
+    engine, cache = pageEngine(args,metrics)
+
+    orig_page = None
+    if not os.path.exists(hocr_file):
+        if not args.quiet:
+            print("missing base hocr file: %s, running Tesseract" % hocr_file)
+        with metrics.stage("baseOcr"):
+            orig_page = engine.ocr(image,args.lang,"")
+        #always want a copy of original
+        writeHocr(orig_page,hocr_file)
+
+    dpi = pageDpi(image,args)
+    extras, pars = findMissed(image,hocr_file,img_base,dpi,args,engine,state)
+    if extras > 0: 
+        with metrics.stage("runThruPars"):
+            runThruPars(hocr_file,pars,args.conf,args.lang,state)
+    metrics.count('lines_added',state.lines)
+    if args.index:
+        with metrics.stage("writeIndex"):
+            hocrindex.indexHocr(hocr_file)
+
+    return page_result(hocr_file,state.lines,extras,
+        metrics.result() if metrics.enabled else None,cacheCounts(cache,metrics))
+
+""" block out what the hocr (file or bytes) already has and OCR what's left """
+def findMissed(image,hocr_file,img_base,dpi,args,engine,state):
+
+    try:
+        with state.metrics.stage("runThruHocr"):
+            img, tmask = runThruHocr(image,hocr_file,img_base,
+                args.border,args.debug,args.words,state)
+        with state.metrics.stage("runThruContours"):
+            extras, pars = runThruContours(img_base,img,args.debug,
+                args.arguments,args.border,args.lang,args.jobs,engine,args.montage,
+                args.reduce,dpi,tmask,args.integral,args.pagelines,state)
+    finally:
+        #threads that stay around (server, pipeline) shouldn't hang on to a big page
+        releaseBuffers()
+
+    return extras, pars
+
+""" resolution to size the kernels for: '--dpi', the image header or BASE_DPI """
+def pageDpi(image,args):
+
+    dpi = args.dpi
+    if dpi is None and isinstance(image,str):
+        dpi = imageDpi(image)
+    if dpi is None:
+        dpi = BASE_DPI
+
+    return dpi
+
+""" OCR engine for the options, along with the page's own counter on the cache
+    (if any), other pages in the process can be using the same cache """
+def pageEngine(args,metrics):
+
+    if args.cache is None:
+        return metrics.engine(ocrengine.getEngine(args.engine,args.jobs)), None
+
+    cache = ocrengine.getCachedEngine(args.engine,args.jobs,args.cache,args.cache_size)
+    #OCR calls and time are only for what the cache didn't have
+    counter = cache.counter(metrics.engine(cache.engine))
+
+    return counter, counter
+
+""" cache counters for one page, None without a cache """
+def cacheCounts(cache,metrics):
+
+    if cache is None:
+        return None
+    counts = cache.counts()
+    for k, v in counts.items():
+        metrics.count('cache_' + k,v)
+
+    return counts
+
+""" number of frames in an image, only tiffs are checked for more than one """
+def frameCount(ifile):
+
+    if not ifile.lower().endswith(('.tif','.tiff')):
+        return 1
+    try:
+        return max(cv2.imcount(ifile),1)
+    except cv2.error:
+        return 1
+
+""" one frame of a multi-page image in gray, only that frame is decoded """
+def readFrame(ifile,frame):
+
+    ok, mats = cv2.imreadmulti(ifile,frame,1,flags=cv2.IMREAD_GRAYSCALE)
+    if not ok or len(mats) == 0:
+        raise ValueError("can't read frame %d of %s" % (frame,ifile))
+
+    return mats[0]
+
+""" ocr_page divs of an hocr tree in document order """
+def hocrPages(root):
+
+    return [elem for elem in root.iter() if localTag(elem) == 'div'
+        and elem.get('class') == 'ocr_page']
+
+""" match frames to ocr_page divs, by ppageno if every page has a different one,
+    otherwise in order """
+def volumePages(root,frames):
+
+    divs = hocrPages(root)
+    numbers = []
+    for div in divs:
+        for part in div.get('title','').split(';'):
+            tokens = part.split()
+            if len(tokens) == 2 and tokens[0] == 'ppageno':
+                numbers.append(int(tokens[1]))
+    if len(numbers) != len(divs) or len(set(numbers)) != len(numbers):
+        numbers = range(len(divs))
+
+    return {n: div for n, div in zip(numbers,divs) if 0 <= n < frames}
+
+""" frame_result - what framePage() did with one frame of a volume """
+class frame_result:
+    def __init__(self, frame, base_hocr, new_hocr, lines, candidates, metrics, cache_counts):
+        self.frame = frame
+        #page div from Tesseract if the volume had no hocr for this frame
+        self.base_hocr = base_hocr
+        #page div with the missed regions added, None if nothing was added
+        self.new_hocr = new_hocr
+        self.lines = lines
+        self.candidates = candidates
+        self.metrics = metrics
+        self.cache_counts = cache_counts
+
+""" one frame of a volume against its ocr_page div (serialized, None to run Tesseract),
+    ids are numbered for the page the frame is on """
+def framePage(ifile,frame,page_hocr,img_base,dpi,args):
+
+    state = page_state("%s[%d]" % (ifile,frame),args.quiet,args.metrics is not None)
+    state.page_cnt = frame + 1
+    metrics = state.metrics
+    engine, cache = pageEngine(args,metrics)
+
+    img = readFrame(ifile,frame)
+    base_hocr = None
+    if page_hocr is None:
+        if not args.quiet:
+            print("missing hocr for page %d, running Tesseract" % (frame + 1))
+        with metrics.stage("baseOcr"):
+            page_div = hocrPages(ET.fromstring(engine.ocr(img,args.lang,"")))[0]
+        #Tesseract numbers every page as the first one
+        page_div.set('id','page_%d' % state.page_cnt)
+        numbering = page_state()
+        numbering.page_cnt = state.page_cnt
+        adjustCounts(page_div,numbering)
+        base_hocr = page_hocr = ET.tostring(page_div)
+
+    ibase = "%s_%04d" % (img_base,frame + 1)
+    extras, pars = findMissed(img,page_hocr,ibase,dpi,args,engine,state)
+    new_hocr = None
+    if extras > 0:
+        with metrics.stage("runThruPars"):
+            orig_page = mergeRegions(io.BytesIO(page_hocr),pars,args.conf,
+                args.lang,state)
+        if orig_page is not None:
+            new_hocr = ET.tostring(orig_page.getroot())
+    metrics.count('lines_added',state.lines)
+
+    return frame_result(frame,base_hocr,new_hocr,state.lines,extras,
+        metrics.result() if metrics.enabled else None,
+        cacheCounts(cache,metrics))
+
+""" volume worker - keep progress output from interleaving between processes """
+def batchFrame(job):
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        return framePage(*job)
+
+""" every frame of a multi-page image against the ocr_page divs of one hocr file,
+    pages go across '-w' worker processes and come back together in one file """
+def processVolume(ifile,args,hocr_file=None):
+
+    if hocr_file is None:
+        hocr_file = ifile.rsplit('.', 1)[0] + '.hocr'
+    img_base = hocr_file.rsplit('.', 1)[0]
+    frames = frameCount(ifile)
+    dpi = pageDpi(ifile,args)
+
+    root = None
+    pages = {}
+    if os.path.exists(hocr_file):
+        root = ET.parse(hocr_file).getroot()
+        pages = volumePages(root,frames)
+    elif not args.quiet:
+        print("missing base hocr file: %s, running Tesseract" % hocr_file)
+
+    jobs = []
+    for frame in range(frames):
+        if root is not None and frame not in pages:
+            if not args.quiet:
+                print("no hocr page for frame %d of %s, skipped" % (frame,ifile))
+            continue
+        page_hocr = ET.tostring(pages[frame]) if root is not None else None
+        jobs.append((ifile,frame,page_hocr,img_base,dpi,args))
+
+    if not args.quiet:
+        print("%d page(s) in %s" % (len(jobs),ifile))
+    if args.workers > 1 and len(jobs) > 1:
+        with concurrent.futures.ProcessPoolExecutor(min(args.workers,len(jobs))) as pool:
+            results = list(pool.map(batchFrame,jobs))
+    else:
+        results = [framePage(*job) for job in jobs]
+
+    #comments mark what hocrmod added, keep them when the pages come back
+    def pageDiv(data):
+        return ET.fromstring(data,
+            parser=ET.XMLParser(target=ET.TreeBuilder(insert_comments=True)))
+
+    if root is None:
+        #new volume hocr, always want a copy of the original
+        root = ET.Element(ET.QName(HOCR_NS,"html"))
+        head = ET.SubElement(root,ET.QName(HOCR_NS,"head"))
+        ET.SubElement(head,ET.QName(HOCR_NS,"title")).text = ""
+        body = ET.SubElement(root,ET.QName(HOCR_NS,"body"))
+        for result in results:
+            pages[result.frame] = pageDiv(result.base_hocr)
+            body.append(pages[result.frame])
+        writeModHocr(ET.ElementTree(root),hocr_file)
+
+    parents = {child: parent for parent in root.iter() for child in parent}
+    lines = 0
+    candidates = 0
+    cached = {}
+    for result in results:
+        lines += result.lines
+        candidates += result.candidates
+        for k, v in (result.cache_counts or {}).items():
+            cached[k] = cached.get(k,0) + v
+        if result.new_hocr is not None:
+            old = pages[result.frame]
+            parent = parents[old]
+            parent.insert(list(parent).index(old),pageDiv(result.new_hocr))
+            parent.remove(old)
+        if not args.quiet:
+            print("page %d: %d hocr line(s) added" % (result.frame + 1,result.lines))
+
+    if any(result.new_hocr is not None for result in results):
+        os.rename(hocr_file, hocr_file + '.bak')
+        writeModHocr(ET.ElementTree(root),hocr_file)
+    if args.index:
+        hocrindex.indexHocr(hocr_file)
+
+    metrics = None
+    if args.metrics is not None:
+        metrics = [result.metrics for result in results]
+
+    return page_result(hocr_file,lines,candidates,metrics,
+        cached if args.cache is not None else None)
+
+""" batch worker - keep progress output from interleaving between processes """
+def batchPage(job):
+    ifile, args = job
+    #the pool is already busy, pages of a volume stay in this process
+    args = copy.copy(args)
+    args.workers = 1
+
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = processPage(ifile,args)
+        return ifile, result.lines, None, result.cache_counts, result.metrics
+    except Exception as e:
+        return ifile, 0, str(e), None, None
+
+""" gather images from a directory, glob pattern or manifest (one path per line),
+    or just the one image """
+def collectImages(source):
+
+    if os.path.isdir(source):
+        ifiles = [os.path.join(source,f) for f in sorted(os.listdir(source))
+            if f.lower().endswith(IMG_EXTS)]
+    elif os.path.isfile(source) and source.lower().endswith(IMG_EXTS):
+        ifiles = [source]
+    elif os.path.isfile(source):
+        with open(source) as f:
+            ifiles = [l.strip() for l in f if l.strip()]
+    else:
+        ifiles = sorted(glob.glob(source))
+
+    #skip anything left behind by earlier debug runs
+    return [f for f in ifiles if os.path.isfile(f) and '_coords_' not in f
+        and not f.endswith(('_regions.jpg','_contours.jpg'))]
+
+""" image, hocr and hocr.bak for a page """
+def pageFiles(ifile):
+
+    img_base = ifile.rsplit('.', 1)[0]
+    return {'image': batchstate.file_info(ifile),
+        'hocr': batchstate.file_info(img_base + '.hocr'),
+        'bak': batchstate.file_info(img_base + '.hocr.bak')}
+
+""" check a page against the state file, True if it needs to be (re)done """
+def preparePage(ifile,state,params):
+
+    files = pageFiles(ifile)
+    #a missing backup doesn't matter as long as the output is still there
+    if state.upToDate(ifile,params,{k: files[k] for k in ('image','hocr')}):
+        return False
+
+    #if the hocr is still what we wrote last time (or there is no record
+    #of it), go back to the original, otherwise it's a new base hocr
+    if files['bak'].exists():
+        recorded = state.recorded(ifile,'hocr')
+        if state.lookup(ifile) is None or batchstate.sameFile(files['hocr'],recorded):
+            shutil.copyfile(files['bak'].path,files['hocr'].path)
+
+    return True
+
+""" fan pages out to a process pool, largest images first to shorten the run """
+def runBatch(ifiles,args):
+    total = 0
+    cached = {}
+
+    state = None
+    if args.state is not None:
+        state = batchstate.batch_state(args.state)
+        params = batchstate.paramString(args,STATE_PARAMS)
+        todo = [ifile for ifile in ifiles if preparePage(ifile,state,params)]
+        print("skipping %d unchanged page(s)" % (len(ifiles) - len(todo)))
+        if args.index:
+            #pages done before without '--index' only need the index
+            redo = set(todo)
+            for ifile in ifiles:
+                hocr_file = ifile.rsplit('.', 1)[0] + '.hocr'
+                if ifile not in redo and hocrindex.staleIndex(hocr_file):
+                    hocrindex.indexHocr(hocr_file)
+        ifiles = todo
+
+    ifiles.sort(key=os.path.getsize, reverse=True)
+
+    #each page as it finishes, in whatever order that is
+    def report(ifile, added, err, counts, page_metrics):
+        nonlocal total
+        if err is not None:
+            print("%s: failed (%s)" % (ifile,err))
+        else:
+            print("%s: %d hocr line(s) added" % (ifile,added))
+            total += added
+        if args.metrics is not None and page_metrics is not None:
+            pagemetrics.writeMetrics(args.metrics,page_metrics)
+        if state is not None:
+            state.finish(ifile,params,pageFiles(ifile),added,err)
+        for k, v in (counts or {}).items():
+            cached[k] = cached.get(k,0) + v
+
+    if args.pipeline:
+        import pagepipeline
+        #volumes are split across processes as usual, single pages share the pipeline
+        volumes = [ifile for ifile in ifiles if frameCount(ifile) > 1]
+        pagepipeline.runPipeline([ifile for ifile in ifiles
+            if ifile not in volumes],args,report)
+        for ifile in volumes:
+            report(*batchPage((ifile,args)))
+    else:
+        #pool processes can start their own ocr workers
+        with concurrent.futures.ProcessPoolExecutor(args.workers) as pool:
+            jobs = [pool.submit(batchPage,(ifile,args)) for ifile in ifiles]
+            for job in concurrent.futures.as_completed(jobs):
+                report(*job.result())
+
+    if len(cached) > 0:
+        print("ocr cache: %d hit(s), %d miss(es), %d evicted" %
+            (cached['hits'],cached['misses'],cached['evicted']))
+    if state is not None:
+        state.close()
+
+    return total
+
+""" command line options """
+def buildParser():
+
+    parser = argparse.ArgumentParser()
+    arg_named = parser.add_argument_group("named arguments")
+    arg_named.add_argument("-f","--file", 
+        help="input image, for example: imgs/my_image.tif")
+    arg_named.add_argument("-b","--border", default=10, type=int,
+        help="adjust border value for extracted regions")
+    arg_named.add_argument('-a', '--arguments', type=str, 
+        default="--psm 6 -c tessedit_pageseg_mode=6",
+        help="arguments for tesseract on missing regions")
+    arg_named.add_argument("-d","--debug", default=False, 
+        action="store_true",
+        help="create debug files")
+    arg_named.add_argument("-c","--conf", default=50, type=int,
+        help="set confidence number threshold for mised regions")
+    arg_named.add_argument('-l', '--lang', type=str, 
+        default="eng",
+        help="language for OCR")
+    arg_named.add_argument("-s","--source",
+        help="batch input: directory, glob pattern or manifest of images")
+    arg_named.add_argument("-w","--workers", default=os.cpu_count(), type=int,
+        help="number of worker processes for batch input")
+    arg_named.add_argument("-j","--jobs", default=1, type=int,
+        help="number of candidate regions to OCR at the same time")
+    arg_named.add_argument("-e","--engine", default="tesseract",
+        choices=ocrengine.ENGINES,
+        help="OCR backend, 'worker' keeps tesseract workers warm between regions "
+            "('worker:stub' or 'worker:tesseract' sets what they run)")
+    arg_named.add_argument("-m","--montage", default=False,
+        action="store_true",
+        help="OCR all candidate regions of a page in one montage image")
+    arg_named.add_argument("-x","--words", default=False,
+        action="store_true",
+        help="block out recognized words rather than whole paragraphs")
+    arg_named.add_argument("-r","--reduce", default=False,
+        action="store_true",
+        help="detect regions on a reduced copy of the page, kernels sized to the dpi")
+    arg_named.add_argument("--dpi", type=int,
+        help="resolution of the image if it is not in the file (default: %d)" % BASE_DPI)
+    arg_named.add_argument("-g","--integral", default=False,
+        action="store_true",
+        help="score regions all at once from the whole page rather than one by one")
+    arg_named.add_argument("-p","--pagelines", default=False,
+        action="store_true",
+        help="find separator lines once for the page rather than for each region")
+    arg_named.add_argument("--cache",
+        help="directory for cached OCR results, reused when a region is unchanged")
+    arg_named.add_argument("--cache-size", default=1024, type=float,
+        help="size limit for the OCR cache in MB (default: 1024)")
+    arg_named.add_argument("--state",
+        help="state file for batch input, pages that haven't changed are skipped")
+    arg_named.add_argument("--metrics",
+        help="append timings and counters for each page as JSON to this file ('-' for stderr)")
+    arg_named.add_argument("--index", default=False,
+        action="store_true",
+        help="also write the words of the hocr to a binary index (.words) for fast loading")
+    arg_named.add_argument("--pipeline", default=False,
+        action="store_true",
+        help="batch input: overlap decoding, region finding, OCR and merging of pages in one process")
+    arg_named.add_argument("--serve",
+        help="run as a local service on this port (of 127.0.0.1) or unix socket path")
+    arg_named.add_argument("--serve-root",
+        help="directory the service can do pages in place under, requests can't give a path without it")
+    arg_named.add_argument("-q","--quiet", default=False,
+        action="store_true",
+        help="don't show progress dots or notes")
+
+
+    return parser
+
+if __name__ == "__main__":
+    args = buildParser().parse_args()
+
+    if args.serve is not None:
+        import hocrserver
+        hocrserver.serve(args)
+        sys.exit()
+
+    if args.source is not None:
+        ifiles = collectImages(args.source)
+        if len(ifiles) == 0:
+            print("no input images found for: %s" % args.source)
+            sys.exit()
+        print("hocr line(s) added: %d" % runBatch(ifiles,args))
+        sys.exit()
+
+    if args.file == None or not os.path.exists(args.file):
+        print("missing input image, use '-h' parameter for syntax")
+        sys.exit()
+
+    result = processPage(args.file,args)
+    if result.cache_counts is not None:
+        print("ocr cache: %d hit(s), %d miss(es), %d evicted" % (result.cache_counts['hits'],
+            result.cache_counts['misses'],result.cache_counts['evicted']))
+    print("hocr line(s) added: %d" % result.lines)
+    if result.metrics is not None:
+        pagemetrics.writeMetrics(args.metrics,result.metrics)
@@ -0,0 +1,311 @@
+"""
+hocrserver.py - keep hocrmod.py running as a local service
+
+With '--serve', hocrmod.py stays up and takes pages over HTTP,
+on a port of 127.0.0.1 or on a unix socket, so python, opencv
+and the OCR engine (with '-e worker', its tesseract processes)
+are started once rather than for every page:
+
+    hocrmod.py --serve 8765 -e worker -j 4 -w 2
+    hocrmod.py --serve /tmp/hocrmod.sock
+
+    POST /page    JSON: {"image": image file, base64 encoded,
+                         "hocr": base hocr (optional, OCR'd if missing),
+                         "name": file name, for the image type (optional),
+                         "options": {"conf": 30, "montage": true, ...}}
+                  or {"path": image under '--serve-root', done in place like '-f'}
+                  back comes {"hocr", "lines", "candidates", "metrics",
+                  "cache", "seconds"}
+    GET /health   engine, pages waiting and running, totals so far
+
+Pages run '-w' at a time in threads that let go of their scratch
+buffers after each page, and up to MAX_WAITING more can wait their
+turn, after that the answer is 503 until things catch up. A request can only change
+the options in PAGE_OPTIONS, the rest come from the command line. Requests have
+to be sent as application/json, and a path is only taken if the server was
+started with '--serve-root' and the image (links and all) is below it.
+"""
+
+import base64, binascii, concurrent.futures, copy, http.server, json, os, socket
+import socketserver, stat, tempfile, threading, time, tracemalloc
+import hocrmod, ocrengine, pagemetrics
+
+#pages that can be waiting for a worker before new ones are turned away
+MAX_WAITING = 16
+#options a request can set, the ones that change what ends up in the hocr, except
+#for the engine and what gets passed on to Tesseract ('-l' and '-a' as well)
+PAGE_OPTIONS = tuple(name for name in hocrmod.STATE_PARAMS
+    if name not in ('engine','arguments','lang'))
+#first bytes of a tiff, the image type matters for multi-page files
+TIFF_MAGIC = (b'II*\x00', b'MM\x00*')
+
+""" service_busy - too many pages already waiting """
+class service_busy(Exception):
+    pass
+
+""" path_refused - a path outside of '--serve-root' (or no root to look in) """
+class path_refused(Exception):
+    pass
+
+""" page_service - options, engine and counts shared by all requests """
+class page_service:
+    def __init__(self, args):
+        self.args, self.tracing = hocrmod.sharedOptions(args)
+        #debug files would land in a temporary directory
+        self.args.debug = False
+        #the pages of a volume stay in the request's thread
+        self.args.workers = 1
+        self.workers = args.workers
+        #pages on this machine only come from here
+        self.root = None
+        if args.serve_root is not None:
+            if not os.path.isdir(args.serve_root):
+                raise ValueError("--serve-root is not a directory: %s" % args.serve_root)
+            self.root = os.path.realpath(args.serve_root)
+        self.defaults = hocrmod.pageOptions()
+        self.pool = concurrent.futures.ThreadPoolExecutor(self.workers)
+        self.lock = threading.Lock()
+        self.waiting = 0
+        self.running = 0
+        self.done = 0
+        self.failed = 0
+        self.busy = 0
+        self.started = time.time()
+
+        #start the engine now rather than on the first page
+        if args.cache is not None:
+            engine = ocrengine.getCachedEngine(args.engine,args.jobs,
+                args.cache,args.cache_size)
+        else:
+            engine = ocrengine.getEngine(args.engine,args.jobs)
+        self.version = engine.version(args.lang,args.arguments)
+
+    def health(self):
+        with self.lock:
+            return {'status': 'ok', 'engine': self.args.engine,
+                'version': self.version, 'workers': self.workers,
+                'waiting': self.waiting, 'running': self.running,
+                'done': self.done, 'failed': self.failed, 'busy': self.busy,
+                'uptime': round(time.time() - self.started,3)}
+
+    """ options for one request on top of the command line ones """
+    def pageArgs(self, options):
+        if not isinstance(options,dict):
+            raise ValueError("options should be an object")
+
+        args = copy.copy(self.args)
+        for name, value in options.items():
+            if name not in PAGE_OPTIONS:
+                raise ValueError("unknown option: %s" % name)
+            default = getattr(self.defaults,name)
+            kind = type(default) if default is not None else int
+            #bool is an int to python, but not here
+            ok = value is None and default is None
+            ok = ok or type(value) is kind or (kind is float and type(value) is int)
+            if not ok:
+                raise ValueError("option %s should be %s" % (name,kind.__name__))
+            setattr(args,name,value)
+
+        return args
+
+    """ queue a request and wait for it """
+    def run(self, request):
+        if not isinstance(request,dict):
+            raise ValueError("request should be an object")
+        args = self.pageArgs(request.get('options') or {})
+
+        with self.lock:
+            if self.waiting >= MAX_WAITING:
+                self.busy += 1
+                raise service_busy()
+            self.waiting += 1
+
+        return self.pool.submit(self.runPage,request,args).result()
+
+    def runPage(self, request, args):
+        with self.lock:
+            self.waiting -= 1
+            self.running += 1
+        start = time.perf_counter()
+        try:
+            if request.get('path') is not None:
+                result, hocr = pathPage(self.servedPath(request['path']),args)
+            else:
+                result, hocr = uploadPage(request,args)
+        except Exception:
+            with self.lock:
+                self.failed += 1
+            raise
+        finally:
+            #the pool threads last as long as the server
+            hocrmod.releaseBuffers()
+            with self.lock:
+                self.running -= 1
+
+        with self.lock:
+            self.done += 1
+        if args.metrics is not None and result.metrics is not None:
+            pagemetrics.writeMetrics(args.metrics,result.metrics)
+
+        return {'hocr': hocr, 'lines': result.lines,
+            'candidates': result.candidates, 'metrics': result.metrics,
+            'cache': result.cache_counts,
+            'seconds': round(time.perf_counter() - start,6)}
+
+    """ where a requested path really is, as long as that's under the root """
+    def servedPath(self, path):
+        if self.root is None:
+            raise path_refused("paths are only taken with --serve-root")
+        if not isinstance(path,str):
+            raise ValueError("path should be a string")
+        #relative paths start at the root, links are followed before checking
+        ifile = os.path.realpath(os.path.join(self.root,path))
+        if os.path.commonpath([self.root,ifile]) != self.root:
+            raise path_refused("not under the served root: %s" % path)
+
+        return ifile
+
+    def close(self):
+        self.pool.shutdown()
+        if self.tracing:
+            tracemalloc.stop()
+
+""" a page on this machine, done in place (hocr next to the image, .bak and all) """
+def pathPage(ifile,args):
+
+    if not isinstance(ifile,str) or not os.path.isfile(ifile):
+        raise ValueError("no image at: %s" % ifile)
+    result = hocrmod.processPage(ifile,args)
+    with open(result.hocr_file,'rb') as f:
+        hocr = f.read()
+
+    return result, hocr.decode('utf-8')
+
+""" a page sent with the request, run in a temporary directory """
+def uploadPage(request,args):
+
+    try:
+        data = base64.b64decode(request.get('image') or '',validate=True)
+    except (binascii.Error, TypeError, ValueError):
+        raise ValueError("image should be base64")
+    if len(data) == 0:
+        raise ValueError("missing image (or path)")
+    hocr = request.get('hocr')
+    if hocr is not None and not isinstance(hocr,str):
+        raise ValueError("hocr should be a string")
+
+    ext = os.path.splitext(str(request.get('name') or ''))[1].lower()
+    if ext not in hocrmod.IMG_EXTS:
+        ext = '.tif' if data[:4] in TIFF_MAGIC else '.png'
+
+    #an index would go out with the temporary directory
+    args = copy.copy(args)
+    args.index = False
+    with tempfile.TemporaryDirectory(prefix='hocrmod_') as tdir:
+        ifile = os.path.join(tdir,'page' + ext)
+        with open(ifile,'wb') as f:
+            f.write(data)
+        if hocr is not None:
+            with open(os.path.join(tdir,'page.hocr'),'wb') as f:
+                f.write(hocr.encode('utf-8'))
+        return pathPage(ifile,args)
+
+""" page_handler - one HTTP request """
+class page_handler(http.server.BaseHTTPRequestHandler):
+    #keep connections open between pages
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        if self.path.split('?')[0] == '/health':
+            self.reply(200,self.server.service.health())
+        else:
+            self.reply(404,{'error': 'not found: %s' % self.path})
+
+    def do_POST(self):
+        size = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(size)
+        if self.path.split('?')[0] != '/page':
+            self.reply(404,{'error': 'not found: %s' % self.path})
+            return
+        kind = (self.headers.get('Content-Type') or '').split(';')[0].strip().lower()
+        if kind != 'application/json':
+            self.reply(415,{'error': 'requests should be application/json'})
+            return
+
+        try:
+            request = json.loads(body)
+            self.reply(200,self.server.service.run(request))
+        except service_busy:
+            self.reply(503,{'error': 'too many pages waiting'},{'Retry-After': '1'})
+        except path_refused as e:
+            self.reply(403,{'error': str(e)})
+        except ValueError as e:
+            #bad json is a ValueError too
+            self.reply(400,{'error': str(e)})
+        except Exception as e:
+            self.reply(500,{'error': str(e)})
+
+    def reply(self, status, body, headers={}):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type','application/json')
+        self.send_header('Content-Length',str(len(data)))
+        for name, value in headers.items():
+            self.send_header(name,value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    #there is no client address on a unix socket
+    def address_string(self):
+        if isinstance(self.client_address,tuple):
+            return self.client_address[0]
+        return 'local'
+
+    def log_message(self, format, *args):
+        if not self.server.quiet:
+            super().log_message(format,*args)
+
+""" local_server - HTTP on 127.0.0.1, a thread per connection """
+class local_server(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+""" unix_server - the same over a unix socket """
+class unix_server(local_server):
+    address_family = socket.AF_UNIX
+
+    def server_bind(self):
+        socketserver.TCPServer.server_bind(self)
+        self.server_name = 'localhost'
+        self.server_port = 0
+
+""" a server for a port number (0 for any free one) or a unix socket path """
+def makeServer(address):
+
+    if address.isdigit():
+        return local_server(('127.0.0.1',int(address)),page_handler)
+
+    #clear out a socket left behind by an earlier run, but nothing else
+    if os.path.exists(address) and stat.S_ISSOCK(os.stat(address).st_mode):
+        os.unlink(address)
+    return unix_server(address,page_handler)
+
+""" run until interrupted """
+def serve(args):
+
+    server = makeServer(args.serve)
+    server.quiet = args.quiet
+    server.service = page_service(args)
+
+    if isinstance(server.server_address,tuple):
+        print("serving on http://127.0.0.1:%d" % server.server_address[1],flush=True)
+    else:
+        print("serving on %s" % server.server_address,flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        server.service.close()
+        if server.address_family == socket.AF_UNIX:
+            os.unlink(args.serve)
@@ -0,0 +1,250 @@
+"""
+hocrwords.py - words of an hocr page in columns
+
+Rather than a word_region (and page_region) object per word,
+a page is read once into a handful of numpy arrays:
+
+    bbox   - x0,y0,x1,y1 for each word
+    conf   - x_wconf, -1 if there isn't one
+    digits - True if the word has a number in it
+    inserted - True if hocrmod.py added the word (see hocrmod_builder)
+    line, par, block, page - index into the line, par, block
+             and page lists (block is -1 outside an ocr_carea)
+    text   - all of the words in one string, with offsets
+
+Only words with some text that sit in an ocr_par are kept.
+Filtering on confidence and working out line or paragraph
+boxes are then done for all words at once.
+"""
+
+import xml.etree.ElementTree as ET
+import numpy as np
+import hocrio
+
+#namespace for HOCR
+HOCR_NS = 'http://www.w3.org/1999/xhtml'
+
+""" bbox (and x_wconf if there is one) from a title, same rules as getBBoxInfo() """
+def titleInfo(title):
+    conf = -1
+
+    parts = title.split(';')
+    if len(parts) > 1:
+        tokens = parts[1].strip().split(' ')
+        if len(tokens) > 1:
+            try:
+                conf = int(tokens[1])
+            except ValueError:
+                pass
+    tokens = title.replace(';',' ').split(' ')
+
+    return int(tokens[1]),int(tokens[2]),int(tokens[3]),int(tokens[4]),conf
+
+""" page_words - columns for the words of a page """
+class page_words:
+    def __init__(self, bbox, conf, digits, line, par, block, page, text, offsets,
+        lines, par_ids, par_bbox, par_page, par_text, block_ids, page_ids, inserted):
+        self.bbox = bbox
+        self.conf = conf
+        self.digits = digits
+        self.line = line
+        self.par = par
+        self.block = block
+        self.page = page
+        self.chars = text
+        self.offsets = offsets
+        #line info (title after the bbox) is None until a paragraph has a line
+        self.lines = lines
+        self.par_ids = par_ids
+        self.par_bbox = par_bbox
+        self.par_page = par_page
+        self.par_text = par_text
+        self.block_ids = block_ids
+        self.page_ids = page_ids
+        self.inserted = inserted
+
+    def __len__(self):
+        return len(self.conf)
+
+    def text(self, i):
+        return self.chars[self.offsets[i]:self.offsets[i + 1]]
+
+    """ indexes of words that make the confidence threshold (or have a number) """
+    def keep(self, conf, number=False):
+        ok = self.conf >= conf
+        if number:
+            ok |= self.digits
+
+        return np.flatnonzero(ok)
+
+""" hocrmod_builder - tree builder that leaves comments out, same as usual, but
+    keeps the elements hocrmod.py added (between its START/END comments) """
+class hocrmod_builder(ET.TreeBuilder):
+    def __init__(self):
+        super().__init__()
+        self.in_mod = False
+        self.added = set()
+
+    def comment(self, text):
+        self.in_mod = hocrio.modComment(text,self.in_mod)
+        return super().comment(text)
+
+    def start(self, tag, attrs):
+        elem = super().start(tag,attrs)
+        if self.in_mod:
+            self.added.add(elem)
+        return elem
+
+""" walk an hocr tree once and fill the columns, line_classes is checked with 'in',
+    added is a set of elements to flag as inserted (from hocrmod_builder) """
+def pageWords(root,line_classes=('ocr_line',),added=None):
+    bbox = []
+    conf = []
+    digits = []
+    line = []
+    par = []
+    block = []
+    page = []
+    text = []
+    lines = []
+    par_ids = []
+    par_bbox = []
+    par_page = []
+    par_text = []
+    block_ids = []
+    page_ids = []
+    inserted = []
+
+    cur_page = -1
+    cur_block = -1
+    cur_par = -1
+    cur_line = -1
+    #(element, None) to visit, or (element, state to go back to after its children)
+    stack = [(root,None)]
+    while len(stack) > 0:
+        elem, restore = stack.pop()
+        if restore is not None:
+            cur_page, cur_block, cur_par, cur_line = restore
+            continue
+
+        tag = elem.tag
+        if not isinstance(tag,str):
+            continue
+        if tag.startswith('{'):
+            tag = tag.split('}', 1)[1]
+        class_name = elem.get('class')
+        restore = (cur_page, cur_block, cur_par, cur_line)
+
+        if tag == 'div' and class_name == 'ocr_page':
+            cur_page = len(page_ids)
+            page_ids.append(elem.get('id'))
+        elif tag == 'div' and class_name == 'ocr_carea':
+            cur_block = len(block_ids)
+            block_ids.append(elem.get('id'))
+        elif tag == 'p' and class_name == 'ocr_par':
+            cur_par = len(par_ids)
+            cur_line = -1
+            par_ids.append(elem.get('id'))
+            title = elem.get('title')
+            par_bbox.append(titleInfo(title)[:4] if title is not None else (0,0,0,0))
+            par_page.append(cur_page)
+            par_text.append(False)
+        elif tag == 'span' and cur_par >= 0:
+            if class_name == 'ocrx_word':
+                word_text = (elem.text or '').strip()
+                if len(word_text) > 0:
+                    x0,y0,x1,y1,wconf = titleInfo(elem.get('title'))
+                    bbox.append((x0,y0,x1,y1))
+                    conf.append(wconf)
+                    digits.append(any(c.isdigit() for c in word_text))
+                    line.append(cur_line)
+                    par.append(cur_par)
+                    block.append(cur_block)
+                    page.append(par_page[cur_par])
+                    text.append(word_text)
+                    inserted.append(added is not None and elem in added)
+                    par_text[cur_par] = True
+            elif class_name is not None and class_name in line_classes:
+                title = elem.get('title','')
+                cur_line = len(lines)
+                lines.append(title[title.find(';') + 1:])
+
+        if len(elem) > 0:
+            #children come off the stack in document order, then the state goes back
+            stack.append((elem,restore))
+            for child in reversed(elem):
+                stack.append((child,None))
+        else:
+            cur_page, cur_block, cur_par, cur_line = restore
+
+    #words before any line point at a None entry
+    lines.append(None)
+    offsets = np.zeros(len(text) + 1, dtype=np.int64)
+    if len(text) > 0:
+        np.cumsum([len(t) for t in text], out=offsets[1:])
+
+    return page_words(np.array(bbox,dtype=np.int64).reshape(-1,4),
+        np.array(conf,dtype=np.int64),np.array(digits,dtype=bool),
+        np.array(line,dtype=np.int64),np.array(par,dtype=np.int64),
+        np.array(block,dtype=np.int64),np.array(page,dtype=np.int64),''.join(text),offsets,
+        lines,par_ids,np.array(par_bbox,dtype=np.int64).reshape(-1,4),
+        np.array(par_page,dtype=np.int64),np.array(par_text,dtype=bool),block_ids,
+        page_ids,np.array(inserted,dtype=bool))
+
+""" load words from an hocr file, hocr bytes or an element """
+def loadWords(source,line_classes=('ocr_line',)):
+
+    if ET.iselement(source):
+        root = source
+    elif isinstance(source,(bytes,bytearray)):
+        root = ET.fromstring(source)
+    else:
+        root = ET.parse(source).getroot()
+
+    return pageWords(root,line_classes)
+
+""" equal strings get equal codes """
+def stringCodes(strings):
+    codes = {}
+
+    return np.array([codes.setdefault(s,len(codes)) for s in strings],
+        dtype=np.int64)
+
+""" run number for each entry, a new run starts whenever the code changes """
+def runIds(codes):
+
+    if len(codes) == 0:
+        return np.zeros(0, dtype=np.int64)
+    change = np.empty(len(codes), dtype=bool)
+    change[0] = True
+    change[1:] = codes[1:] != codes[:-1]
+
+    return np.cumsum(change) - 1
+
+""" box for each run of words, same result as running calcBoxLimit() over the
+    words of each run in turn (a 0 in x0/y0 starts the low end over) """
+def boxLimits(bbox,runs):
+
+    n = len(runs)
+    if n == 0:
+        return np.zeros((0,4), dtype=np.int64)
+    starts = np.flatnonzero(np.r_[True, runs[1:] != runs[:-1]])
+    ends = np.r_[starts[1:], n]
+    out = np.empty((len(starts),4), dtype=np.int64)
+
+    out[:,2] = np.maximum.reduceat(bbox[:,2], starts)
+    out[:,3] = np.maximum.reduceat(bbox[:,3], starts)
+
+    idx = np.arange(n)
+    group_start = np.repeat(starts, ends - starts)
+    for c in (0,1):
+        v = bbox[:,c]
+        #the low end only counts words after the last 0 in the run
+        first = np.maximum.accumulate(np.where(v == 0, idx + 1, group_start))[ends - 1]
+        bounds = np.empty(2 * len(starts), dtype=np.intp)
+        bounds[0::2] = first
+        bounds[1::2] = ends
+        lows = np.minimum.reduceat(np.r_[v, 0], bounds)[0::2]
+        out[:,c] = np.where(first < ends, lows, 0)
+
+    return out
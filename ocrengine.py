@@ -0,0 +1,591 @@
+"""
+ocrengine.py - OCR backends for hocrmod.py
+
+There are three ways to get hocr for an image:
+
+    tesseract - run pytesseract for every image (default)
+    worker    - keep long-lived worker processes warm for
+                each lang/arguments combination and pass
+                images to them over a pipe, 'worker:stub'
+                or 'worker:tesseract' picks what they run
+    stub      - fake Tesseract with one word per band of
+                ink, useful for trying things out (and timing
+                them) without Tesseract installed
+
+Images can be numpy arrays (BGR or gray, as opencv hands
+them out) or file paths. Each backend returns hocr bytes,
+just like pytesseract.image_to_pdf_or_hocr().
+
+The worker backend uses tesserocr if it is installed, which
+keeps the traineddata for '-l' loaded between images. Without
+it, workers fall back to pytesseract, which still saves on
+python startup but not on Tesseract's. Each worker reports the
+backend it loaded when it starts (and that goes into the cache
+key), one that can't load anything fails right away. Workers
+come from a fork server (spawn where there isn't one), and one
+that dies is replaced, the image it had fails but the next one
+doesn't.
+
+Any of them can be wrapped in a cache_engine, which keeps the
+hocr on disk keyed by a hash of the image, the lang/arguments
+and the Tesseract version, so re-runs (say, after changing
+'-b' or '-c') only OCR regions that actually changed.
+"""
+
+import atexit, hashlib, multiprocessing, os, queue, shlex, tempfile, threading, time
+
+#workers are started from OCR pool threads once opencv is loaded, forking
+#then copies whatever those threads hold, a fork server starts them clean
+WORKER_START = 'forkserver'
+#seconds before a cache temp file is taken to be left over from a writer that died
+STALE_TMP = 3600
+
+#opencv, numpy and pytesseract are imported when first needed, so
+#importing this module (or hocrmod.py) to set things up is quick
+
+#namespace for HOCR
+HOCR_NS = 'http://www.w3.org/1999/xhtml'
+
+ENGINES = ('tesseract','worker','worker:tesseract','worker:stub','stub')
+
+""" wrap page level hocr in a document, tesserocr only returns the page div """
+def hocrDocument(page_hocr):
+
+    return ('<?xml version="1.0" encoding="UTF-8"?>\n'
+        '<html xmlns="%s">\n <body>\n%s </body>\n</html>\n' %
+        (HOCR_NS,page_hocr)).encode('utf8')
+
+""" load image if needed, pytesseract and tesserocr take arrays as RGB """
+def rgbImage(image):
+    import cv2
+
+    if isinstance(image,str):
+        path, image = image, cv2.imread(image)
+        if image is None:
+            raise ValueError("cannot read image %s" % path)
+    if len(image.shape) == 3:
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+
+    return image
+
+""" tess_engine - pytesseract call for each image """
+class tess_engine:
+    def ocr(self, image, lang, args):
+        import pytesseract
+        if not isinstance(image,str):
+            image = rgbImage(image)
+
+        return pytesseract.image_to_pdf_or_hocr(image,
+            config=("-l %s %s" % (lang,args)).strip(),
+            extension='hocr')
+
+    def version(self, lang=None, args=None):
+        import pytesseract
+        return "tesseract %s" % pytesseract.get_tesseract_version()
+
+    def close(self):
+        pass
+
+""" stub_engine - deterministic stand-in for Tesseract """
+class stub_engine:
+    def __init__(self, text="stub", conf=95):
+        self.text = text
+        self.conf = conf
+
+    def ocr(self, image, lang, args):
+        import cv2
+        if isinstance(image,str):
+            path, image = image, cv2.imread(image)
+            if image is None:
+                raise ValueError("cannot read image %s" % path)
+        if len(image.shape) == 3:
+            image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        h, w = image.shape[:2]
+
+        #every horizontal band of dark pixels becomes a line with one word
+        ink = (image < 128).any(axis=1)
+        bands = []
+        y = 0
+        while y < h:
+            if ink[y]:
+                y0 = y
+                while y < h and ink[y]:
+                    y += 1
+                bands.append((y0,y))
+            y += 1
+
+        lines = ''
+        px0, py0, px1, py1 = w, h, 0, 0
+        for i, (y0,y1) in enumerate(bands):
+            cols = (image[y0:y1] < 128).any(axis=0).nonzero()[0]
+            bbox = '%d %d %d %d' % (cols[0],y0,cols[-1] + 1,y1)
+            px0, py0 = min(px0,cols[0]), min(py0,y0)
+            px1, py1 = max(px1,cols[-1] + 1), max(py1,y1)
+            lines += ('     <span class="ocr_line" id="line_1_%d" title="bbox %s; '
+                'baseline 0 0; x_size %d; x_descenders 0; x_ascenders 0">\n'
+                '      <span class="ocrx_word" id="word_1_%d" title="bbox %s; '
+                'x_wconf %d">%s</span>\n     </span>\n' %
+                (i + 1,bbox,y1 - y0,i + 1,bbox,self.conf,self.text))
+
+        page = '  <div class="ocr_page" id="page_1" title="bbox 0 0 %d %d">\n' % (w,h)
+        if len(lines) > 0:
+            pbox = '%d %d %d %d' % (px0,py0,px1,py1)
+            page += ('   <div class="ocr_carea" id="block_1_1" title="bbox %s">\n'
+                '    <p class="ocr_par" id="par_1_1" lang="%s" title="bbox %s">\n'
+                '%s    </p>\n   </div>\n' % (pbox,lang,pbox,lines))
+        page += '  </div>\n'
+
+        return hocrDocument(page)
+
+    def version(self, lang=None, args=None):
+        return "stub %s %d" % (self.text,self.conf)
+
+    def close(self):
+        pass
+
+""" set up tesserocr for tesseract style arguments, None if it can't be used """
+def warmApi(lang,args):
+
+    try:
+        import tesserocr
+    except ImportError:
+        return None
+
+    psm = None
+    oem = tesserocr.OEM.DEFAULT
+    variables = []
+    tokens = shlex.split(args)
+    while len(tokens) > 0:
+        token = tokens.pop(0)
+        if token == '--psm' and len(tokens) > 0:
+            psm = int(tokens.pop(0))
+        elif token == '--oem' and len(tokens) > 0:
+            oem = int(tokens.pop(0))
+        elif token == '--dpi' and len(tokens) > 0:
+            variables.append(('user_defined_dpi',tokens.pop(0)))
+        elif token == '-c' and len(tokens) > 0 and '=' in tokens[0]:
+            variables.append(tuple(tokens.pop(0).split('=',1)))
+        else:
+            #not something we can pass along, leave it to the command line
+            return None
+
+    api = tesserocr.PyTessBaseAPI(lang=lang, oem=oem)
+    if psm is not None:
+        api.SetPageSegMode(psm)
+    for name, value in variables:
+        api.SetVariable(name,value)
+
+    return api
+
+""" worker process - keep an engine warm and answer requests until told to stop,
+    the first message back is the backend it loaded (or why it couldn't) """
+def workerLoop(conn,lang,args,inner=None):
+
+    api = None
+    try:
+        if inner is None:
+            api = warmApi(lang,args)
+        fallback = stub_engine() if inner == 'stub' else tess_engine()
+        if api is not None:
+            import tesserocr
+            backend = "tesserocr %s" % tesserocr.tesseract_version()
+        else:
+            backend = fallback.version()
+    except Exception as e:
+        conn.send((False,str(e)))
+        conn.close()
+        return
+    conn.send((True,backend))
+
+    while True:
+        try:
+            image = conn.recv()
+        except EOFError:
+            break
+        if image is None:
+            break
+        try:
+            if api is not None:
+                from PIL import Image
+                api.SetImage(Image.fromarray(rgbImage(image)))
+                api.Recognize()
+                result = hocrDocument(api.GetHOCRText(0))
+            else:
+                result = fallback.ocr(image,lang,args)
+            conn.send((True,result))
+        except Exception as e:
+            conn.send((False,str(e)))
+
+    if api is not None:
+        api.End()
+    conn.close()
+
+""" worker_engine - long-lived workers per (lang, args) combination, running
+    inner ('tesseract' or 'stub') or tesserocr where it can be used """
+class worker_engine:
+    def __init__(self, size=1, inner=None):
+        self.size = max(size,1)
+        self.inner = inner
+        self.idle = {}
+        self.backends = {}
+        self.procs = []
+        self.lock = threading.Lock()
+        if WORKER_START in multiprocessing.get_all_start_methods():
+            self.context = multiprocessing.get_context(WORKER_START)
+        else:
+            self.context = multiprocessing.get_context('spawn')
+
+    #new worker process, hands back its end of the pipe (call with the lock held)
+    def startWorker(self, lang, args):
+        conn, child_conn = self.context.Pipe()
+        proc = self.context.Process(target=workerLoop,
+            args=(child_conn,lang,args,self.inner), daemon=True)
+        proc.start()
+        child_conn.close()
+        self.procs.append((proc,conn))
+
+        return conn
+
+    #wait for a new worker to say what it loaded, one that couldn't is stopped
+    def greetWorker(self, conn, lang, args):
+        try:
+            ok, backend = conn.recv()
+        except (EOFError, OSError):
+            ok, backend = False, "worker exited"
+        if not ok:
+            self.stopWorker(conn)
+            raise RuntimeError("OCR worker for %s %s could not start: %s" %
+                (lang,args,backend))
+        self.backends[(lang,args)] = backend
+
+    #kill a worker and close its pipe (call with the lock held)
+    def stopWorker(self, conn):
+        for proc, pconn in self.procs:
+            if pconn is conn:
+                self.procs.remove((proc,pconn))
+                proc.kill()
+                proc.join(timeout=5)
+                break
+        conn.close()
+
+    def workers(self, lang, args):
+        key = (lang,args)
+        with self.lock:
+            if key not in self.idle:
+                #all of them start together, then each one checks in
+                conns = [self.startWorker(lang,args) for i in range(self.size)]
+                try:
+                    for conn in conns:
+                        self.greetWorker(conn,lang,args)
+                except RuntimeError:
+                    for conn in conns:
+                        if not conn.closed:
+                            self.stopWorker(conn)
+                    raise
+                self.idle[key] = queue.Queue()
+                for conn in conns:
+                    self.idle[key].put(conn)
+
+        return self.idle[key]
+
+    #a worker whose pipe broke is dropped and a new one takes its place
+    def replaceWorker(self, conn, lang, args):
+        with self.lock:
+            self.stopWorker(conn)
+            conn = self.startWorker(lang,args)
+            self.greetWorker(conn,lang,args)
+            return conn
+
+    def ocr(self, image, lang, args):
+        idle = self.workers(lang,args)
+        #blocks until one of the workers for this combination is free
+        conn = idle.get()
+        try:
+            conn.send(image)
+            ok, result = conn.recv()
+        except (EOFError, OSError):
+            #this image fails, the next one gets a working process
+            conn = self.replaceWorker(conn,lang,args)
+            raise
+        finally:
+            idle.put(conn)
+        if not ok:
+            import pytesseract
+            raise pytesseract.TesseractError(-1,result)
+
+        return result
+
+    #what the workers for a lang/args combination loaded (starting them if needed)
+    def version(self, lang='eng', args=''):
+        self.workers(lang,args)
+        return self.backends[(lang,args)]
+
+    def close(self):
+        with self.lock:
+            for proc, conn in self.procs:
+                try:
+                    conn.send(None)
+                except (BrokenPipeError, OSError):
+                    pass
+            for proc, conn in self.procs:
+                proc.join(timeout=5)
+                conn.close()
+            self.procs = []
+            self.idle = {}
+            self.backends = {}
+
+""" cache key for an image (array or file) and the settings that went with it """
+def cacheKey(image,lang,args,version):
+    import numpy as np
+
+    h = hashlib.sha256()
+    if isinstance(image,str):
+        with open(image,'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                h.update(chunk)
+    else:
+        image = np.ascontiguousarray(image)
+        h.update(("%s %s\n" % (image.shape,image.dtype)).encode('utf8'))
+        h.update(image.data)
+    h.update(("\n%s\n%s\n%s" % (lang,args,version)).encode('utf8'))
+
+    return h.hexdigest()
+
+""" cache_engine - content addressed hocr cache on disk in front of another engine
+
+Entries live in cdir/<2 hex>/<hash>.hocr and are written to a temp
+file and renamed into place, so processes sharing the directory never
+see half an entry. A hit touches the entry, and when the directory
+grows past max_bytes the least recently used entries are removed
+(under a lock file where the platform has one).
+"""
+class cache_engine:
+    def __init__(self, engine, cdir, max_bytes):
+        self.engine = engine
+        self.cdir = cdir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+        #bytes on disk, as far as this process knows, None until first needed
+        self.size = None
+        self.lock = threading.Lock()
+        self.tags = {}
+        os.makedirs(cdir, exist_ok=True)
+
+    def entryPath(self, key):
+        return os.path.join(self.cdir, key[:2], key + '.hocr')
+
+    def ocr(self, image, lang, args):
+        return self.fetch(image,lang,args)[0]
+
+    #hocr for an image, whether it was a hit and how many entries were evicted to make room,
+    #misses go to engine if given (the same one underneath, but counted by the caller)
+    def fetch(self, image, lang, args, engine=None):
+        #the backend can depend on the settings (the worker engine's does)
+        tag = self.tags.get((lang,args))
+        if tag is None:
+            tag = self.tags[(lang,args)] = self.engine.version(lang,args)
+        path = self.entryPath(cacheKey(image,lang,args,tag))
+
+        try:
+            with open(path,'rb') as f:
+                result = f.read()
+        except FileNotFoundError:
+            result = None
+        if result is not None:
+            #most recently used, unless it was evicted since it was read
+            try:
+                os.utime(path)
+            except OSError:
+                pass
+            with self.lock:
+                self.hits += 1
+            return result, True, 0
+
+        result = (engine or self.engine).ocr(image,lang,args)
+        with self.lock:
+            self.misses += 1
+
+        return result, False, self.store(path,result)
+
+    #counts for one caller (a page, say) while others share the cache
+    def counter(self, engine=None):
+        return cache_counter(self,engine)
+
+    def store(self, path, result):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(fd,'wb') as f:
+                f.write(result)
+            os.replace(tmp,path)
+        except OSError:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            return 0
+
+        with self.lock:
+            if self.size is None:
+                self.size = self.diskSize()
+            else:
+                self.size += len(result)
+            full = self.size > self.max_bytes
+        if full:
+            return self.evict()
+        return 0
+
+    #entries as (mtime, size, path), and temp files older than STALE_TMP as (size, path)
+    def entries(self):
+        found = []
+        stale = []
+        cutoff = time.time() - STALE_TMP
+        for sub in os.scandir(self.cdir):
+            if not sub.is_dir():
+                continue
+            for entry in os.scandir(sub.path):
+                if not entry.name.endswith(('.hocr','.tmp')):
+                    continue
+                try:
+                    st = entry.stat()
+                except FileNotFoundError:
+                    continue
+                if entry.name.endswith('.hocr'):
+                    found.append((st.st_mtime,st.st_size,entry.path))
+                elif st.st_mtime < cutoff:
+                    stale.append((st.st_size,entry.path))
+        return found, stale
+
+    def diskSize(self):
+        found, stale = self.entries()
+        return (sum(size for mtime, size, path in found) +
+            sum(size for size, path in stale))
+
+    def evict(self):
+        #trim to 90% of the cap so eviction isn't run for every new entry
+        low_water = int(self.max_bytes * 0.9)
+        with lockFile(os.path.join(self.cdir,'.lock')):
+            found, stale = self.entries()
+            found.sort()
+            #a writer that died never renames its temp file into place
+            for fsize, path in stale:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            size = sum(size for mtime, size, path in found)
+            removed = 0
+            for mtime, fsize, path in found:
+                if size <= low_water:
+                    break
+                try:
+                    os.remove(path)
+                    removed += 1
+                except FileNotFoundError:
+                    pass
+                size -= fsize
+        with self.lock:
+            self.size = size
+            self.evicted += removed
+
+        return removed
+
+    def counts(self):
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses, 'evicted': self.evicted}
+
+    def version(self, lang='eng', args=''):
+        return self.engine.version(lang,args)
+
+    def close(self):
+        pass
+
+""" cache_counter - one caller's hits, misses and evictions on a shared cache_engine """
+class cache_counter:
+    def __init__(self, cache, engine=None):
+        self.cache = cache
+        self.engine = engine
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+        self.lock = threading.Lock()
+
+    def ocr(self, image, lang, args):
+        result, hit, evicted = self.cache.fetch(image,lang,args,self.engine)
+        with self.lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+            self.evicted += evicted
+        return result
+
+    def counts(self):
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses, 'evicted': self.evicted}
+
+    def version(self, lang='eng', args=''):
+        return self.cache.version(lang,args)
+
+    def close(self):
+        pass
+
+""" lockFile - exclusive lock on a file for the length of a with block (posix only) """
+class lockFile:
+    def __init__(self, path):
+        self.path = path
+        self.f = None
+
+    def __enter__(self):
+        try:
+            import fcntl
+        except ImportError:
+            return self
+        self.f = open(self.path,'a')
+        fcntl.flock(self.f, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        if self.f is not None:
+            import fcntl
+            fcntl.flock(self.f, fcntl.LOCK_UN)
+            self.f.close()
+            self.f = None
+
+#engines are kept for the life of the process so workers stay warm between pages
+engines = {}
+
+""" get (and keep) an engine by name """
+def getEngine(name,size=1):
+
+    #worker pools of different sizes are kept apart, 'worker:stub' runs stubs in them
+    kind, _, inner = name.partition(':')
+    key = (name,max(size,1)) if kind == 'worker' else name
+    if key not in engines:
+        if kind == 'worker':
+            engines[key] = worker_engine(size,inner or None)
+        elif name == 'stub':
+            engines[key] = stub_engine()
+        else:
+            engines[key] = tess_engine()
+
+    return engines[key]
+
+""" get (and keep) an engine with an on-disk cache in front of it, size cap in MB """
+def getCachedEngine(name,size,cdir,cache_mb):
+
+    key = (name,size if name.startswith('worker') else None,os.path.abspath(cdir))
+    if key not in engines:
+        engines[key] = cache_engine(getEngine(name,size),cdir,
+            int(cache_mb * 1024 * 1024))
+
+    return engines[key]
+
+""" shut down any workers """
+def closeEngines():
+
+    for engine in engines.values():
+        engine.close()
+    engines.clear()
+
+atexit.register(closeEngines)
@@ -0,0 +1,160 @@
+"""
+pagemetrics.py - per page timings and counters for hocrmod.py
+
+With '--metrics', each stage of a page is timed (wall clock)
+and its peak memory taken from tracemalloc, which sees numpy
+and opencv arrays as well as python objects. Counters keep
+track of things like how many contours were found and how
+long OCR took. Each page goes out as one line of JSON.
+
+Without '--metrics', a page_metrics is still handed around
+but does nothing, so the stages don't need to check.
+
+tracemalloc is for the whole process, so per stage peaks only
+work with one page at a time. Where pages overlap (the pipeline
+and the server), traceProcess() starts it once and each page
+gets the process peak so far (process_peak_bytes) instead.
+"""
+
+import contextlib, json, sys, threading, time, tracemalloc
+
+try:
+    import resource
+except ImportError: #not on windows
+    resource = None
+
+""" stage_info - running totals for one stage """
+class stage_info:
+    def __init__(self):
+        self.seconds = 0.0
+        self.calls = 0
+        self.peak = 0
+
+""" page_metrics - stages and counters for one page """
+class page_metrics:
+    def __init__(self, page=None, enabled=False):
+        self.page = page
+        self.enabled = enabled
+        self.stages = {}
+        self.counters = {}
+        self.stack = []
+        self.lock = threading.Lock()
+        self.started = time.perf_counter()
+        self.tracing = False
+        #someone else is tracing, leave the peak alone
+        self.shared = enabled and tracemalloc.is_tracing()
+        if enabled and not self.shared:
+            tracemalloc.start()
+            self.tracing = True
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        if not self.enabled:
+            yield
+            return
+
+        info = self.stages.setdefault(name, stage_info())
+        if self.shared:
+            start = time.perf_counter()
+            try:
+                yield
+            finally:
+                info.seconds += time.perf_counter() - start
+                info.calls += 1
+            return
+
+        #the enclosing stage keeps its peak so far, then the peak starts over
+        if len(self.stack) > 0:
+            outer = self.stack[-1]
+            outer.peak = max(outer.peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.reset_peak()
+        self.stack.append(info)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            info.seconds += time.perf_counter() - start
+            info.calls += 1
+            peak = tracemalloc.get_traced_memory()[1]
+            info.peak = max(info.peak, peak)
+            self.stack.pop()
+            if len(self.stack) > 0:
+                self.stack[-1].peak = max(self.stack[-1].peak, peak)
+
+    def count(self, name, n=1):
+        if self.enabled:
+            with self.lock:
+                self.counters[name] = self.counters.get(name,0) + n
+
+    """ wrap an OCR engine so calls and time spent are counted """
+    def engine(self, engine):
+        if not self.enabled:
+            return engine
+        return timed_engine(engine, self)
+
+    def result(self):
+        #tracing slows everything down, only keep it on for the page
+        if self.tracing:
+            tracemalloc.stop()
+            self.tracing = False
+
+        result = {'page': self.page,
+            'seconds': round(time.perf_counter() - self.started,6),
+            'stages': {name: {'seconds': round(info.seconds,6),
+                'calls': info.calls, 'peak_bytes': info.peak}
+                for name, info in self.stages.items()},
+            'counters': {name: round(v,3) if isinstance(v,float) else v
+                for name, v in self.counters.items()}}
+        if self.shared:
+            #other pages were running too, only the process peak means anything
+            for info in result['stages'].values():
+                del info['peak_bytes']
+            if tracemalloc.is_tracing():
+                result['process_peak_bytes'] = tracemalloc.get_traced_memory()[1]
+        if resource is not None:
+            #kilobytes on linux, bytes on macos
+            result['max_rss'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+        return result
+
+""" timed_engine - count OCR calls and milliseconds for an engine (below any cache,
+    so hits aren't counted as calls) """
+class timed_engine:
+    def __init__(self, engine, metrics):
+        self.engine = engine
+        self.metrics = metrics
+
+    def ocr(self, image, lang, args):
+        start = time.perf_counter()
+        try:
+            return self.engine.ocr(image,lang,args)
+        finally:
+            self.metrics.count('ocr_calls')
+            self.metrics.count('ocr_ms', (time.perf_counter() - start) * 1000.0)
+
+    def version(self, lang='eng', args=''):
+        return self.engine.version(lang,args)
+
+    def close(self):
+        pass
+
+""" trace memory once for the process, for when pages overlap,
+    returns True if it was started here (and should be stopped by the caller) """
+def traceProcess():
+
+    if tracemalloc.is_tracing():
+        return False
+    tracemalloc.start()
+    return True
+
+""" append one page of metrics (or a list of them, for a volume) as lines of JSON,
+    '-' for standard error """
+def writeMetrics(path,result):
+
+    results = result if isinstance(result,list) else [result]
+    lines = ''.join(json.dumps(r, sort_keys=True) + '\n' for r in results)
+    if path == '-':
+        print(lines, end='', file=sys.stderr)
+    else:
+        with open(path,'a') as f:
+            f.write(lines)
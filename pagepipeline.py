@@ -0,0 +1,163 @@
+"""
+pagepipeline.py - run a batch of pages through hocrmod.py in overlapping stages
+
+With '--pipeline', pages go through four stages in one process,
+each with its own thread(s) and a short queue in front of it:
+
+    decode   - read the base hocr boxes and the page in gray
+               (running Tesseract first if there is no hocr)
+    contours - block out recognized text, find candidate regions
+    ocr      - OCR the candidates, '-j' at a time across pages
+    merge    - slot what was found into the hocr and write it
+
+While one page is with Tesseract, the next can be in opencv and
+the one after that being read, so a batch goes at about the
+speed of its slowest stage rather than the sum of them. A full
+queue holds up the stage feeding it, so only a handful of pages
+are ever in memory however quickly they can be decoded.
+
+opencv and the OCR engines let go of the GIL while they work,
+which is what lets threads (rather than processes) overlap here.
+"""
+
+import asyncio, concurrent.futures, os, time, tracemalloc
+import hocrindex, hocrmod
+
+#pages waiting in front of each stage
+QUEUE_SIZE = 2
+#threads (pages at once) for each stage, in order, ocr also has its own '-j' pool
+STAGE_WORKERS = (('decode',1),('contours',1),('ocr',2),('merge',1))
+
+""" page_job - one page and what the stages have made of it so far """
+class page_job:
+    def __init__(self, ifile, args):
+        self.ifile = ifile
+        self.hocr_file = ifile.rsplit('.', 1)[0] + '.hocr'
+        self.img_base = self.hocr_file.rsplit('.', 1)[0]
+        self.state = hocrmod.page_state(ifile,args.quiet,args.metrics is not None)
+        #the engine (and cache) is shared, the counts are the page's
+        self.engine, self.cache = hocrmod.pageEngine(args,self.state.metrics)
+        self.dpi = None
+        self.boxes = None
+        self.gray = None
+        self.cands = None
+        self.extras = 0
+        self.pars = None
+        self.error = None
+        #time spent sitting in queues
+        self.queued = time.perf_counter()
+        self.waited = 0.0
+
+""" read the boxes and the page, OCR the page first if there's no hocr for it """
+def decodePage(job,args,ocr_pool):
+    metrics = job.state.metrics
+
+    if not os.path.exists(job.hocr_file):
+        with metrics.stage("baseOcr"):
+            hocrmod.writeHocr(job.engine.ocr(job.ifile,args.lang,""),job.hocr_file)
+    job.dpi = hocrmod.pageDpi(job.ifile,args)
+    with metrics.stage("decode"):
+        job.boxes = hocrmod.hocrBoxes(job.hocr_file,args.words)
+        job.gray = hocrmod.grayImage(job.ifile)
+        if job.gray is None:
+            raise ValueError("unable to read image")
+
+""" block out what the hocr has and gather up the candidate regions """
+def contourPage(job,args,ocr_pool):
+
+    try:
+        with job.state.metrics.stage("contours"):
+            tmask = hocrmod.blockOut(job.gray,job.boxes,job.img_base,
+                args.border,args.debug,job.state)
+            job.cands = list(hocrmod.findCandidates(job.img_base,job.gray,args.debug,
+                args.border,args.reduce,job.dpi,tmask,args.integral,args.pagelines,job.state))
+    finally:
+        #the stage threads live for the whole batch
+        hocrmod.releaseBuffers()
+    #the candidates are copies, the page isn't needed any more
+    job.boxes = job.gray = None
+
+""" OCR the candidates in the shared pool """
+def ocrPage(job,args,ocr_pool):
+
+    with job.state.metrics.stage("ocr"):
+        job.extras, job.pars = hocrmod.ocrCandidates(job.img_base,job.cands,
+            args.debug,args.arguments,args.lang,job.engine,args.montage,ocr_pool)
+    job.cands = None
+
+""" merge the new paragraphs into the hocr and write it out """
+def mergePage(job,args,ocr_pool):
+
+    if job.extras > 0:
+        with job.state.metrics.stage("runThruPars"):
+            hocrmod.runThruPars(job.hocr_file,job.pars,args.conf,args.lang,job.state)
+    job.pars = None
+    if args.index:
+        with job.state.metrics.stage("writeIndex"):
+            hocrindex.indexHocr(job.hocr_file)
+
+""" workers for one stage, a page that failed earlier is passed along untouched,
+    each finished worker sends one None on to the next stage """
+async def runStage(func, inq, outq, workers, next_workers, args, ocr_pool):
+    loop = asyncio.get_running_loop()
+
+    async def worker(pool):
+        while True:
+            job = await inq.get()
+            if job is None:
+                return
+            job.waited += time.perf_counter() - job.queued
+            if job.error is None:
+                try:
+                    await loop.run_in_executor(pool,func,job,args,ocr_pool)
+                except Exception as e:
+                    job.error = str(e)
+                    job.boxes = job.gray = job.cands = job.pars = None
+            job.queued = time.perf_counter()
+            #blocks while the next stage is backed up
+            await outq.put(job)
+
+    #one thread per worker
+    with concurrent.futures.ThreadPoolExecutor(workers) as pool:
+        await asyncio.gather(*[worker(pool) for _ in range(workers)])
+    for _ in range(next_workers):
+        await outq.put(None)
+
+""" push the pages through the stages, report() gets each page as it comes out """
+async def pipePages(ifiles, args, report):
+    funcs = (decodePage,contourPage,ocrPage,mergePage)
+    counts = [n for _, n in STAGE_WORKERS] + [1]
+    queues = [asyncio.Queue(QUEUE_SIZE) for _ in range(len(funcs) + 1)]
+
+    async def feed():
+        for ifile in ifiles:
+            await queues[0].put(page_job(ifile,args))
+        for _ in range(counts[0]):
+            await queues[0].put(None)
+
+    async def drain():
+        while True:
+            job = await queues[-1].get()
+            if job is None:
+                return
+            metrics = job.state.metrics
+            metrics.count('queue_ms',job.waited * 1000.0)
+            metrics.count('lines_added',job.state.lines)
+            counts = hocrmod.cacheCounts(job.cache,metrics)
+            report(job.ifile,job.state.lines,job.error,counts,
+                metrics.result() if metrics.enabled else None)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=args.jobs) as ocr_pool:
+        await asyncio.gather(feed(),drain(),
+            *[runStage(func,queues[i],queues[i + 1],counts[i],counts[i + 1],args,ocr_pool)
+                for i, func in enumerate(funcs)])
+
+""" run single page images through the pipeline, report() gets each one as it's done """
+def runPipeline(ifiles, args, report):
+
+    args, tracing = hocrmod.sharedOptions(args)
+    try:
+        asyncio.run(pipePages(ifiles,args,report))
+    finally:
+        if tracing:
+            tracemalloc.stop()
@@ -0,0 +1,7 @@
+"""
+conftest.py - the scripts live at the top of the repo, not in a package
+"""
+
+import os, sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,144 @@
+"""
+test_cleanhocr.py - batch runs and the two ways through a page
+"""
+
+import os, random
+import pytest
+import cleanhocr, hocrindex, hocrwords
+
+PAGE = ('<html xmlns="http://www.w3.org/1999/xhtml"><head><title></title></head><body>'
+    '<div class="ocr_page" id="page_1" title="bbox 0 0 800 1000">'
+    '<div class="ocr_carea" id="block_1_1" title="bbox 10 10 300 60">'
+    '<p class="ocr_par" id="par_1_1" lang="eng" title="bbox 10 10 300 60">'
+    '<span class="ocr_line" id="line_1_1" title="bbox 10 10 300 60; baseline 0 -5">'
+    '<span class="ocrx_word" id="word_1_1" title="bbox 10 10 120 60; x_wconf 91">one</span> '
+    '<span class="ocrx_word" id="word_1_2" title="bbox 130 10 200 60; x_wconf 40">two</span> '
+    '<span class="ocrx_word" id="word_1_3" title="bbox 210 10 300 60; x_wconf 20">p7</span>'
+    '</span></p></div></div></body></html>')
+
+""" a random hocr file of a page or two, words with and without numbers over a
+    range of confidences, some of the blocks marked as added by hocrmod.py """
+def randomHocr(rng):
+    out = ['<html xmlns="http://www.w3.org/1999/xhtml"><head><title></title></head><body>']
+    n = 0
+    for p in range(1,rng.randint(1,2) + 1):
+        out.append('<div class="ocr_page" id="page_%d" title="bbox 0 0 900 900; ppageno %d">' %
+            (p,p - 1))
+        for b in range(rng.randint(1,4)):
+            added = rng.random() < 0.3
+            if added:
+                out.append('<!-- START HOCRMOD -->')
+            out.append('<div class="ocr_carea" id="block_%d_%d">' % (p,b))
+            for q in range(rng.randint(1,3)):
+                out.append('<p class="ocr_par" id="par_%d_%d_%d" lang="eng">' % (p,b,q))
+                for l in range(rng.randint(1,3)):
+                    out.append('<span class="ocr_line" id="line_%d_%d_%d_%d" title="bbox 0 0 1 1">' %
+                        (p,b,q,l))
+                    for w in range(rng.randint(1,5)):
+                        n += 1
+                        x, y = rng.randint(0,800), rng.randint(0,800)
+                        text = rng.choice(['word','p%d' % n,'%d' % n,'caf\u00e9','a&amp;b'])
+                        out.append('<span class="ocrx_word" id="word_%d" '
+                            'title="bbox %d %d %d %d; x_wconf %d">%s</span> ' %
+                            (n,x,y,x + rng.randint(1,90),y + rng.randint(1,40),
+                            rng.randint(0,99),text))
+                    out.append('</span>')
+                out.append('</p>')
+            out.append('</div>')
+            if added:
+                out.append('<!-- END HOCRMOD -->')
+        out.append('</div>')
+    out.append('</body></html>')
+
+    return ''.join(out)
+
+""" words of a cleaned file as (page, text, box, conf, inserted), in no particular order """
+def keptWords(odw_file):
+    if not os.path.exists(odw_file):
+        return []
+    words = hocrindex.loadIndex(hocrindex.indexFile(odw_file))
+    found = [(words.ident('page',i),words.text(i),tuple(words.bbox[i].tolist()),
+        int(words.conf[i]),bool(words.inserted[i])) for i in range(len(words))]
+    #the index has what the file has
+    tree = hocrwords.loadWords(odw_file)
+    assert [tree.text(i) for i in range(len(tree))] == [w[1] for w in found]
+
+    return sorted(found)
+
+""" a few hocr files in a directory """
+def makeBatch(tmp_path, n=3):
+    for i in range(n):
+        (tmp_path / ('page%d.hocr' % i)).write_text(PAGE)
+
+    return str(tmp_path)
+
+def batch(source, capsys, *flags):
+    args = cleanhocr.buildParser().parse_args(['-s',source,'-w','1','-q',
+        '--state',os.path.join(source,'state.db')] + list(flags))
+    cleaned = cleanhocr.runBatch(cleanhocr.collectHocr(args.source),args)
+    capsys.readouterr()
+    return cleaned
+
+def test_batch_options(tmp_path, capsys):
+    source = makeBatch(tmp_path)
+    odw_file = os.path.join(source,'page0_odw.hocr')
+
+    assert batch(source,capsys) == 3
+    assert 'two' not in open(odw_file).read()
+    assert batch(source,capsys) == 0
+    #a different threshold (or any other option that changes the output) does them again
+    assert batch(source,capsys,'-c','30') == 3
+    assert 'two' in open(odw_file).read()
+    assert batch(source,capsys,'-c','30') == 0
+    assert batch(source,capsys,'-c','30','-n') == 3
+    assert 'p7' in open(odw_file).read()
+
+def test_batch_changed_files(tmp_path, capsys):
+    source = makeBatch(tmp_path)
+    assert batch(source,capsys) == 3
+
+    #touching a file isn't a change, new contents or a lost output are
+    os.utime(os.path.join(source,'page0.hocr'))
+    assert batch(source,capsys) == 0
+    (tmp_path / 'page1.hocr').write_text(PAGE.replace('one','uno'))
+    os.remove(os.path.join(source,'page2_odw.hocr'))
+    assert batch(source,capsys) == 2
+    assert 'uno' in open(os.path.join(source,'page1_odw.hocr')).read()
+
+def test_write_interrupted(tmp_path, monkeypatch):
+    hocr_file = tmp_path / 'page.hocr'
+    hocr_file.write_text(PAGE)
+    odw_file = str(tmp_path / 'page_odw.hocr')
+
+    def stop(node, f):
+        f.write('<html>')
+        raise KeyboardInterrupt
+    monkeypatch.setattr(cleanhocr.hocrio,'writePrettyHocr',stop)
+    with pytest.raises(KeyboardInterrupt):
+        cleanhocr.cleanPage(str(hocr_file))
+    #nothing half written is left to look finished
+    assert sorted(os.listdir(tmp_path)) == ['page.hocr']
+
+    monkeypatch.undo()
+    assert cleanhocr.cleanPage(str(hocr_file)).words == 1
+    assert open(odw_file).read().startswith('<?xml')
+    assert sorted(os.listdir(tmp_path)) == ['page.hocr','page_odw.hocr']
+
+@pytest.mark.parametrize('seed', range(40))
+def test_stream_words(tmp_path, seed):
+    rng = random.Random(seed)
+    text = randomHocr(rng)
+    conf = rng.choice([0,30,50,80])
+    number = rng.random() < 0.5
+
+    kept = {}
+    for stream in (False,True):
+        work = tmp_path / ('stream' if stream else 'tree')
+        work.mkdir()
+        (work / 'page.hocr').write_text(text)
+        cleanhocr.cleanPage(str(work / 'page.hocr'),cleanhocr.cleanOptions(conf=conf,
+            number=number,stream=stream,index=True))
+        kept[stream] = keptWords(str(work / 'page_odw.hocr'))
+
+    #the layout is different, the words that are left aren't
+    assert kept[True] == kept[False]
@@ -0,0 +1,128 @@
+"""
+test_hocrindex.py - the word index against the columns pageWords() gets from the tree
+"""
+
+import xml.etree.ElementTree as ET
+import random
+import pytest
+import hocrindex, hocrwords
+
+""" a random hocr file with the awkward bits: words outside of lines, paragraphs outside
+    of blocks, words with no text or no confidence, the other line classes and HOCRMOD
+    insertions (every word is in a paragraph, pageWords() leaves out any that aren't) """
+def randomHocr(rng):
+    n = 0
+
+    def words():
+        nonlocal n
+        out = ''
+        for w in range(rng.randint(0,4)):
+            n += 1
+            title = 'bbox %d %d %d %d' % (n,n + 1,n + 20,n + 9)
+            if rng.random() < 0.8:
+                title += '; x_wconf %d' % rng.randint(0,99)
+            text = rng.choice(['w%d' % n,'%d' % n,'café %d' % n,'a&amp;b','  ',''])
+            out += '<span class="ocrx_word" id="word_%d" title="%s">%s</span> ' % (n,title,text)
+        return out
+
+    def lines(prefix):
+        out = ''
+        for l in range(rng.randint(0,3)):
+            kind = rng.choice(['ocr_line','ocr_line','ocr_caption','ocr_header','ocr_textfloat'])
+            out += '<span class="%s" id="line_%s_%d" title="bbox 0 0 1 1">%s</span>' % (
+                kind,prefix,l,words())
+        return out
+
+    def pars(prefix):
+        out = ''
+        for q in range(rng.randint(0,3)):
+            out += '<p class="ocr_par" id="par_%s_%d">%s%s</p>' % (prefix,q,
+                words() if rng.random() < 0.2 else '',lines('%s_%d' % (prefix,q)))
+        return out
+
+    out = '<html xmlns="http://www.w3.org/1999/xhtml"><body>'
+    for p in range(1,rng.randint(1,3) + 1):
+        out += '<div class="ocr_page" id="page_%d" title="bbox 0 0 900 900">' % p
+        for b in range(rng.randint(0,4)):
+            added = rng.random() < 0.3
+            body = pars('%d_%d' % (p,b))
+            if rng.random() < 0.8:
+                body = '<div class="ocr_carea" id="block_%d_%d">%s</div>' % (p,b,body)
+            if added:
+                body = '<!-- START HOCRMOD -->%s<!-- END HOCRMOD -->' % body
+            out += body
+        out += '</div>'
+
+    return out + '</body></html>'
+
+""" the index and pageWords() for the same file """
+def indexAndWords(tmp_path, text):
+    hocr_file = tmp_path / 'page.hocr'
+    hocr_file.write_text(text)
+    count = hocrindex.indexHocr(str(hocr_file))
+    index = hocrindex.loadIndex(hocrindex.indexFile(str(hocr_file)))
+    builder = hocrwords.hocrmod_builder()
+    root = ET.fromstring(text,parser=ET.XMLParser(target=builder))
+    words = hocrwords.pageWords(root,hocrindex.LINE_CLASSES,builder.added)
+    assert count == len(index)
+
+    return index, words
+
+@pytest.mark.parametrize('seed', range(100))
+def test_index_columns(tmp_path, seed):
+    index, words = indexAndWords(tmp_path,randomHocr(random.Random(seed)))
+
+    assert len(index) == len(words)
+    assert [index.text(i) for i in range(len(index))] == [words.text(i) for i in range(len(words))]
+    assert index.bbox.tolist() == words.bbox.tolist()
+    assert index.conf.tolist() == words.conf.tolist()
+    assert index.inserted.astype(bool).tolist() == words.inserted.tolist()
+
+    #the same page, block and par for every word, looked up one at a time or as a table
+    for table, ids, rows in (('page',words.page_ids,words.page),
+            ('block',words.block_ids,words.block),('par',words.par_ids,words.par)):
+        expected = [ids[r] if r >= 0 else None for r in rows.tolist()]
+        assert [index.ident(table,i) for i in range(len(index))] == expected
+        names = index.table(table)
+        assert [names[r] if r >= 0 else None for r in getattr(index,table).tolist()] == expected
+
+    #lines have no ids in the columns, but the words should be grouped the same way
+    for i in range(len(index) - 1):
+        same = words.line[i] == words.line[i + 1]
+        assert (index.line[i] == index.line[i + 1]) == same
+        if same:
+            assert index.ident('line',i) == index.ident('line',i + 1)
+
+def test_index_flags(tmp_path):
+    text = randomHocr(random.Random(5))
+    index, words = indexAndWords(tmp_path,text)
+    flags = [i % 3 == 0 for i in range(len(words))]
+    assert len(flags) > 0
+
+    #flags handed in (cleanhocr.py drops the comments) win over the comments
+    hocr_file = str(tmp_path / 'page.hocr')
+    hocrindex.indexHocr(hocr_file,inserted=flags)
+    assert hocrindex.loadIndex(hocrindex.indexFile(hocr_file)).inserted.astype(bool).tolist() == flags
+    with pytest.raises(ValueError):
+        hocrindex.indexHocr(hocr_file,inserted=flags + [True])
+    with pytest.raises(ValueError):
+        hocrindex.indexHocr(hocr_file,inserted=flags[:-1])
+
+def test_not_an_index(tmp_path):
+    path = tmp_path / 'page.words'
+    path.write_bytes(b'<html></html>' * 10)
+    with pytest.raises(ValueError):
+        hocrindex.loadIndex(str(path))
+
+def test_loose_words(tmp_path):
+    #the index has every word with text, even one that isn't in a paragraph
+    text = ('<html xmlns="http://www.w3.org/1999/xhtml"><body>'
+        '<div class="ocr_page" id="page_1">'
+        '<span class="ocrx_word" id="word_1_1" title="bbox 1 2 3 4; x_wconf 70">loose</span>'
+        '<p class="ocr_par" id="par_1_1"><span class="ocrx_word" id="word_1_2" '
+        'title="bbox 5 6 7 8">kept</span></p></div></body></html>')
+    index, words = indexAndWords(tmp_path,text)
+    assert [index.text(i) for i in range(len(index))] == ['loose','kept']
+    assert [words.text(i) for i in range(len(words))] == ['kept']
+    assert index.ident('page',0) == 'page_1' and index.ident('par',0) is None
+    assert index.conf.tolist() == [70,-1]
@@ -0,0 +1,135 @@
+"""
+test_hocrio.py - the streaming writers against the round trips they replaced
+"""
+
+import io, os, random
+import xml.etree.ElementTree as ET
+from xml.dom import minidom
+import pytest
+import hocrio
+
+HTML = '{%s}' % hocrio.HOCR_NS
+
+ET.register_namespace('html', hocrio.HOCR_NS)
+
+PAGE = ('<html xmlns="http://www.w3.org/1999/xhtml"><head><title></title></head><body>'
+    '<div class="ocr_page" id="page_1" title="bbox 0 0 800 1000">'
+    '<div class="ocr_carea" id="block_1_1" title="bbox 10 10 300 60">'
+    '<p class="ocr_par" id="par_1_1" lang="eng" title="bbox 10 10 300 60">'
+    '<span class="ocr_line" id="line_1_1" title="bbox 10 10 300 60; baseline 0 -5">'
+    '<span class="ocrx_word" id="word_1_1" title="bbox 10 10 120 60; x_wconf 91">Café</span> '
+    '<span class="ocrx_word" id="word_1_2" title="bbox 130 10 300 60; x_wconf 12">&amp; &lt;more&gt;</span>'
+    '</span></p></div><!-- START HOCRMOD -->'
+    '<div class="ocr_carea" id="block_1_2" title="bbox 10 900 80 950">'
+    '<p class="ocr_par" id="par_1_2" title="bbox 10 900 80 950">'
+    '<span class="ocr_line" id="line_1_2" title="bbox 10 900 80 950">'
+    '<span class="ocrx_word" id="word_1_3" title="bbox 10 900 80 950; x_wconf 77">42</span>'
+    '</span></p></div><!-- END HOCRMOD --></div></body></html>')
+
+""" hocrmod.py's writer before hocrio, ET.tostring() and string clean-ups """
+def oldTessHocr(root):
+
+    rstr = ET.tostring(root).decode('utf8')
+    rstr = rstr.replace('--><','-->\n   <')
+    rstr = rstr.replace('\"><html:p','\">\n    <html:p')
+    rstr = rstr.replace('><html:span class=\"ocr_line\"','>\n     <html:span class=\"ocr_line\"')
+    rstr = rstr.replace('><html:span class=\"ocrx_word\"','>\n      <html:span class=\"ocrx_word\"')
+    rstr = rstr.replace('><html:span class=\"ocrx_word\"','>\n      <html:span class=\"ocrx_word\"')
+    rstr = rstr.replace('span></html:span','span>\n     </html:span')
+    rstr = rstr.replace('span></html:p','span>\n    </html:p')
+    rstr = rstr.replace('p></html:div','p>\n   </html:div')
+    rstr = rstr.replace('div><html','div>\n   <html')
+    rstr = rstr.replace('div><!--','div>\n   <!--')
+    rstr = os.linesep.join([s for s in rstr.splitlines() if s])
+
+    return (hocrio.TESS_HEADER + rstr).encode('utf8')
+
+""" cleanhocr.py's writer before hocrio, a minidom round trip """
+def oldPrettyHocr(root):
+
+    return minidom.parseString(ET.tostring(root)).toprettyxml(indent="   ")
+
+""" parse keeping comments, the way hocrmod.py reads its own output """
+def parseHocr(text):
+
+    return ET.fromstring(text,
+        parser=ET.XMLParser(target=ET.TreeBuilder(insert_comments=True)))
+
+def tessHocr(root):
+    f = io.BytesIO()
+    hocrio.writeTessHocr(root,f)
+    return f.getvalue()
+
+def prettyHocr(root):
+    f = io.StringIO()
+    hocrio.writePrettyHocr(root,f)
+    return f.getvalue()
+
+""" a random hocr-ish tree with the awkward bits: non-ascii, markup characters in
+    text and attributes, comments, empty elements and stray whitespace """
+def randomTree(rng):
+    pieces = ['a', 'Z', '9', ' ', '&', '<', '>', '"', "'", 'é', '中', '\n', '\t', '\r']
+
+    def text():
+        if rng.random() < 0.4:
+            return None
+        return ''.join(rng.choice(pieces) for _ in range(rng.randint(0,6)))
+
+    root = ET.Element(HTML + 'html')
+    body = ET.SubElement(root,HTML + 'body')
+    for b in range(rng.randint(1,3)):
+        block = ET.SubElement(body,HTML + 'div',{'class': 'ocr_carea', 'id': 'block_%d' % b})
+        for p in range(rng.randint(0,2)):
+            par = ET.SubElement(block,HTML + 'p',{'class': 'ocr_par', 'title': text() or 'x'})
+            for l in range(rng.randint(0,2)):
+                line = ET.SubElement(par,HTML + 'span',{'class': 'ocr_line'})
+                for w in range(rng.randint(0,3)):
+                    word = ET.SubElement(line,HTML + 'span',{'class': 'ocrx_word'})
+                    word.text = text()
+                    word.tail = text()
+            par.tail = text()
+        if rng.random() < 0.3:
+            body.append(ET.Comment(' START HOCRMOD '))
+
+    return root
+
+def test_tess_sample():
+    root = parseHocr(PAGE)
+    assert tessHocr(root) == oldTessHocr(root)
+
+def test_pretty_sample():
+    root = ET.fromstring(PAGE)
+    assert prettyHocr(root) == oldPrettyHocr(root)
+
+@pytest.mark.parametrize('seed', range(200))
+def test_random_trees(seed):
+    root = randomTree(random.Random(seed))
+    assert tessHocr(root) == oldTessHocr(root)
+    assert prettyHocr(root) == oldPrettyHocr(root)
+
+def test_escapes_match_tostring():
+    text = 'a & b < c > d " e \' f\r\n\tg é'
+    elem = ET.Element('w',{'title': text})
+    elem.text = text
+    assert ET.tostring(elem,encoding='unicode') == '<w title="%s">%s</w>' % (
+        hocrio.escapeAttrib(text),hocrio.escapeCdata(text))
+
+def test_names_match_tostring():
+    root = ET.Element('{urn:a}root',{'{urn:b}key': 'v',
+        '{http://www.w3.org/XML/1998/namespace}lang': 'en'})
+    ET.SubElement(root,HTML + 'p')
+    ET.SubElement(root,'plain')
+    qnames, namespaces = hocrio.xmlNames(root)
+    assert namespaces == {'urn:a': 'ns0', 'urn:b': 'ns1', hocrio.HOCR_NS: 'html'}
+    assert qnames['{http://www.w3.org/XML/1998/namespace}lang'] == 'xml:lang'
+    assert qnames['plain'] == 'plain'
+    assert tessHocr(root) == oldTessHocr(root)
+
+def test_mod_comments():
+    notes = [' START HOCRMOD ','something else','END HOCRMOD','START HOCRMOD',None,'  END HOCRMOD\n']
+    in_mod = False
+    seen = []
+    for note in notes:
+        in_mod = hocrio.modComment(note,in_mod)
+        seen.append(in_mod)
+    assert seen == [True,True,False,True,True,False]
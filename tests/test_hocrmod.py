@@ -0,0 +1,140 @@
+"""
+test_hocrmod.py - whole pages through processPage() and the batch, with the stub engine standing in for Tesseract
+"""
+
+import xml.etree.ElementTree as ET
+import os
+import cv2
+import numpy as np
+import pytest
+import hocrmod, ocrengine
+
+""" lines of random letters, something for region finding to work on """
+def textImage(seed, h=900, w=700):
+    rng = np.random.default_rng(seed)
+    image = np.full((h,w),255,dtype=np.uint8)
+    for y in range(80,h - 60,45):
+        words = [''.join(chr(int(c)) for c in rng.integers(97,123,size=int(rng.integers(2,8))))
+            for _ in range(5)]
+        cv2.putText(image,' '.join(words),(60,y),cv2.FONT_HERSHEY_SIMPLEX,0.9,0,2)
+
+    return image
+
+""" page image with a base hocr that only has its top half, the rest is there to be found """
+def makePage(path, seed):
+    image = textImage(seed)
+    cv2.imwrite(path,image)
+    top = image.copy()
+    top[image.shape[0] // 2:] = 255
+    with open(path.rsplit('.', 1)[0] + '.hocr','wb') as f:
+        f.write(ocrengine.stub_engine().ocr(top,'eng',''))
+
+""" a directory of pages for a batch """
+def makeBatch(path, n=3):
+    path.mkdir()
+    for i in range(n):
+        makePage(str(path / ('page%d.png' % i)),i)
+
+    return str(path)
+
+def hocrFiles(source):
+    found = {}
+    for name in sorted(os.listdir(source)):
+        if name.endswith('.hocr'):
+            with open(os.path.join(source,name),'rb') as f:
+                found[name] = f.read()
+
+    return found
+
+def runBatch(source, capsys, *flags):
+    args = hocrmod.buildParser().parse_args(['-s',source,'-e','stub','-w','2','-q'] +
+        list(flags))
+    total = hocrmod.runBatch(hocrmod.collectImages(args.source),args)
+    return total, capsys.readouterr().out
+
+@pytest.mark.parametrize('data', [b'', b'not an image', b'\x89PNG\r\n\x1a\n' + b'\x00' * 64])
+def test_unreadable_image(tmp_path, data):
+    ifile = str(tmp_path / 'page.png')
+    with open(ifile,'wb') as f:
+        f.write(data)
+    with pytest.raises(ValueError, match='cannot read image'):
+        hocrmod.processPage(ifile,hocrmod.pageOptions(engine='stub'))
+    with pytest.raises(ValueError, match='cannot read image'):
+        hocrmod.processPage(str(tmp_path / 'missing.png'),hocrmod.pageOptions(engine='stub'))
+
+def test_state(tmp_path, capsys):
+    source = makeBatch(tmp_path / 'pages')
+    state = str(tmp_path / 'state.db')
+    base = hocrFiles(source)
+
+    total, out = runBatch(source,capsys,'--state',state)
+    assert total > 0 and 'skipping 0 unchanged' in out
+    done = hocrFiles(source)
+    assert all(done[name] != base[name] for name in base)
+
+    #nothing changed, nothing done, nothing touched
+    stamps = [os.stat(os.path.join(source,name)).st_mtime_ns for name in done]
+    total, out = runBatch(source,capsys,'--state',state)
+    assert total == 0 and 'skipping 3 unchanged' in out
+    assert [os.stat(os.path.join(source,name)).st_mtime_ns for name in done] == stamps
+
+    #new options do every page again, from the original hocr rather than on top of the last run
+    total, out = runBatch(source,capsys,'--state',state,'-m')
+    assert total > 0 and 'skipping 0 unchanged' in out
+    assert all(hocrFiles(source)[name].count(b'START HOCRMOD') == done[name].count(b'START HOCRMOD')
+        for name in done)
+    total, out = runBatch(source,capsys,'--state',state,'-m')
+    assert 'skipping 3 unchanged' in out
+
+    #so does a new image
+    makePage(os.path.join(source,'page1.png'),7)
+    total, out = runBatch(source,capsys,'--state',state,'-m')
+    assert 'skipping 2 unchanged' in out
+
+""" a multi-page tiff with a base hocr for the top half of each page, made the way
+    hocrmod.py makes one when there isn't any """
+def makeVolume(path, seeds):
+    images = [textImage(seed,600,500) for seed in seeds]
+    tops = [image.copy() for image in images]
+    for top in tops:
+        top[300:] = 255
+    cv2.imwritemulti(path,tops)
+    hocrmod.processPage(path,hocrmod.pageOptions(engine='stub',workers=1))
+    cv2.imwritemulti(path,images)
+
+@pytest.mark.parametrize('workers', [1,3])
+def test_volume_ids(tmp_path, workers):
+    ifile = str(tmp_path / 'vol.tif')
+    makeVolume(ifile,(1,2,3))
+    result = hocrmod.processPage(ifile,hocrmod.pageOptions(engine='stub',workers=workers))
+    assert result.lines > 0
+
+    root = ET.parse(result.hocr_file).getroot()
+    pages = hocrmod.hocrPages(root)
+    assert [div.get('id') for div in pages] == ['page_1','page_2','page_3']
+    ids = []
+    for n, div in enumerate(pages,1):
+        for elem in div.iter():
+            ident = elem.get('id')
+            if ident is not None and elem is not div:
+                #block_<page>_<n>, par_<page>_<n> and so on
+                assert ident.split('_')[1] == str(n), ident
+                ids.append(ident)
+    assert len(ids) == len(set(ids))
+    #every page got something added
+    with open(result.hocr_file) as f:
+        parts = f.read().split('class="ocr_page"')[1:]
+    assert len(parts) == 3 and all('START HOCRMOD' in part for part in parts)
+
+@pytest.mark.parametrize('flags', [[], ['-m'], ['-x','-j','3']])
+def test_pipeline_same(tmp_path, capsys, flags):
+    pool = makeBatch(tmp_path / 'pool',4)
+    pipe = makeBatch(tmp_path / 'pipe',4)
+    #a volume goes through the pool either way
+    makeVolume(os.path.join(pool,'vol.tif'),(5,6))
+    makeVolume(os.path.join(pipe,'vol.tif'),(5,6))
+
+    pool_total, out = runBatch(pool,capsys,*flags)
+    pipe_total, out = runBatch(pipe,capsys,'--pipeline',*flags)
+    assert pipe_total == pool_total > 0
+    assert hocrFiles(pipe) == hocrFiles(pool)
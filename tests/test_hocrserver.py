@@ -0,0 +1,173 @@
+"""
+test_hocrserver.py - the service over a real socket, with the stub engine standing in for Tesseract
+"""
+
+import base64, http.client, json, os, threading
+import cv2
+import numpy as np
+import pytest
+import hocrmod, hocrserver, ocrengine
+
+""" lines of random letters, with a base hocr (if asked for) that only has the top half """
+def makePage(path, seed=0, hocr=False):
+    rng = np.random.default_rng(seed)
+    page = np.full((600,500),255,dtype=np.uint8)
+    for y in range(60,560,45):
+        words = [''.join(chr(int(c)) for c in rng.integers(97,123,size=int(rng.integers(2,7))))
+            for _ in range(4)]
+        cv2.putText(page,' '.join(words),(40,y),cv2.FONT_HERSHEY_SIMPLEX,0.9,0,2)
+    cv2.imwrite(path,page)
+    if hocr:
+        page[300:] = 255
+        with open(path.rsplit('.', 1)[0] + '.hocr','wb') as f:
+            f.write(ocrengine.stub_engine().ocr(page,'eng',''))
+
+""" servers on free ports for the given command line options, closed afterwards """
+@pytest.fixture
+def serve():
+    servers = []
+
+    def start(*flags):
+        args = hocrmod.buildParser().parse_args(['--serve','0','-e','stub','-w','2','-q'] +
+            list(flags))
+        httpd = hocrserver.makeServer(args.serve)
+        httpd.quiet = True
+        httpd.service = hocrserver.page_service(args)
+        threading.Thread(target=httpd.serve_forever,daemon=True).start()
+        servers.append(httpd)
+        return httpd
+
+    yield start
+    for httpd in servers:
+        httpd.shutdown()
+        httpd.server_close()
+        httpd.service.close()
+
+def call(httpd, method, path, body=None, kind='application/json'):
+    conn = http.client.HTTPConnection('127.0.0.1',httpd.server_address[1])
+    headers = {} if kind is None else {'Content-Type': kind}
+    conn.request(method,path,body=None if body is None else json.dumps(body),headers=headers)
+    response = conn.getresponse()
+    result = response.status, json.loads(response.read())
+    conn.close()
+    return result
+
+def test_content_type(serve):
+    server = serve()
+    for kind in (None,'text/plain','application/x-www-form-urlencoded'):
+        status, body = call(server,'POST','/page',{'image': ''},kind)
+        assert status == 415
+    status, body = call(server,'POST','/page',{'image': ''},'application/json; charset=utf-8')
+    assert status == 400
+
+def test_no_paths(serve, tmp_path):
+    server = serve()
+    makePage(str(tmp_path / 'page.png'))
+    status, body = call(server,'POST','/page',{'path': str(tmp_path / 'page.png')})
+    assert status == 403
+    assert not os.path.exists(tmp_path / 'page.hocr')
+
+@pytest.fixture
+def root(tmp_path):
+    (tmp_path / 'root').mkdir()
+    (tmp_path / 'other').mkdir()
+    makePage(str(tmp_path / 'root' / 'page.png'))
+    makePage(str(tmp_path / 'other' / 'page.png'))
+    os.symlink(tmp_path / 'other' / 'page.png',tmp_path / 'root' / 'link.png')
+    return tmp_path
+
+def test_root_paths(serve, root):
+    server = serve('--serve-root',str(root / 'root'))
+
+    for path in ('../other/page.png',str(root / 'other' / 'page.png'),'link.png'):
+        status, body = call(server,'POST','/page',{'path': path})
+        assert status == 403, path
+    assert not os.path.exists(root / 'other' / 'page.hocr')
+
+    status, body = call(server,'POST','/page',{'path': 'page.png'})
+    assert status == 200
+    #done in place, like '-f'
+    with open(root / 'root' / 'page.hocr') as f:
+        assert body['hocr'] == f.read()
+    status, body = call(server,'POST','/page',{'path': 'nothing.png'})
+    assert status == 400
+
+def test_unreadable_image(serve, tmp_path):
+    server = serve('--serve-root',str(tmp_path))
+    (tmp_path / 'junk.png').write_bytes(b'not an image')
+    status, body = call(server,'POST','/page',{'path': 'junk.png'})
+    assert status == 400 and body['error'].startswith('cannot read image')
+    #a png header with nothing behind it gets as far as the engine
+    junk = base64.b64encode(b'\x89PNG\r\n\x1a\n' + b'\x00' * 64).decode()
+    status, body = call(server,'POST','/page',{'image': junk,'name': 'page.png'})
+    assert status == 400 and body['error'].startswith('cannot read image')
+    assert server.service.health()['failed'] == 2
+
+def upload(path, options=None):
+    with open(path,'rb') as f:
+        image = base64.b64encode(f.read()).decode()
+    with open(path.rsplit('.', 1)[0] + '.hocr') as f:
+        hocr = f.read()
+
+    return {'image': image, 'hocr': hocr, 'name': os.path.basename(path),
+        'options': options or {}}
+
+def test_health(serve):
+    server = serve('-j','2')
+    status, body = call(server,'GET','/health')
+    assert status == 200
+    assert body['status'] == 'ok' and body['engine'] == 'stub'
+    assert body['version'] == ocrengine.stub_engine().version()
+    assert body['workers'] == 2
+    assert (body['waiting'],body['running'],body['done'],body['failed']) == (0,0,0,0)
+    assert call(server,'GET','/nothing')[0] == 404
+    assert call(server,'POST','/nothing',{})[0] == 404
+
+@pytest.mark.parametrize('options', [{}, {'montage': True, 'conf': 30}, {'words': True}])
+def test_page(serve, tmp_path, options):
+    server = serve()
+    ifile = str(tmp_path / 'page.png')
+    makePage(ifile,1,hocr=True)
+    request = upload(ifile,options)
+
+    #the same page done locally with the same options
+    args = hocrmod.pageOptions(engine='stub',**options)
+    expected = hocrmod.processPage(ifile,args)
+    with open(expected.hocr_file) as f:
+        expected_hocr = f.read()
+
+    status, body = call(server,'POST','/page',request)
+    assert status == 200
+    assert body['hocr'] == expected_hocr
+    assert body['lines'] == expected.lines > 0
+    assert body['candidates'] == expected.candidates
+    assert body['metrics'] is None and body['seconds'] > 0
+
+    #no base hocr, the engine does the whole page
+    del request['hocr']
+    status, body = call(server,'POST','/page',request)
+    assert status == 200 and 'ocrx_word' in body['hocr']
+    assert call(server,'GET','/health')[1]['done'] == 2
+
+def test_page_errors(serve, tmp_path, monkeypatch):
+    server = serve()
+    ifile = str(tmp_path / 'page.png')
+    makePage(ifile,hocr=True)
+    request = upload(ifile)
+
+    for bad in ({'image': '!!'},{'options': {'nope': 1}},{'image': request['image'],
+        'options': {'conf': 'x'}},{'image': request['image'],'options': {'montage': 1}},
+        {'image': request['image'],'options': {'engine': 'tesseract'}},[1]):
+        status, body = call(server,'POST','/page',bad)
+        assert status == 400, bad
+    conn = http.client.HTTPConnection('127.0.0.1',server.server_address[1])
+    conn.request('POST','/page',body=b'{bad',headers={'Content-Type': 'application/json'})
+    assert conn.getresponse().status == 400
+    conn.close()
+
+    #nothing waits once the queue is full
+    monkeypatch.setattr(hocrserver,'MAX_WAITING',0)
+    status, body = call(server,'POST','/page',request)
+    assert status == 503
+    health = call(server,'GET','/health')[1]
+    assert health['busy'] == 1 and health['done'] == 0
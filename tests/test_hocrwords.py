@@ -0,0 +1,105 @@
+"""
+test_hocrwords.py - the word columns against word-at-a-time reference code
+"""
+
+import xml.etree.ElementTree as ET
+import numpy as np
+import pytest
+import hocrwords
+
+PAGE = ('<html xmlns="http://www.w3.org/1999/xhtml"><body>'
+    '<div class="ocr_page" id="page_1" title="bbox 0 0 800 1000">'
+    '<div class="ocr_carea" id="block_1_1">'
+    '<p class="ocr_par" id="par_1_1" title="bbox 10 10 300 60">'
+    '<span class="ocrx_word" id="word_1_0" title="bbox 5 5 8 8; x_wconf 50">early</span>'
+    '<span class="ocr_line" id="line_1_1" title="bbox 10 10 300 60; baseline 0 -5">'
+    '<span class="ocrx_word" id="word_1_1" title="bbox 10 10 120 60; x_wconf 91">one</span>'
+    '<span class="ocrx_word" id="word_1_2" title="bbox 130 10 300 60; x_wconf 12">  </span>'
+    '<span class="ocrx_word" id="word_1_3" title="bbox 130 10 300 60">p7</span>'
+    '</span></p></div>'
+    '<p class="ocr_par" id="par_1_2" title="bbox 10 900 80 950">'
+    '<span class="ocr_line" id="line_1_2" title="bbox 10 900 80 950">'
+    '<span class="ocrx_word" id="word_1_4" title="bbox 10 900 80 950; x_wconf 77">two</span>'
+    '</span></p>'
+    '<!-- START HOCRMOD -->'
+    '<div class="ocr_carea" id="block_1_2"><p class="ocr_par" id="par_1_3">'
+    '<span class="ocr_line" id="line_1_3" title="bbox 1 2 3 4">'
+    '<span class="ocrx_word" id="word_1_5" title="bbox 1 2 3 4; x_wconf 60">new</span>'
+    '</span></p></div><!-- END HOCRMOD -->'
+    '<span class="ocrx_word" id="word_1_6" title="bbox 1 1 2 2">loose</span>'
+    '</div></body></html>')
+
+""" cleanhocr.py's box arithmetic before the columns, one word at a time """
+def calcBoxLimit(low_x, low_y, high_x, high_y, box):
+    x0, y0, x1, y1 = box
+
+    if low_x == 0 or x0 < low_x:
+        low_x = x0
+    if low_y == 0 or y0 < low_y:
+        low_y = y0
+    if high_x == 0 or x1 > high_x:
+        high_x = x1
+    if high_y == 0 or y1 > high_y:
+        high_y = y1
+
+    return low_x, low_y, high_x, high_y
+
+""" boxes for each run the old way """
+def loopLimits(bbox,runs):
+    out = []
+
+    for i in range(len(runs)):
+        if i == 0 or runs[i] != runs[i - 1]:
+            out.append((0,0,0,0))
+        out[-1] = calcBoxLimit(*out[-1],bbox[i])
+
+    return np.array(out,dtype=np.int64).reshape(-1,4)
+
+def test_page_columns():
+    words = hocrwords.pageWords(ET.fromstring(PAGE))
+    assert [words.text(i) for i in range(len(words))] == ['early','one','p7','two','new']
+    assert words.conf.tolist() == [50,91,-1,77,60]
+    assert words.digits.tolist() == [False,False,True,False,False]
+    assert words.bbox[1].tolist() == [10,10,120,60]
+    assert words.block_ids == ['block_1_1','block_1_2']
+    assert words.block.tolist() == [0,0,0,-1,1]
+    assert words.par_ids == ['par_1_1','par_1_2','par_1_3']
+    assert words.par.tolist() == [0,0,0,1,2]
+    assert words.page_ids == ['page_1']
+    assert words.page.tolist() == [0,0,0,0,0]
+    #a word before any line gets the None entry
+    assert words.lines[words.line[0]] is None
+    assert words.lines[words.line[1]] == ' baseline 0 -5'
+    assert words.keep(60).tolist() == [1,3,4]
+    assert words.keep(60,number=True).tolist() == [1,2,3,4]
+    assert not words.inserted.any()
+
+def test_inserted_flags():
+    builder = hocrwords.hocrmod_builder()
+    root = ET.fromstring(PAGE,parser=ET.XMLParser(target=builder))
+    words = hocrwords.pageWords(root,added=builder.added)
+    assert words.inserted.tolist() == [False,False,False,False,True]
+    #comments still stay out of the tree
+    assert all(isinstance(elem.tag,str) for elem in root.iter())
+
+def test_run_ids():
+    codes = hocrwords.stringCodes(['a','a','b',None,None,'a','b','b'])
+    assert codes.tolist() == [0,0,1,2,2,0,1,1]
+    assert hocrwords.runIds(codes).tolist() == [0,0,1,2,2,3,4,4]
+    assert hocrwords.runIds(np.zeros(0,dtype=np.int64)).tolist() == []
+    assert hocrwords.runIds(np.array([5])).tolist() == [0]
+
+def test_box_limits_edges():
+    bbox = np.array([[5,6,7,8],[0,2,9,9],[3,0,4,4],[1,1,1,1]],dtype=np.int64)
+    runs = np.array([0,0,0,1])
+    assert hocrwords.boxLimits(bbox,runs).tolist() == loopLimits(bbox,runs).tolist()
+    assert hocrwords.boxLimits(np.zeros((0,4),dtype=np.int64),np.zeros(0)).shape == (0,4)
+
+@pytest.mark.parametrize('seed', range(100))
+def test_box_limits_random(seed):
+    rng = np.random.default_rng(seed)
+    n = int(rng.integers(1,60))
+    #small coordinates so zeros (which restart the low end) turn up often
+    bbox = rng.integers(0,4,size=(n,4)).astype(np.int64)
+    runs = hocrwords.runIds(rng.integers(0,3,size=n))
+    assert hocrwords.boxLimits(bbox,runs).tolist() == loopLimits(bbox,runs).tolist()
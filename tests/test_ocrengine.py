@@ -0,0 +1,184 @@
+"""
+test_ocrengine.py - worker processes and the hocr cache, with the stub engine standing in for Tesseract
+"""
+
+import concurrent.futures, os, time
+import numpy as np
+import pytest
+import ocrengine
+
+""" white image with a few dark bars, each one a line of stub words """
+def makeImage(seed, h=80, w=120):
+    rng = np.random.default_rng(seed)
+    image = np.full((h,w),255,dtype=np.uint8)
+    for _ in range(int(rng.integers(1,4))):
+        y = int(rng.integers(0,h - 10))
+        x = int(rng.integers(0,w - 30))
+        image[y:y + int(rng.integers(2,8)),x:x + int(rng.integers(5,30))] = 0
+
+    return image
+
+@pytest.fixture
+def workers():
+    engine = ocrengine.worker_engine(2,'stub')
+    yield engine
+    engine.close()
+
+def test_worker_warm(workers):
+    stub = ocrengine.stub_engine()
+    image = makeImage(0)
+    assert workers.ocr(image,'eng','') == stub.ocr(image,'eng','')
+    procs = [proc.pid for proc, conn in workers.procs]
+    assert len(procs) == 2
+
+    #the same processes answer every image for a combination
+    for seed in range(10):
+        workers.ocr(makeImage(seed),'eng','')
+    assert [proc.pid for proc, conn in workers.procs] == procs
+    #a new combination gets its own
+    workers.ocr(image,'fra','--psm 6')
+    assert len(workers.procs) == 4
+    assert workers.version('eng','') == stub.version()
+
+def test_worker_replaced(workers):
+    image = makeImage(1)
+    expected = workers.ocr(image,'eng','')
+    for proc, conn in workers.procs:
+        proc.kill()
+        proc.join()
+
+    #each dead worker fails the image it was given, then a new one takes its place
+    failed = 0
+    for i in range(4):
+        try:
+            assert workers.ocr(image,'eng','') == expected
+        except (EOFError, OSError):
+            failed += 1
+    assert failed == 2
+    assert len(workers.procs) == 2
+    assert all(proc.is_alive() for proc, conn in workers.procs)
+
+def test_worker_order(workers):
+    stub = ocrengine.stub_engine()
+    images = [makeImage(seed) for seed in range(24)]
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=4) as pool:
+        jobs = [pool.submit(workers.ocr,image,'eng','') for image in images]
+        results = [job.result() for job in jobs]
+
+    assert results == [stub.ocr(image,'eng','') for image in images]
+
+def test_worker_names():
+    engine = ocrengine.getEngine('worker:stub',3)
+    assert isinstance(engine,ocrengine.worker_engine)
+    assert engine.inner == 'stub' and engine.size == 3
+    assert ocrengine.getEngine('worker:stub',3) is engine
+    assert ocrengine.getEngine('worker:stub',2) is not engine
+    assert ocrengine.getEngine('worker',3).inner is None
+    ocrengine.closeEngines()
+
+""" stub engine that counts the images it was asked to do """
+class counting_engine(ocrengine.stub_engine):
+    def __init__(self):
+        super().__init__()
+        self.calls = 0
+
+    def ocr(self, image, lang, args):
+        self.calls += 1
+        return super().ocr(image,lang,args)
+
+def cacheFiles(cdir, ext='.hocr'):
+    return sorted(os.path.join(root,name) for root, dirs, names in os.walk(cdir)
+        for name in names if name.endswith(ext))
+
+def test_cache_hits(tmp_path):
+    engine = counting_engine()
+    cache = ocrengine.cache_engine(engine,str(tmp_path),1 << 20)
+    image = makeImage(2)
+
+    result, hit, evicted = cache.fetch(image,'eng','')
+    assert result == engine.ocr(image,'eng','') and not hit and evicted == 0
+    engine.calls = 0
+    assert cache.fetch(image,'eng','') == (result,True,0)
+    #anything that changes the hocr is a different entry
+    cache.fetch(image,'fra','')
+    cache.fetch(image,'eng','--psm 6')
+    cache.fetch(makeImage(3),'eng','')
+    assert engine.calls == 3
+    assert cache.counts() == {'hits': 1, 'misses': 4, 'evicted': 0}
+    assert len(cacheFiles(str(tmp_path))) == 4
+
+    #a fresh cache on the same directory picks up where this one left off
+    again = ocrengine.cache_engine(counting_engine(),str(tmp_path),1 << 20)
+    assert again.fetch(image,'eng','') == (result,True,0)
+    assert again.engine.calls == 0
+
+def test_cache_counter(tmp_path):
+    cache = ocrengine.cache_engine(ocrengine.stub_engine(),str(tmp_path),1 << 20)
+    page = counting_engine()
+    counter = cache.counter(page)
+    image = makeImage(4)
+    counter.ocr(image,'eng','')
+    counter.ocr(image,'eng','')
+    cache.ocr(image,'eng','')
+    #misses go to the page's engine, the page only sees its own counts
+    assert page.calls == 1
+    assert counter.counts() == {'hits': 1, 'misses': 1, 'evicted': 0}
+    assert cache.counts() == {'hits': 2, 'misses': 1, 'evicted': 0}
+
+def test_cache_evicted_after_read(tmp_path, monkeypatch):
+    cache = ocrengine.cache_engine(counting_engine(),str(tmp_path),1 << 20)
+    image = makeImage(5)
+    result = cache.ocr(image,'eng','')
+
+    #the entry goes between reading it and touching it
+    def gone(path, *args, **kwargs):
+        raise FileNotFoundError(path)
+    monkeypatch.setattr(ocrengine.os,'utime',gone)
+    assert cache.fetch(image,'eng','') == (result,True,0)
+    assert cache.engine.calls == 1
+
+def test_cache_eviction(tmp_path):
+    engine = counting_engine()
+    images = [makeImage(seed) for seed in range(6)]
+    size = len(engine.ocr(images[0],'eng',''))
+    #room for about three entries
+    cache = ocrengine.cache_engine(engine,str(tmp_path),int(size * 3.5))
+
+    #three entries, a second apart
+    now = time.time()
+    for i, image in enumerate(images[:3]):
+        cache.ocr(image,'eng','')
+        path = cache.entryPath(ocrengine.cacheKey(image,'eng','',engine.version()))
+        os.utime(path,(now - 100 + i,now - 100 + i))
+    #using the first one makes the second the oldest
+    cache.ocr(images[0],'eng','')
+    result, hit, evicted = cache.fetch(images[3],'eng','')
+    assert not hit and evicted > 0
+    assert cache.counts()['evicted'] == evicted
+
+    engine.calls = 0
+    assert cache.fetch(images[0],'eng','')[1]
+    assert not cache.fetch(images[1],'eng','')[1]
+    assert engine.calls == 1
+    total = sum(os.path.getsize(path) for path in cacheFiles(str(tmp_path)))
+    assert total <= cache.max_bytes
+
+def test_cache_stale_tmp(tmp_path):
+    engine = counting_engine()
+    image = makeImage(6)
+    size = len(engine.ocr(image,'eng',''))
+    cache = ocrengine.cache_engine(engine,str(tmp_path),int(size * 1.5))
+
+    #temp files from writers that died, one long ago and one that may still be going
+    os.makedirs(tmp_path / 'ab')
+    old, new = str(tmp_path / 'ab' / 'old.tmp'), str(tmp_path / 'ab' / 'new.tmp')
+    for path in (old,new):
+        with open(path,'wb') as f:
+            f.write(b'x' * 10)
+    past = time.time() - ocrengine.STALE_TMP - 60
+    os.utime(old,(past,past))
+
+    cache.ocr(image,'eng','')
+    cache.ocr(makeImage(7),'eng','')
+    assert not os.path.exists(old) and os.path.exists(new)
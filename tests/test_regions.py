@@ -0,0 +1,148 @@
+"""
+test_regions.py - region finding, scoring and placement against the simpler code they replaced
+"""
+
+import random
+import cv2
+import numpy as np
+import pytest
+import hocrmod
+
+""" white page with dark bars for lines of text and a couple of rules """
+def makePage(seed, h=700, w=520):
+    rng = np.random.default_rng(seed)
+    page = np.full((h,w),235,dtype=np.uint8)
+    page += rng.integers(0,20,size=(h,w),dtype=np.uint8)
+    for _ in range(int(rng.integers(8,20))):
+        x = int(rng.integers(0,w - 60))
+        y = int(rng.integers(0,h - 20))
+        cv2.rectangle(page,(x,y),(x + int(rng.integers(20,200)),y + int(rng.integers(4,14))),
+            int(rng.integers(0,60)),-1)
+    cv2.line(page,(10,h // 2),(w - 10,h // 2),0,2)
+
+    return page
+
+""" random x,y,w,h rects on a page, some too small or too thin to be kept """
+def makeRects(seed, h, w, n=300):
+    rng = np.random.default_rng(seed)
+    rects = []
+    for _ in range(n):
+        x = int(rng.integers(0,w - 1))
+        y = int(rng.integers(0,h - 1))
+        rects.append((x,y,int(rng.integers(1,w - x + 1)),int(rng.integers(1,h - y + 1))))
+
+    return rects
+
+@pytest.mark.parametrize('seed', range(4))
+@pytest.mark.parametrize('reduce, dpi', [(False,300), (True,600)])
+def test_banded_regions(monkeypatch, seed, reduce, dpi):
+    page = makePage(seed)
+    monkeypatch.setattr(hocrmod,'DETECT_BAND',100000)
+    whole = hocrmod.findRegions(page,reduce,dpi)
+    for band in (7,64,333):
+        monkeypatch.setattr(hocrmod,'DETECT_BAND',band)
+        assert hocrmod.findRegions(page,reduce,dpi) == whole
+
+@pytest.mark.parametrize('seed', range(4))
+@pytest.mark.parametrize('band', [7,64,256,100000])
+def test_region_scores(monkeypatch, seed, band):
+    page = makePage(seed)
+    h, w = page.shape
+    boxes = np.array([[40,40,200,80],[300,500,420,560]],dtype=np.int64)
+    tmask = hocrmod.text_mask(boxes,page.shape,2)
+    rects = makeRects(seed,h,w) + [(40,40,160,40)]
+    monkeypatch.setattr(hocrmod,'SCORE_BAND',band)
+    scores = hocrmod.scoreRegions(page,rects,tmask,300)
+
+    #white pixels counted region by region on one thresholded page
+    ret, th = cv2.threshold(page,0,1,cv2.THRESH_BINARY+cv2.THRESH_TRIANGLE)
+    r = np.array(rects,dtype=np.int64)
+    rw, rh = r[:,2], r[:,3]
+    keep = rw * rh >= hocrmod.MIN_REGION_AREA
+    keep &= np.maximum(rw,rh) <= hocrmod.MAX_ASPECT * np.minimum(rw,rh)
+    keep &= tmask.coverage(r) < hocrmod.MAX_COVERED
+    white = np.array([cv2.countNonZero(th[y:y + rh_,x:x + rw_])
+        for x, y, rw_, rh_ in rects],dtype=np.int64)
+    expected = np.round(white / (rw * rh) * 100,1)
+    expected[~keep] = 0.0
+
+    assert scores == expected.tolist()
+    #the last one sits right on a recognized box
+    assert scores[-1] == 0.0
+
+def test_text_mask():
+    boxes = np.array([[10,10,50,30],[45,20,80,60],[5,5,5,40],[90,0,120,10]],dtype=np.int64)
+    mask = hocrmod.text_mask(boxes,(70,110),3)
+
+    #what the original blocking out drew, box by box
+    expected = np.zeros((70,110),dtype=np.uint8)
+    for x0, y0, x1, y1 in boxes:
+        if x1 > x0 and y1 > y0:
+            cv2.rectangle(expected,(int(x0) - 3,int(y0) - 3),(int(x1) + 3,int(y1) + 3),255,-1)
+    assert np.array_equal(mask.mask,expected)
+
+    #a second mask on the same thread leaves the first alone
+    other = hocrmod.text_mask(np.array([[0,0,5,5]],dtype=np.int64),(70,110),0)
+    assert np.array_equal(mask.mask,expected)
+    assert not np.shares_memory(mask.mask,other.mask)
+    assert mask.overlaps(0,0,12,12) and not mask.overlaps(0,50,20,70)
+
+def test_work_buffers():
+    small = hocrmod.workBuffer('test',(10,10))
+    small[:] = 7
+    again = hocrmod.workBuffer('test',(5,4),np.int32)
+    #grow only, the same memory comes back for anything that fits
+    assert again.shape == (5,4) and again.dtype == np.int32
+    assert np.shares_memory(small,again)
+    bigger = hocrmod.workBuffer('test',(20,20))
+    assert not np.shares_memory(small,bigger)
+    hocrmod.releaseBuffers()
+    assert not np.shares_memory(bigger,hocrmod.workBuffer('test',(20,20)))
+    hocrmod.releaseBuffers()
+
+""" missed paragraphs of random words, one wident per paragraph """
+def makeParagraphs(rng):
+    par_regions = []
+    for p in range(rng.randint(0,8)):
+        regions = []
+        for _ in range(rng.randint(1,4)):
+            x, y = rng.randint(0,50), rng.randint(0,50)
+            regions.append(hocrmod.word_region(hocrmod.page_region(x,y,x + 5,y + 5),
+                'p%d' % p,'w','',90))
+        par_regions.append(regions)
+
+    return par_regions
+
+""" the nested scans region_index replaced, a paragraph goes in before the first block
+    that starts after any of its words, in the order the words come up """
+def oldPlacement(par_regions, blocks):
+    added = set()
+    placed = []
+
+    def group(wident):
+        added.add(wident)
+        return [r for regions in par_regions for r in regions if r.wident == wident]
+
+    for x0, y0 in blocks:
+        found = []
+        for regions in par_regions:
+            for r in regions:
+                if x0 > r.wregion.x0 or (x0 == r.wregion.x0 and y0 > r.wregion.y0):
+                    if r.wident not in added:
+                        found.append(group(r.wident))
+        placed.append(found)
+    placed.append([group(r.wident) for regions in par_regions for r in regions
+        if r.wident not in added])
+
+    return placed
+
+@pytest.mark.parametrize('seed', range(200))
+def test_region_index(seed):
+    rng = random.Random(seed)
+    par_regions = makeParagraphs(rng)
+    blocks = [(rng.randint(0,60),rng.randint(0,60)) for _ in range(rng.randint(0,6))]
+
+    rindex = hocrmod.region_index(par_regions)
+    placed = [rindex.before(x0,y0) for x0, y0 in blocks] + [rindex.remaining()]
+
+    assert placed == oldPlacement(par_regions,blocks)